@@ -1,21 +1,3511 @@
 import tkinter as tk
 from tkinter import Menu
-import win32api
-import win32con
-import win32gui
-import win32process
+try:
+    import win32api
+    import win32con
+    import win32gui
+    import win32process
+except ImportError:
+    # 非Windows环境（如在Linux上用回放记录测试跟踪流程）
+    win32api = win32con = win32gui = win32process = None
 import time
 import logging
 import os
 import datetime
 import sqlite3
-from collections import deque
+import threading
+import queue
+import re
+import bisect
+import ctypes
+import json
+import heapq
+import itertools
+import getpass
+import hashlib
+import argparse
+import struct
+import pathlib
+import zlib
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+from collections import OrderedDict, namedtuple
+from array import array
 import gc
 
-class CapsLockChecker:
-    def __init__(self, root):
+
+class DatabaseManager:
+    """SQLite长连接管理器 - 每个数据库文件只打开一次连接，避免频繁打开文件带来的卡顿"""
+
+    # 每个连接打开后执行的PRAGMA设置
+    CONNECTION_PRAGMAS = (
+        'PRAGMA auto_vacuum=INCREMENTAL',  # 新数据库使用增量回收，删除数据后可分批归还空闲页（已有数据库需VACUUM一次才生效）
+        'PRAGMA journal_mode=WAL',  # WAL模式：读写互不阻塞，提交时无需重写整个回滚日志
+        'PRAGMA synchronous=NORMAL',  # WAL模式下NORMAL即可保证数据库一致性，减少fsync次数
+        'PRAGMA cache_size=-8000',  # 页缓存约8MB（负数表示KB）
+        'PRAGMA temp_store=MEMORY',  # 临时表和排序放在内存中
+    )
+    # 只读连接只设置不修改数据库文件的PRAGMA（日志模式由写入方设置，保存在数据库文件中）
+    READ_ONLY_PRAGMAS = (
+        'PRAGMA cache_size=-8000',
+        'PRAGMA temp_store=MEMORY',
+    )
+    # 每个连接缓存的预编译语句数量
+    CACHED_STATEMENTS = 128
+
+    def __init__(self, logger=None, read_only=False):
+        """
+        Args:
+            read_only: 以只读方式打开数据库（客户端模式的界面，数据库由跟踪服务写入）
+        """
+        self.logger = logger or logging.getLogger(__name__)
+        self.read_only = read_only
+        self._connections = {}  # {数据库路径: sqlite3.Connection}
+
+    def get_connection(self, db_path):
+        """获取指定数据库文件的长连接，首次使用时创建并设置PRAGMA"""
+        conn = self._connections.get(db_path)
+        if conn is None:
+            # cached_statements: sqlite3按SQL文本缓存预编译语句，参数化查询可直接复用
+            if self.read_only:
+                uri = pathlib.Path(os.path.abspath(db_path)).as_uri() + '?mode=ro'
+                conn = sqlite3.connect(uri, uri=True, cached_statements=self.CACHED_STATEMENTS)
+            else:
+                conn = sqlite3.connect(db_path, cached_statements=self.CACHED_STATEMENTS)
+            for pragma in (self.READ_ONLY_PRAGMAS if self.read_only else self.CONNECTION_PRAGMAS):
+                conn.execute(pragma)
+            self._connections[db_path] = conn
+            self.logger.debug(f"数据库连接已建立: {db_path}")
+        return conn
+
+    def close_all(self):
+        """关闭所有连接，关闭前执行PRAGMA optimize更新查询统计信息"""
+        for db_path, conn in list(self._connections.items()):
+            try:
+                if not self.read_only:
+                    conn.execute('PRAGMA optimize')
+                conn.close()
+                self.logger.debug(f"数据库连接已关闭: {db_path}")
+            except Exception as e:
+                self.logger.error(f"关闭数据库连接时出错 ({db_path}): {e}")
+        self._connections.clear()
+
+
+class DatabaseWriter(threading.Thread):
+    """
+    后台数据库写入线程 - 通过队列接收写操作并分组提交（group commit）
+    UI线程只负责入队，不再等待INSERT和COMMIT（fsync）完成
+    """
+
+    def __init__(self, logger=None, batch_size=200, batch_interval=0.5):
+        """
+        Args:
+            batch_size: 单次提交最多包含的写操作数量
+            batch_interval: 收到第一条写操作后最多等待多少秒再提交
+        """
+        super().__init__(name="DatabaseWriter", daemon=True)
+        self.logger = logger or logging.getLogger(__name__)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self._queue = queue.Queue()
+        # 写线程独占自己的连接，与UI线程的只读连接在WAL模式下互不阻塞
+        self._db_manager = DatabaseManager(self.logger)
+        self._stopped = threading.Event()
+        # 检查_stopped与入队在同一把锁内完成，避免stop()排空队列后才入队的写操作丢失
+        self._lock = threading.Lock()
+        self._maintenance_conn = None  # 正在执行维护语句的连接，stop()时中断
+        # 统计信息
+        self.commit_count = 0
+        self.unit_count = 0
+
+    def submit(self, db_path, statements, on_commit=None):
+        """
+        提交一组写操作，同一组内的语句保证在同一个事务中执行
+        Args:
+            db_path: 数据库文件路径
+            statements: [(sql, [params, ...]), ...]，params列表为None时按无参数语句执行一次
+            on_commit: 这组写操作提交到数据库后调用（在写入线程中调用，应只做简单的赋值）
+        """
+        with self._lock:
+            if not self._stopped.is_set():
+                self._queue.put(('write', db_path, (statements, on_commit)))
+                return
+        # 写线程已停止（程序退出后仍有写入），等写线程把之前的写操作提交完，再在调用线程同步写入，避免数据丢失
+        self.logger.warning("写入线程已停止，改为同步写入数据库")
+        if self.is_alive():
+            self.join()
+        self._write_units_sync(db_path, statements, on_commit)
+
+    def submit_one(self, db_path, sql, params):
+        """提交单条写操作"""
+        self.submit(db_path, [(sql, [params])])
+
+    def submit_maintenance(self, db_path, statements):
+        """
+        提交需要在事务之外执行的维护语句（如VACUUM、PRAGMA incremental_vacuum），在之前提交的写操作之后执行
+        stop()时中断正在执行的维护语句并跳过剩余的，维护语句可以在下次启动时重新执行，不拖延退出
+        Args:
+            statements: [sql, ...]
+        """
+        with self._lock:
+            if not self._stopped.is_set():
+                self._queue.put(('maintenance', db_path, statements))
+
+    def commit_event(self):
+        """不等待地请求确认：返回的Event在此前提交的写操作全部提交到数据库后被设置"""
+        done = threading.Event()
+        with self._lock:
+            if self.is_alive() and not self._stopped.is_set():
+                self._queue.put(('flush', done, None))
+                return done
+        if self.is_alive():
+            # 已请求停止：写线程退出前会提交队列中的全部写操作
+            self.join()
+        done.set()
+        return done
+
+    def flush(self, timeout=None):
+        """等待队列中已提交的写操作全部提交到数据库"""
+        return self.commit_event().wait(timeout)
+
+    def stop(self, timeout=10):
+        """
+        停止写入线程，停止前保证队列中所有写操作已提交
+        Returns:
+            bool: 写入线程是否已结束（超时仍在提交时返回False，队列中的写操作可能随进程退出丢失）
+        """
+        with self._lock:
+            # 先置位再放入停止标记：之后的submit不再入队，停止标记一定是队列中的最后一项
+            self._stopped.set()
+            alive = self.is_alive()
+            if alive:
+                self._queue.put(('stop', None, None))
+            if self._maintenance_conn is not None:
+                # 中断耗时的维护语句（如整理大数据库的VACUUM），之后排队的写操作照常提交
+                self._maintenance_conn.interrupt()
+        if alive:
+            self.join(timeout)
+        if self.is_alive():
+            self.logger.warning(f"数据库写入线程在 {timeout} 秒内未结束，队列中的写操作可能未提交")
+            return False
+        self.logger.info(f"数据库写入线程已停止 - 提交次数: {self.commit_count}, 写操作数: {self.unit_count}")
+        return True
+
+    def run(self):
+        while True:
+            kind, arg, statements = self._queue.get()
+            batch = []
+            waiters = []
+            maintenance = None
+            stop_requested = False
+            deadline = time.monotonic() + self.batch_interval
+            # 收集一批写操作：达到数量上限或等待超时即提交
+            while True:
+                if kind == 'write':
+                    batch.append((arg, *statements))
+                elif kind == 'flush':
+                    waiters.append(arg)
+                    break
+                elif kind == 'maintenance':
+                    maintenance = (arg, statements)
+                    break
+                elif kind == 'stop':
+                    stop_requested = True
+                    break
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    kind, arg, statements = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._commit_batch(batch)
+            if maintenance:
+                self._run_maintenance(*maintenance)
+            for waiter in waiters:
+                waiter.set()
+            if stop_requested:
+                # 停止标记之后不会再有新写入入队，这里只是防御性地排空队列
+                remaining_batch = []
+                while True:
+                    try:
+                        kind, arg, statements = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if kind == 'write':
+                        remaining_batch.append((arg, *statements))
+                    elif kind == 'flush':
+                        arg.set()
+                if remaining_batch:
+                    self._commit_batch(remaining_batch)
+                # 连接由写线程创建，必须在写线程内关闭
+                self._db_manager.close_all()
+                return
+
+    def _commit_batch(self, batch):
+        """按数据库分组，每个数据库一个事务提交整批写操作"""
+        units_by_db = {}
+        for db_path, statements, on_commit in batch:
+            units_by_db.setdefault(db_path, []).append((statements, on_commit))
+
+        for db_path, units in units_by_db.items():
+            try:
+                conn = self._db_manager.get_connection(db_path)
+                with conn:
+                    for statements, _ in units:
+                        self._execute_statements(conn, statements)
+                self.commit_count += 1
+                self.unit_count += len(units)
+            except Exception as e:
+                # 整批失败时逐组重试，避免一条错误数据拖累同批的其他写入
+                self.logger.error(f"批量写入数据库失败，改为逐组重试 ({db_path}): {e}")
+                for statements, on_commit in units:
+                    self._write_units(self._db_manager, db_path, statements, on_commit)
+                continue
+            for _, on_commit in units:
+                self._committed(on_commit)
+
+    def _committed(self, on_commit):
+        """调用提交回调，回调出错不影响写入线程"""
+        if on_commit is None:
+            return
+        try:
+            on_commit()
+        except Exception as e:
+            self.logger.error(f"提交回调出错: {e}")
+
+    def _run_maintenance(self, db_path, statements):
+        """在事务之外逐条执行维护语句（executescript执行到完成，execute对incremental_vacuum只回收一页）"""
+        try:
+            conn = self._db_manager.get_connection(db_path)
+            for sql in statements:
+                # 标记与检查_stopped在同一把锁内：stop()之后不再开始新的维护语句，正在执行的由stop()中断
+                with self._lock:
+                    if self._stopped.is_set():
+                        self.logger.info(f"写入线程正在停止，跳过数据库维护 ({db_path}): {sql}")
+                        return
+                    self._maintenance_conn = conn
+                try:
+                    conn.executescript(sql)
+                finally:
+                    with self._lock:
+                        self._maintenance_conn = None
+        except sqlite3.OperationalError as e:
+            if self._stopped.is_set():
+                self.logger.info(f"写入线程正在停止，已中断数据库维护 ({db_path}): {e}")
+            else:
+                self.logger.error(f"数据库维护出错 ({db_path}): {e}")
+        except Exception as e:
+            self.logger.error(f"数据库维护出错 ({db_path}): {e}")
+
+    @staticmethod
+    def _execute_statements(conn, statements):
+        """执行一组语句，params_list为None时表示不带参数的单条语句（如DDL、PRAGMA）"""
+        for sql, params_list in statements:
+            if params_list is None:
+                conn.execute(sql)
+            else:
+                conn.executemany(sql, params_list)
+
+    def _write_units(self, db_manager, db_path, statements, on_commit=None):
+        """在单独事务中执行一组写操作"""
+        try:
+            conn = db_manager.get_connection(db_path)
+            with conn:
+                self._execute_statements(conn, statements)
+            self.commit_count += 1
+            self.unit_count += 1
+        except Exception as e:
+            self.logger.error(f"写入数据库时出错 ({db_path}): {e}")
+            return
+        self._committed(on_commit)
+
+    def _write_units_sync(self, db_path, statements, on_commit=None):
+        """写线程停止后的同步写入"""
+        db_manager = DatabaseManager(self.logger)
+        try:
+            self._write_units(db_manager, db_path, statements, on_commit)
+        finally:
+            db_manager.close_all()
+
+
+class TodayTotals:
+    """
+    今天各应用使用时长的内存累计值
+    启动时从数据库加载一次，之后随每条写入数据库的（合并后的）屏幕时间记录增量更新，统计刷新无需查询数据库
+    同时增量维护按时长降序的排名，时长只增不减，每次更新只需把该应用向前冒泡
+    """
+
+    def __init__(self, day_key, totals=None):
+        self.reset(day_key, totals)
+
+    def reset(self, day_key, totals=None):
+        """重置为指定日期的累计值（用于启动加载和跨越午夜）"""
+        self.day_key = day_key
+        self._totals = dict(totals or {})
+        self._order = sorted(self._totals, key=self._totals.get, reverse=True)
+        self._rank = {app_name: i for i, app_name in enumerate(self._order)}
+
+    def add(self, app_name, seconds):
+        """累加应用时长并调整排名"""
+        if app_name not in self._totals:
+            self._totals[app_name] = 0.0
+            self._rank[app_name] = len(self._order)
+            self._order.append(app_name)
+        self._totals[app_name] += seconds
+
+        total = self._totals[app_name]
+        i = self._rank[app_name]
+        while i > 0 and self._totals[self._order[i - 1]] < total:
+            previous = self._order[i - 1]
+            self._order[i] = previous
+            self._rank[previous] = i
+            i -= 1
+        self._order[i] = app_name
+        self._rank[app_name] = i
+
+    def get(self, app_name):
+        """获取应用今天的累计时长"""
+        return self._totals.get(app_name, 0.0)
+
+    def __len__(self):
+        return len(self._totals)
+
+    def as_dict(self):
+        """返回各应用累计时长的副本"""
+        return dict(self._totals)
+
+    def ranked(self, in_progress=()):
+        """
+        按时长降序返回今天的统计数据
+        Args:
+            in_progress: [(app_name, seconds), ...] 尚未写入的时长（合并器暂存的时间段、当前进行中的会话）
+        Returns:
+            list: [(app_name, seconds), ...]
+        """
+        items = [(app_name, self._totals[app_name]) for app_name in self._order]
+        for app_name, seconds in in_progress:
+            i = next((j for j, item in enumerate(items) if item[0] == app_name), len(items))
+            total = (items.pop(i)[1] if i < len(items) else 0.0) + seconds
+            while i > 0 and items[i - 1][1] < total:
+                i -= 1
+            items.insert(i, (app_name, total))
+        return items
+
+
+class SegmentCoalescer:
+    """
+    窗口切换时间段合并，减少Alt+Tab切换和短暂弹窗产生的大量短记录
+    连续的同一程序时间段合并为一段；短于阈值的时间段并入前一段（没有前一段时并入后一段），
+    合并只改变短时间段的归属，总时长不变。最后一段暂存，确定不会再被合并后才交给emit写入
+    """
+
+    def __init__(self, emit, min_duration=1.0):
+        """
+        Args:
+            emit: 写入函数，参数为(程序名, 开始时间, 结束时间)
+            min_duration: 短时间段阈值（秒），0表示只合并同一程序的连续时间段
+        """
+        self.emit = emit
+        self.min_duration = min_duration
+        self.pending = None  # 暂存的时间段 [程序名, 开始时间, 结束时间]
+        # 统计计数：输入的时间段数、写入的记录数、同程序合并次数、短时间段并入次数
+        self.segment_count = 0
+        self.row_count = 0
+        self.merged_count = 0
+        self.absorbed_count = 0
+
+    def add(self, app_name, start, end):
+        """加入一个结束的时间段（与暂存的时间段首尾相接）"""
+        self.segment_count += 1
+        pending = self.pending
+        if pending is None:
+            self.pending = [app_name, start, end]
+        elif app_name == pending[0]:
+            pending[2] = end
+            self.merged_count += 1
+        elif end - start < self.min_duration:
+            pending[2] = end
+            self.absorbed_count += 1
+        elif pending[2] - pending[1] < self.min_duration:
+            # 暂存的短时间段没有前一段可以并入，并入当前时间段
+            self.pending = [app_name, pending[1], end]
+            self.absorbed_count += 1
+        else:
+            self.flush()
+            self.pending = [app_name, start, end]
+
+    def release(self, current_app, current_start, now):
+        """
+        当前会话是其他程序且已超过阈值时，暂存的时间段不会再被合并，交给emit写入
+        （暂存的是短时间段时继续等待，之后并入当前会话）
+        Args:
+            current_app: 当前进行中的会话的程序名
+            current_start: 当前会话开始时间
+            now: 当前时间
+        """
+        pending = self.pending
+        if (pending and current_app != pending[0] and now - current_start >= self.min_duration
+                and pending[2] - pending[1] >= self.min_duration):
+            self.flush()
+
+    def flush(self):
+        """写入暂存的时间段（跨越午夜和退出时调用）"""
+        if self.pending:
+            pending, self.pending = self.pending, None
+            self.row_count += 1
+            self.emit(*pending)
+
+
+class TimeStreamBuffer:
+    """
+    时间流缓存：尚未写入数据库的时间段，按列保存在定长环形缓冲区中
+    起始时间(int32秒，与数据库start_ts一致)、程序编号(int16，对应app_names)、时长(float32)各占一个array，
+    内存固定为 容量*10 字节，与程序数量无关；缓冲区满时覆盖最早的记录，调用方应在full时及时写入数据库
+    程序名表只保留缓冲区中的记录引用的程序名（清空时重置，超过容量时压缩），程序编号不会超出int16范围
+    """
+
+    def __init__(self, capacity=4096):
+        if not 0 < capacity < 32767:
+            raise ValueError(f"时间流缓存容量超出程序编号(int16)的范围: {capacity}")
+        self.capacity = capacity
+        self.start_times = array('i', [0]) * capacity
+        self.app_ids = array('h', [0]) * capacity
+        self.durations = array('f', [0.0]) * capacity
+        self.app_names = []  # 程序编号 -> 程序名
+        self.app_index = {}  # 程序名 -> 程序编号
+        self.start = 0  # 最早一条记录的位置
+        self.count = 0
+        self.overwritten = 0  # 缓冲区满时被覆盖的记录数
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def full(self):
+        return self.count == self.capacity
+
+    def append(self, app_name, start_ts, duration):
+        """
+        追加一条时间段
+        Args:
+            app_name: 程序名
+            start_ts: 起始时间（整数秒）
+            duration: 时长（秒）
+        """
+        app_id = self.app_index.get(app_name)
+        if app_id is None:
+            if len(self.app_names) >= self.capacity:
+                # 长时间未清空（如客户端显示用的缓存）时，程序名表中大多是已被覆盖的记录的程序名
+                self._compact_app_names()
+            app_id = self.app_index[app_name] = len(self.app_names)
+            self.app_names.append(app_name)
+        if self.count == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+            self.count -= 1
+            self.overwritten += 1
+        i = (self.start + self.count) % self.capacity
+        self.start_times[i] = start_ts
+        self.app_ids[i] = app_id
+        self.durations[i] = duration
+        self.count += 1
+
+    def __iter__(self):
+        """按写入顺序遍历 (起始时间, 程序名, 时长)，直接读取各列，不复制缓冲区"""
+        start_times, app_ids, durations, names = self.start_times, self.app_ids, self.durations, self.app_names
+        capacity, start = self.capacity, self.start
+        for k in range(self.count):
+            i = (start + k) % capacity
+            yield start_times[i], names[app_ids[i]], durations[i]
+
+    def last(self):
+        """最后一条记录，缓冲区为空时返回None"""
+        if not self.count:
+            return None
+        i = (self.start + self.count - 1) % self.capacity
+        return self.start_times[i], self.app_names[self.app_ids[i]], self.durations[i]
+
+    def app_count(self):
+        """缓冲区中出现的程序数量"""
+        return len({app_name for _, app_name, _ in self})
+
+    def _compact_app_names(self):
+        """只保留缓冲区中的记录引用的程序名，并重新编号"""
+        names = []
+        index = {}
+        app_ids, capacity, start = self.app_ids, self.capacity, self.start
+        for k in range(self.count):
+            i = (start + k) % capacity
+            app_name = self.app_names[app_ids[i]]
+            app_id = index.get(app_name)
+            if app_id is None:
+                app_id = index[app_name] = len(names)
+                names.append(app_name)
+            app_ids[i] = app_id
+        self.app_names = names
+        self.app_index = index
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+        self.app_names = []
+        self.app_index = {}
+
+
+class TrackingJournal:
+    """
+    崩溃保护日志：尚未写入数据库的跟踪数据按定长记录追加到二进制文件，异常退出后在下次启动时重放
+    记录类型：程序名（按48字节分段，之后的记录只引用编号）、时间流时间段、当前会话检查点、
+    屏幕时间已提交到数据库的水位线。每条记录带CRC32，断电造成的不完整尾部在重放时丢弃
+    每次追加都直接写入操作系统（进程崩溃不丢失），按间隔fsync（断电最多丢失一个间隔）
+    使用期间独占锁定 path + '.lock'，第二个实例不会重放并删除正在使用的日志
+    """
+    RECORD = struct.Struct('<BxHdd48s')  # 类型、程序编号、两个时间值、程序名分段
+    CRC = struct.Struct('<I')
+    RECORD_SIZE = RECORD.size + CRC.size
+    NAME_CHUNK = 48
+    APP, SEGMENT, SESSION, PERSISTED = 1, 2, 3, 4
+
+    def __init__(self, path, logger=None, fsync_interval=5.0):
+        """
+        Args:
+            path: 日志文件路径，切换文件时旧文件改名为 path + '.old'，写入线程提交后删除
+            fsync_interval: fsync间隔（秒）
+        """
+        self.path = path
+        self.old_path = path + '.old'
+        self.lock_path = path + '.lock'
+        self.lock_fd = None
+        self.logger = logger or logging.getLogger(__name__)
+        self.fsync_interval = fsync_interval
+        self.file = None
+        self.app_index = {}  # 程序名 -> 当前文件中的编号
+        self.session = None  # 最后写入的会话检查点 (程序名, 开始时间, 最后确认时间)
+        self.persisted_until = 0.0  # 屏幕时间水位线
+        self.dirty = False
+        self.last_sync = time.monotonic()
+
+    def replay(self):
+        """
+        读取上次留下的日志文件（先旧文件后新文件）
+        Returns:
+            tuple: (时间流时间段[(程序名, 起始时间, 时长), ...],
+                    会话中水位线之后尚未写入的部分[(程序名, 开始时间, 最后确认时间), ...], 屏幕时间水位线)
+        """
+        segments = []
+        sessions = {}
+        persisted = 0.0
+        for path in (self.old_path, self.path):
+            if os.path.exists(path):
+                persisted = max(persisted, self._read(path, segments, sessions))
+        unpersisted = []
+        for (app, start), seen in sorted(sessions.items()):
+            start = max(start, persisted)
+            if seen > start:
+                unpersisted.append((app, start, seen))
+        return segments, unpersisted, persisted
+
+    def _read(self, path, segments, sessions):
+        """解析一个日志文件，遇到损坏或不完整的记录时丢弃之后的内容"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        names = {}
+        pieces = {}
+        persisted = 0.0
+        size = self.RECORD_SIZE
+        for offset in range(0, len(data) - size + 1, size):
+            body = data[offset:offset + self.RECORD.size]
+            crc, = self.CRC.unpack_from(data, offset + self.RECORD.size)
+            kind, index, a, b, chunk = self.RECORD.unpack(body)
+            # 水位线记录不引用程序名（编号固定为0），可以出现在任何程序名记录之前
+            if zlib.crc32(body) != crc or (kind not in (self.APP, self.PERSISTED) and index not in names):
+                self.logger.warning(f"崩溃保护日志在第 {offset // size} 条记录处不完整，忽略之后的内容: {path}")
+                break
+            if kind == self.APP:
+                pieces.setdefault(index, []).append(chunk)
+                names[index] = b''.join(pieces[index]).rstrip(b'\0').decode('utf-8', 'replace')
+            elif kind == self.SEGMENT:
+                segments.append((names[index], int(a), b))
+            elif kind == self.SESSION:
+                key = (names[index], a)
+                sessions[key] = max(sessions.get(key, b), b)
+            elif kind == self.PERSISTED:
+                persisted = max(persisted, a)
+        return persisted
+
+    def acquire_lock(self):
+        """
+        独占锁定日志，锁在close时释放
+        Returns:
+            bool: 是否成功（另一个进程正在使用日志时返回False）
+        """
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.lock_fd = fd
+        return True
+
+    def release_lock(self):
+        if self.lock_fd is None:
+            return
+        if os.name == 'nt':
+            import msvcrt
+            os.lseek(self.lock_fd, 0, os.SEEK_SET)
+            msvcrt.locking(self.lock_fd, msvcrt.LK_UNLCK, 1)
+        os.close(self.lock_fd)
+        self.lock_fd = None
+
+    def start(self):
+        """重放并补写数据库之后调用：删除旧日志，开始新的日志文件"""
+        if self.file:
+            self.file.close()
+        self._remove_files()
+        self.file = open(self.path, 'wb', buffering=0)
+
+    def _append(self, kind, index, a, b, chunk=b''):
+        body = self.RECORD.pack(kind, index, a, b, chunk)
+        self.file.write(body + self.CRC.pack(zlib.crc32(body)))
+        self.dirty = True
+
+    def _app_id(self, app_name):
+        """返回程序名在当前文件中的编号，首次出现时先写入程序名记录"""
+        index = self.app_index.get(app_name)
+        if index is None:
+            index = self.app_index[app_name] = len(self.app_index)
+            data = app_name.encode('utf-8')
+            for offset in range(0, max(len(data), 1), self.NAME_CHUNK):
+                self._append(self.APP, index, offset, 0.0, data[offset:offset + self.NAME_CHUNK])
+        return index
+
+    def segment(self, app_name, start_ts, duration):
+        """记录一个进入时间流缓存的时间段"""
+        if self.file:
+            self._append(self.SEGMENT, self._app_id(app_name), start_ts, duration)
+
+    def checkpoint(self, app_name, start, seen):
+        """记录会话检查点：程序从start开始一直在前台，至少持续到seen"""
+        self.session = (app_name, start, seen)
+        if self.file:
+            self._append(self.SESSION, self._app_id(app_name), start, seen)
+
+    def persisted(self, end):
+        """记录屏幕时间水位线：end之前的屏幕时间已提交到数据库"""
+        self.persisted_until = max(self.persisted_until, end)
+        if self.file:
+            self._append(self.PERSISTED, 0, end, 0.0)
+
+    def sync(self):
+        """距上次fsync超过间隔且有新记录时把日志刷到磁盘"""
+        if self.file and self.dirty and time.monotonic() - self.last_sync >= self.fsync_interval:
+            os.fsync(self.file.fileno())
+            self.dirty = False
+            self.last_sync = time.monotonic()
+
+    def rotate(self):
+        """
+        时间流缓存交给写入线程后切换到新文件，新文件带上当前会话检查点和水位线
+        Returns:
+            bool: 是否已切换（上一次切换的旧文件尚未删除时不切换）
+        """
+        if not self.file or os.path.exists(self.old_path):
+            return False
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.path, self.old_path)
+        self.file = open(self.path, 'wb', buffering=0)
+        self.app_index = {}
+        self.dirty = False
+        if self.persisted_until:
+            self.persisted(self.persisted_until)
+        if self.session:
+            self.checkpoint(*self.session)
+        return True
+
+    def discard_old(self):
+        """写入线程已提交切换前的数据，删除旧文件"""
+        if os.path.exists(self.old_path):
+            os.remove(self.old_path)
+
+    def close(self, discard=False):
+        """
+        关闭日志文件
+        Args:
+            discard: 是否删除日志文件（正常退出、数据已全部写入数据库时）
+        """
+        if self.file:
+            self.file.close()
+            self.file = None
+        if discard:
+            self._remove_files()
+        self.release_lock()
+
+    def _remove_files(self):
+        for path in (self.old_path, self.path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class ProcessNameCache:
+    """
+    进程名解析结果的LRU缓存
+    以(pid, 进程创建时间)为键，PID被新进程复用时创建时间不同，不会得到旧进程的名称；
+    另外按窗口句柄记录对应的键：窗口存在期间其所属进程必然存活，同一句柄、同一PID可直接命中，无需打开进程句柄
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._names = OrderedDict()  # (pid, 创建时间) -> 进程名
+        self._hwnd_keys = OrderedDict()  # 窗口句柄 -> (pid, 创建时间)
+        # 统计计数
+        self.hits = 0
+        self.hwnd_hits = 0
+        self.misses = 0
+
+    def lookup_hwnd(self, hwnd, pid):
+        """按窗口句柄查找进程名，句柄记录的PID与当前PID一致时命中"""
+        key = self._hwnd_keys.get(hwnd)
+        if key is None or key[0] != pid:
+            return None
+        name = self._names.get(key)
+        if name is None:
+            return None
+        self._hwnd_keys.move_to_end(hwnd)
+        self._names.move_to_end(key)
+        self.hwnd_hits += 1
+        return name
+
+    def get(self, pid, create_time):
+        """按(pid, 创建时间)查找进程名，未命中返回None"""
+        key = (pid, create_time)
+        name = self._names.get(key)
+        if name is None:
+            self.misses += 1
+            return None
+        self._names.move_to_end(key)
+        self.hits += 1
+        return name
+
+    def put(self, pid, create_time, name, hwnd=None):
+        """记录解析结果，超出容量时淘汰最久未使用的条目"""
+        key = (pid, create_time)
+        self._names[key] = name
+        self._names.move_to_end(key)
+        while len(self._names) > self.maxsize:
+            self._names.popitem(last=False)
+        if hwnd is not None:
+            self._hwnd_keys[hwnd] = key
+            self._hwnd_keys.move_to_end(hwnd)
+            while len(self._hwnd_keys) > self.maxsize:
+                self._hwnd_keys.popitem(last=False)
+
+    def __len__(self):
+        return len(self._names)
+
+
+class SoftwareMatcher:
+    """
+    自动大写软件列表（software_list）的匹配器
+    规则写法：普通文本为子串匹配，以“=”开头为完全匹配，以“re:”开头为正则表达式，均不区分大小写
+    子串和完全匹配规则编译为一个正则表达式一次匹配；“re:”规则各自单独编译，按规则顺序匹配
+    （合并后内联标志、同名分组和编号反向引用会失效或出错）。程序名或窗口标题命中任一规则即需要大写
+    匹配结果按(程序名, 窗口标题)缓存，配置重新加载时整体重建
+    """
+
+    EXACT_PREFIX = '='
+    REGEX_PREFIX = 're:'
+
+    def __init__(self, rules, logger=None, cache_size=512):
+        self.rules = []
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # (程序名, 窗口标题) -> 命中的规则或None
+        # 统计计数
+        self.hits = 0
+        self.misses = 0
+
+        patterns = []
+        self._rule_regexes = []  # [(规则, 编译后的正则表达式), ...]
+        for rule in rules:
+            if rule.startswith(self.REGEX_PREFIX):
+                try:
+                    regex = re.compile(rule[len(self.REGEX_PREFIX):], re.IGNORECASE)
+                except re.error as e:
+                    if logger:
+                        logger.warning(f"忽略无效的软件匹配规则: {rule} ({e})")
+                    continue
+                self._rule_regexes.append((rule, regex))
+            else:
+                if rule.startswith(self.EXACT_PREFIX):
+                    pattern = r'\A' + re.escape(rule[len(self.EXACT_PREFIX):]) + r'\Z'
+                else:
+                    pattern = re.escape(rule)
+                patterns.append(f'(?P<r{len(self.rules)}>{pattern})')
+            self.rules.append(rule)
+        self._regex = re.compile('|'.join(patterns), re.IGNORECASE) if patterns else None
+
+    def match(self, app_name, title):
+        """
+        检查程序名或窗口标题是否命中规则（先匹配子串和完全匹配规则，再按顺序匹配正则表达式规则）
+        Returns:
+            str: 命中的规则，未命中返回None
+        """
+        key = (app_name, title)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return self._cache[key]
+
+        self.misses += 1
+        rule = None
+        if self._regex is not None:
+            m = self._regex.search(app_name) or self._regex.search(title)
+            if m:
+                rule = self.rules[int(m.lastgroup[1:])]
+        if rule is None:
+            rule = next((rule for rule, regex in self._rule_regexes
+                         if regex.search(app_name) or regex.search(title)), None)
+        self._cache[key] = rule
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return rule
+
+
+class CapsLockToggler:
+    """
+    非阻塞的Caps Lock切换状态机
+    发送按键后不在主线程上等待，而是通过root.after延迟校验状态，未生效时有限次重试；
+    切换进行中的重复请求被合并，目标改变时（如快速Alt-Tab）只更新目标，由下一次校验决定是否再切换
+    """
+
+    def __init__(self, root, read_state, send_toggle, on_settled, logger=None, verify_delay_ms=50, max_attempts=3):
+        self.root = root
+        self.read_state = read_state  # 读取当前Caps Lock状态
+        self.send_toggle = send_toggle  # 发送一次Caps Lock按键
+        self.on_settled = on_settled  # 切换结束（成功或放弃）后以最终状态回调
+        self.logger = logger
+        self.verify_delay_ms = verify_delay_ms
+        self.max_attempts = max_attempts
+        self.target = None  # 正在切换的目标状态，None表示空闲
+        self.attempts = 0
+        self._verify_id = None
+        # 统计计数：发送按键次数、被合并的重复请求次数
+        self.toggle_count = 0
+        self.suppressed_count = 0
+
+    @property
+    def pending(self):
+        return self.target is not None
+
+    def request(self, target):
+        """
+        请求把Caps Lock切换为target状态
+        Returns:
+            bool: 是否发起了新的切换
+        """
+        if self.pending:
+            if target == self.target:
+                self.suppressed_count += 1
+            else:
+                # 已发送的按键可能尚未生效，等待校验时按新目标处理
+                self.target = target
+                self.attempts = 0
+            return False
+        if self.read_state() == target:
+            return False
+        self.target = target
+        self.attempts = 0
+        self._toggle()
+        return True
+
+    def cancel(self):
+        """取消等待中的校验（程序退出时调用）"""
+        if self._verify_id is not None:
+            try:
+                self.root.after_cancel(self._verify_id)
+            except Exception:
+                pass
+            self._verify_id = None
+        self.target = None
+
+    def _toggle(self):
+        self.attempts += 1
+        self.toggle_count += 1
+        self.send_toggle()
+        self._verify_id = self.root.after(self.verify_delay_ms, self._verify)
+
+    def _verify(self):
+        self._verify_id = None
+        state = self.read_state()
+        if state != self.target and self.attempts < self.max_attempts:
+            self._toggle()
+            return
+        if state != self.target and self.logger:
+            self.logger.warning(f"Caps Lock切换未生效 - 目标: {'大写' if self.target else '小写'}, 已尝试 {self.attempts} 次")
+        self.target = None
+        self.attempts = 0
+        self.on_settled(state)
+
+
+# 跟踪线程发布给界面的不可变快照
+# kind: 'switch' 前台窗口切换 / 'caps' Caps Lock状态变化 / 'segment' 时间流时间段结束（segment_start到timestamp）
+TrackerSnapshot = namedtuple('TrackerSnapshot', ['kind', 'timestamp', 'hwnd', 'app_name', 'window_title', 'caps_lock_on', 'segment_start'])
+
+
+class AdaptiveCadence:
+    """
+    自适应采样间隔
+    用户有键盘鼠标输入时使用最短间隔；空闲超过阈值后每次加倍直到最长间隔，锁屏时直接使用最长间隔；
+    检测到输入后立即恢复最短间隔
+    """
+
+    def __init__(self, active_interval, idle_interval, idle_threshold=60):
+        """
+        Args:
+            active_interval: 用户活动时的间隔（秒）
+            idle_interval: 空闲或锁屏时的最长间隔（秒）
+            idle_threshold: 无输入多少秒后视为空闲，0表示不退避
+        """
+        self.active_interval = active_interval
+        self.idle_interval = max(idle_interval, active_interval)
+        self.idle_threshold = idle_threshold
+        self.interval = active_interval
+        self.active = True
+
+    def update(self, idle_seconds, locked):
+        """根据距最后一次输入的秒数和锁屏状态返回下一次的间隔"""
+        if locked:
+            self.active = False
+            self.interval = self.idle_interval
+        elif self.idle_threshold and idle_seconds >= self.idle_threshold:
+            self.active = False
+            self.interval = min(self.idle_interval, self.interval * 2)
+        else:
+            self.active = True
+            self.interval = self.active_interval
+        return self.interval
+
+
+class ForegroundTracker(threading.Thread):
+    """
+    前台窗口跟踪线程
+    以固定节奏采样前台窗口和Caps Lock状态，自行维护当前窗口和时间流时间段，
+    把结果作为TrackerSnapshot放入队列，由Tk主循环取出处理；采样时间不受界面重绘和数据库操作耗时影响
+    事件驱动模式下不再轮询：提供者通知变化时立即采样，其余时间只在时间段结束时和兜底间隔到达时醒来
+    用户空闲或锁屏时采样间隔（事件驱动模式下为兜底间隔）逐步退避，有输入后恢复
+    """
+
+    def __init__(self, sample, resolve_app, logger, sample_interval=0.2, segment_interval=30,
+                 event_driven=False, fallback_interval=5, activity=None, idle_threshold=60,
+                 idle_sample_interval=5, idle_fallback_interval=60):
+        """
+        Args:
+            sample: 采样函数，返回(窗口句柄, Caps Lock状态)
+            resolve_app: 解析函数，参数为窗口句柄，返回(程序名, 窗口标题)，窗口无效时返回None
+            sample_interval: 采样间隔（秒）
+            segment_interval: 时间流时间段长度（秒）
+            event_driven: 是否由notify唤醒采样（否则按sample_interval轮询）
+            fallback_interval: 事件驱动模式下的兜底采样间隔（秒），防止漏掉事件
+            activity: 活动检测函数，参数为窗口句柄，返回(距最后一次输入的秒数, 是否锁屏)，None表示始终视为活动
+            idle_threshold: 无输入多少秒后开始退避，0表示不退避
+            idle_sample_interval: 轮询模式下空闲时的最长采样间隔（秒）
+            idle_fallback_interval: 事件驱动模式下空闲时的最长兜底间隔（秒）
+        """
+        super().__init__(name='ForegroundTracker', daemon=True)
+        self.sample = sample
+        self.resolve_app = resolve_app
+        self.logger = logger
+        self.sample_interval = sample_interval
+        self.segment_interval = segment_interval
+        self.event_driven = event_driven
+        self.fallback_interval = fallback_interval
+        self.activity = activity
+        self.idle_threshold = idle_threshold
+        self.idle_sample_interval = idle_sample_interval
+        self.idle_fallback_interval = idle_fallback_interval
+        self.cadence = None
+        self.snapshots = queue.Queue()
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        # 跟踪状态，只在跟踪线程内修改
+        self.hwnd = None
+        self.app_name = None
+        self.caps_lock_on = None
+        self.segment_start = time.time()
+        # 统计计数：采样次数、采样滞后（未能按时采样）次数
+        self.sample_count = 0
+        self.late_count = 0
+
+    @property
+    def active(self):
+        """用户是否处于活动状态（未空闲、未锁屏）"""
+        return self.cadence is None or self.cadence.active
+
+    def next_interval(self):
+        """根据用户活动状态计算下一次采样的间隔"""
+        if self.activity is None:
+            return self.cadence.active_interval
+        try:
+            idle_seconds, locked = self.activity(self.hwnd)
+        except Exception as e:
+            self.logger.error(f"检测用户活动状态时出错: {e}")
+            idle_seconds, locked = 0, False
+        was_active = self.cadence.active
+        interval = self.cadence.update(idle_seconds, locked)
+        if was_active != self.cadence.active:
+            state = '恢复活动' if self.cadence.active else ('锁屏' if locked else '空闲')
+            self.logger.info(f"用户{state} - 采样间隔: {interval}秒")
+        return interval
+
+    def run(self):
+        if self.event_driven:
+            self.cadence = AdaptiveCadence(self.fallback_interval, self.idle_fallback_interval, self.idle_threshold)
+            self._run_event_driven()
+            return
+        self.cadence = AdaptiveCadence(self.sample_interval, self.idle_sample_interval, self.idle_threshold)
+        next_sample = time.monotonic()
+        while not self._stop_event.is_set():
+            self.sample_once(time.time())
+            next_sample += self.next_interval()
+            delay = next_sample - time.monotonic()
+            if delay < 0:
+                # 采样落后时不补采，从当前时间重新计时
+                self.late_count += 1
+                next_sample = time.monotonic()
+                delay = 0
+            self._stop_event.wait(delay)
+
+    def _run_event_driven(self):
+        while not self._stop_event.is_set():
+            # 先清除唤醒标记再采样，采样期间到达的通知会让下一次等待立即返回
+            self._wake_event.clear()
+            self.sample_once(time.time())
+            timeout = min(self.next_interval(), self.segment_start + self.segment_interval - time.time())
+            self._wake_event.wait(max(0, timeout))
+
+    def notify(self):
+        """提供者通知前台窗口或Caps Lock状态可能变化，可在任意线程中调用"""
+        self._wake_event.set()
+
+    def stop(self, timeout=2):
+        """停止跟踪线程，已发布的快照留在队列中由界面取出"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self.is_alive():
+            self.join(timeout)
+        self.logger.info(f"前台窗口跟踪线程已停止 - 采样次数: {self.sample_count}, 滞后次数: {self.late_count}")
+
+    def sample_once(self, now):
+        """采样一次，状态变化时发布快照"""
+        self.sample_count += 1
+        try:
+            hwnd, caps_lock_on = self.sample()
+        except Exception as e:
+            self.logger.error(f"采样前台窗口时出错: {e}")
+            return
+
+        if caps_lock_on != self.caps_lock_on:
+            self.caps_lock_on = caps_lock_on
+            self._publish('caps', now)
+
+        if hwnd != self.hwnd:
+            try:
+                resolved = self.resolve_app(hwnd)
+            except Exception as e:
+                self.logger.error(f"Error handling window switch: {e}")
+                resolved = None
+            if resolved is not None:
+                self.hwnd = hwnd
+                self.app_name, window_title = resolved
+                self._publish('switch', now, window_title=window_title)
+
+        if now - self.segment_start >= self.segment_interval:
+            if self.app_name:
+                self._publish('segment', now, segment_start=self.segment_start)
+            self.segment_start = now
+
+    def _publish(self, kind, now, window_title=None, segment_start=None):
+        self.snapshots.put(TrackerSnapshot(kind, now, self.hwnd, self.app_name, window_title, self.caps_lock_on, segment_start))
+
+
+class RenderScheduler:
+    """
+    画布重绘的合并调度器
+    调用方只把视图标记为脏，由一次after_idle回调统一渲染，同一帧内每个脏视图最多渲染一次；
+    两帧之间至少间隔frame_budget_ms毫秒，窗口拖动等高频事件只会触发有限次数的重绘
+    """
+
+    def __init__(self, root, logger, frame_budget_ms=50):
+        self.root = root
+        self.logger = logger
+        self.frame_budget_ms = frame_budget_ms
+        self._views = []  # [(视图名称, 渲染函数)]，按注册顺序渲染
+        self._dirty = {}  # 视图名称 -> 渲染参数
+        self._pending = None
+        self._rendering = False
+        self._last_frame_time = 0.0
+        # 统计计数：标记次数、帧数、实际渲染次数
+        self.invalidate_count = 0
+        self.frame_count = 0
+        self.render_count = 0
+
+    def register(self, name, render_func):
+        """注册视图，先注册的视图先渲染（前面的视图在渲染时标记后面的视图，会在同一帧内完成）"""
+        self._views.append((name, render_func))
+
+    def invalidate(self, name, **options):
+        """
+        标记视图需要重绘
+        Args:
+            name: 视图名称
+            options: 传给渲染函数的布尔参数，同一帧内的多次标记按“或”合并
+        """
+        self.invalidate_count += 1
+        merged = self._dirty.setdefault(name, {})
+        for key, value in options.items():
+            merged[key] = merged.get(key, False) or value
+        if not self._rendering:
+            self._schedule()
+
+    def cancel(self):
+        """取消尚未执行的渲染（程序退出时调用）"""
+        if self._pending is not None:
+            try:
+                self.root.after_cancel(self._pending)
+            except Exception:
+                pass
+            self._pending = None
+        self._dirty.clear()
+
+    def _schedule(self):
+        if self._pending is not None:
+            return
+        delay_ms = self.frame_budget_ms - (time.time() - self._last_frame_time) * 1000
+        if delay_ms > 0:
+            self._pending = self.root.after(max(1, int(delay_ms)), self._run)
+        else:
+            self._pending = self.root.after_idle(self._run)
+
+    def _run(self):
+        self._pending = None
+        self._last_frame_time = time.time()
+        self.frame_count += 1
+        self._rendering = True
+        try:
+            for name, render_func in self._views:
+                options = self._dirty.pop(name, None)
+                if options is None:
+                    continue
+                try:
+                    render_func(**options)
+                    self.render_count += 1
+                except Exception as e:
+                    self.logger.error(f"渲染视图 {name} 时出错: {e}")
+        finally:
+            self._rendering = False
+        # 渲染过程中被重新标记的视图留到下一帧
+        if self._dirty:
+            self._schedule()
+
+
+class HeadlessScheduler:
+    """
+    无界面运行时代替Tk根窗口的定时器
+    提供与Tk相同的after/after_idle/after_cancel接口，在mainloop中按到期时间顺序执行回调；
+    可以从其他线程调用after（用于把IPC线程收到的消息交给主循环处理）
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self._queue = []  # [(到期时间, 序号, 回调, 参数)]
+        self._cancelled = set()
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._running = False
+
+    def after(self, ms, func=None, *args):
+        with self._cond:
+            after_id = next(self._ids)
+            heapq.heappush(self._queue, (time.monotonic() + ms / 1000, after_id, func, args))
+            self._cond.notify()
+        return after_id
+
+    def after_idle(self, func, *args):
+        return self.after(0, func, *args)
+
+    def after_cancel(self, after_id):
+        with self._cond:
+            self._cancelled.add(after_id)
+
+    def mainloop(self):
+        """执行到期的回调，直到调用quit"""
+        self._running = True
+        while self._running:
+            with self._cond:
+                if not self._queue:
+                    self._cond.wait(0.5)
+                    continue
+                delay = self._queue[0][0] - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(min(delay, 0.5))
+                    continue
+                _, after_id, func, args = heapq.heappop(self._queue)
+                if after_id in self._cancelled:
+                    self._cancelled.discard(after_id)
+                    continue
+            try:
+                func(*args)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"定时任务执行出错: {e}")
+
+    def quit(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+
+class WindowProvider:
+    """
+    前台窗口信息提供者接口：前台窗口变化、Caps Lock状态和进程信息
+    event_driven为True的提供者在start后通过notify回调主动通知变化，跟踪线程不再需要高频轮询
+    """
+
+    event_driven = False
+
+    def start(self, notify):
+        """
+        开始提供变化通知（轮询实现无需通知）
+        Args:
+            notify: 前台窗口或Caps Lock状态可能变化时调用，可在任意线程中调用
+        """
+
+    def stop(self):
+        """停止变化通知并释放资源"""
+
+    def foreground_window(self):
+        """返回当前前台窗口句柄"""
+        raise NotImplementedError
+
+    def window_info(self, hwnd):
+        """返回(窗口标题, 窗口类名)，窗口无效时返回None"""
+        raise NotImplementedError
+
+    def process_name(self, hwnd):
+        """返回窗口所属进程的程序文件名，无法获取时返回None"""
+        raise NotImplementedError
+
+    def idle_seconds(self):
+        """返回距最后一次键盘鼠标输入的秒数，无法获取时返回0"""
+        return 0
+
+    def is_locked(self, hwnd):
+        """前台窗口是否为锁屏界面"""
+        return False
+
+    def read_caps_lock_state(self):
+        """读取当前Caps Lock状态"""
+        raise NotImplementedError
+
+    def send_caps_lock_toggle(self):
+        """模拟按下并松开Caps Lock键"""
+        raise NotImplementedError
+
+
+class PollingWindowProvider(WindowProvider):
+    """通过win32接口查询前台窗口的提供者，由跟踪线程定时轮询"""
+
+    def __init__(self, logger):
+        if win32gui is None:
+            raise RuntimeError("未安装pywin32，无法读取前台窗口")
+        self.logger = logger
+        # 进程名解析缓存，避免反复切换同一批程序时重复打开进程句柄
+        self.process_name_cache = ProcessNameCache()
+
+    def stop(self):
+        # 记录进程名缓存的命中情况
+        cache = self.process_name_cache
+        self.logger.info(f"进程名缓存 - 窗口命中: {cache.hwnd_hits}, 命中: {cache.hits}, 未命中: {cache.misses}, 条目数: {len(cache)}")
+
+    def foreground_window(self):
+        return win32gui.GetForegroundWindow()
+
+    def window_info(self, hwnd):
+        if not hwnd or not win32gui.IsWindow(hwnd):
+            return None
+        return win32gui.GetWindowText(hwnd), win32gui.GetClassName(hwnd)
+
+    def process_name(self, hwnd):
+        """获取窗口所属进程名 - 修复win32api句柄泄漏"""
+        try:
+            tid, pid = win32process.GetWindowThreadProcessId(hwnd)
+            
+            # 先按窗口句柄查缓存，命中时无需打开进程句柄
+            process_name = self.process_name_cache.lookup_hwnd(hwnd, pid)
+            if process_name:
+                return process_name
+            
+            # 修复：更严格的句柄管理
+            hproc = win32api.OpenProcess(win32con.PROCESS_QUERY_INFORMATION | win32con.PROCESS_VM_READ, False, pid)
+            if not hproc:
+                # 无法打开进程（权限问题）
+                return None
+            try:
+                # 进程创建时间与PID一起作为缓存键，防止PID复用时返回旧进程的名称
+                try:
+                    create_time = win32process.GetProcessTimes(hproc)['CreationTime']
+                except Exception:
+                    create_time = None
+                if create_time is not None:
+                    process_name = self.process_name_cache.get(pid, create_time)
+                    if process_name:
+                        self.process_name_cache.put(pid, create_time, process_name, hwnd)
+                        return process_name
+                
+                modules = win32process.EnumProcessModules(hproc)
+                if modules and len(modules) > 0:
+                    process_name = os.path.basename(win32process.GetModuleFileNameEx(hproc, modules[0]))
+                    if create_time is not None:
+                        self.process_name_cache.put(pid, create_time, process_name, hwnd)
+                    return process_name
+            finally:
+                # 确保句柄被关闭
+                win32api.CloseHandle(hproc)
+        except Exception:
+            pass
+        return None
+
+    def idle_seconds(self):
+        # GetTickCount和最后一次输入时间都是32位毫秒计数，约49.7天回绕一次
+        return ((win32api.GetTickCount() - win32api.GetLastInputInfo()) & 0xFFFFFFFF) / 1000
+
+    def is_locked(self, hwnd):
+        return bool(hwnd) and win32gui.GetClassName(hwnd) == "LockAppFrame"
+
+    def read_caps_lock_state(self):
+        return win32api.GetKeyState(win32con.VK_CAPITAL) & 1 != 0
+
+    def send_caps_lock_toggle(self):
+        win32api.keybd_event(win32con.VK_CAPITAL, 0, 0, 0)
+        win32api.keybd_event(win32con.VK_CAPITAL, 0, win32con.KEYEVENTF_KEYUP, 0)
+
+
+class WinEventWindowProvider(PollingWindowProvider):
+    """
+    事件驱动的提供者：在独立线程中安装WinEvent钩子（前台窗口切换、桌面切换），变化发生时立即通知跟踪线程，
+    查询接口与轮询实现相同
+    Caps Lock不使用低级键盘钩子（WH_KEYBOARD_LL）：全局钩子的Python回调让系统中每次按键都要等待GIL，
+    超过LowLevelHooksTimeout时会被系统静默卸载，还容易被杀毒软件当作键盘记录器。
+    改为在钩子线程的消息等待间隙检查：最后一次输入时间变化时才读取一次Caps Lock状态，状态变化时通知跟踪线程
+    """
+
+    event_driven = True
+    EVENT_SYSTEM_FOREGROUND = 0x0003
+    EVENT_SYSTEM_DESKTOPSWITCH = 0x0020
+    WINEVENT_OUTOFCONTEXT = 0x0000
+    WINEVENT_SKIPOWNPROCESS = 0x0002
+    WM_QUIT = 0x0012
+    PM_REMOVE = 0x0001
+    QS_ALLINPUT = 0x04FF
+    WAIT_TIMEOUT = 0x0102
+    CAPS_CHECK_INTERVAL_MS = 200  # 检查键盘输入和Caps Lock状态的间隔
+
+    def __init__(self, logger):
+        super().__init__(logger)
+        self._notify = None
+        self._thread = None
+        self._thread_id = None
+        self._ready = threading.Event()
+        self._error = None
+        self.event_count = 0
+
+    def start(self, notify):
+        """安装钩子，失败时抛出RuntimeError（调用方可改为轮询）"""
+        self._notify = notify
+        self._thread = threading.Thread(target=self._hook_loop, name='WinEventHook', daemon=True)
+        self._thread.start()
+        if not self._ready.wait(2):
+            raise RuntimeError("安装WinEvent钩子超时")
+        if self._error:
+            raise RuntimeError(f"安装WinEvent钩子失败: {self._error}")
+
+    def stop(self):
+        if self._thread and self._thread.is_alive() and self._thread_id:
+            ctypes.windll.user32.PostThreadMessageW(self._thread_id, self.WM_QUIT, 0, 0)
+            self._thread.join(2)
+        self.logger.info(f"WinEvent钩子已卸载 - 事件数: {self.event_count}")
+        super().stop()
+
+    def _hook_loop(self):
+        """钩子线程：安装钩子并运行消息循环（WINEVENT_OUTOFCONTEXT在安装线程的消息循环中回调），等待消息的间隙检查Caps Lock"""
+        hooks = []
+        try:
+            from ctypes import wintypes
+            user32 = ctypes.windll.user32
+            kernel32 = ctypes.windll.kernel32
+            WinEventProc = ctypes.WINFUNCTYPE(None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+                                              wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD)
+            user32.SetWinEventHook.argtypes = (wintypes.DWORD, wintypes.DWORD, wintypes.HMODULE, WinEventProc,
+                                               wintypes.DWORD, wintypes.DWORD, wintypes.DWORD)
+            user32.SetWinEventHook.restype = wintypes.HANDLE
+
+            def on_win_event(hook, event, hwnd, id_object, id_child, event_thread, event_time):
+                self.event_count += 1
+                self._notify()
+
+            # 保持回调对象的引用，防止被垃圾回收
+            self._callbacks = (WinEventProc(on_win_event),)
+            msg = wintypes.MSG()
+            self._thread_id = kernel32.GetCurrentThreadId()
+            # 先创建线程消息队列，保证stop时PostThreadMessage能送达
+            user32.PeekMessageW(ctypes.byref(msg), None, 0, 0, 0)
+            flags = self.WINEVENT_OUTOFCONTEXT | self.WINEVENT_SKIPOWNPROCESS
+            for event in (self.EVENT_SYSTEM_FOREGROUND, self.EVENT_SYSTEM_DESKTOPSWITCH):
+                hook = user32.SetWinEventHook(event, event, None, self._callbacks[0], 0, 0, flags)
+                if not hook:
+                    raise ctypes.WinError()
+                hooks.append(hook)
+        except Exception as e:
+            self._error = e
+        self._ready.set()
+        try:
+            if self._error is None:
+                self._message_loop(user32, msg)
+        finally:
+            for hook in hooks:
+                user32.UnhookWinEvent(hook)
+
+    def _message_loop(self, user32, msg):
+        """
+        处理钩子线程的消息，每次最多等待CAPS_CHECK_INTERVAL_MS毫秒
+        Caps Lock只会随键盘输入变化：最后一次输入时间不变时只读一个计数，有输入后才读取Caps Lock状态
+        """
+        last_input = None
+        caps_lock_on = self.read_caps_lock_state()
+        while True:
+            result = user32.MsgWaitForMultipleObjects(0, None, False, self.CAPS_CHECK_INTERVAL_MS, self.QS_ALLINPUT)
+            if result != self.WAIT_TIMEOUT:
+                while user32.PeekMessageW(ctypes.byref(msg), None, 0, 0, self.PM_REMOVE):
+                    if msg.message == self.WM_QUIT:
+                        return
+                    user32.TranslateMessage(ctypes.byref(msg))
+                    user32.DispatchMessageW(ctypes.byref(msg))
+            input_tick = win32api.GetLastInputInfo()
+            if input_tick == last_input:
+                continue
+            last_input = input_tick
+            state = self.read_caps_lock_state()
+            if state != caps_lock_on:
+                caps_lock_on = state
+                self.event_count += 1
+                self._notify()
+
+
+class ReplayWindowProvider(WindowProvider):
+    """
+    回放录制的窗口切换记录的提供者，用于在没有Windows桌面的环境（如Linux）中测试和压测跟踪流程
+    记录为[(开始秒数, 窗口句柄, 进程名, 窗口标题), ...]，从start开始按时间切换前台窗口并通知跟踪线程；
+    speed大于1时加速回放。Caps Lock状态保存在内存中，自动大小写发送的按键会切换该状态
+    """
+
+    event_driven = True
+
+    def __init__(self, trace, caps_lock_on=False, speed=1.0):
+        self.trace = sorted(trace, key=lambda event: event[0])
+        self.offsets = [event[0] for event in self.trace]
+        self.windows = {hwnd: (process_name, window_title) for _, hwnd, process_name, window_title in self.trace}
+        self.caps_lock_on = caps_lock_on
+        self.speed = speed
+        self.start_time = time.monotonic()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def load(cls, path, speed=1.0):
+        """从JSON文件读取记录：[[开始秒数, 窗口句柄, 进程名, 窗口标题], ...]"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls([tuple(event) for event in json.load(f)], speed=speed)
+
+    def start(self, notify):
+        self.start_time = time.monotonic()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._replay, args=(notify,), name='WindowReplay', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(2)
+
+    def _replay(self, notify):
+        """按记录的时间点通知跟踪线程"""
+        for offset in self.offsets:
+            delay = self.start_time + offset / self.speed - time.monotonic()
+            if self._stop_event.wait(max(0, delay)):
+                return
+            notify()
+
+    def foreground_window(self):
+        index = bisect.bisect_right(self.offsets, (time.monotonic() - self.start_time) * self.speed)
+        return self.trace[index - 1][1] if index else 0
+
+    def window_info(self, hwnd):
+        window = self.windows.get(hwnd)
+        return (window[1], '') if window else None
+
+    def process_name(self, hwnd):
+        window = self.windows.get(hwnd)
+        return window[0] if window else None
+
+    def idle_seconds(self):
+        """回放时以距上一次窗口切换的时间作为无输入时间"""
+        elapsed = (time.monotonic() - self.start_time) * self.speed
+        index = bisect.bisect_right(self.offsets, elapsed)
+        return (elapsed - self.offsets[index - 1]) / self.speed if index else 0
+
+    def is_locked(self, hwnd):
+        return self.process_name(hwnd) == 'LockApp.exe'
+
+    def read_caps_lock_state(self):
+        return self.caps_lock_on
+
+    def send_caps_lock_toggle(self):
+        self.caps_lock_on = not self.caps_lock_on
+
+
+def service_dir():
+    """跟踪服务的私有目录（Windows为%LOCALAPPDATA%下，其他系统为$XDG_RUNTIME_DIR或用户主目录下），只有当前用户可以访问"""
+    base = os.environ.get('LOCALAPPDATA' if os.name == 'nt' else 'XDG_RUNTIME_DIR') or os.path.expanduser('~')
+    path = os.path.join(base, 'stt_new')
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if os.name != 'nt':
+        # 目录已存在时makedirs不修改权限
+        os.chmod(path, 0o700)
+    return path
+
+
+def service_authkey():
+    """
+    跟踪服务的IPC认证密钥：首次使用时随机生成，保存在当前用户的私有目录中
+    其他用户读不到密钥，既无法连接服务读取数据或发送stop，也无法冒充服务（认证是双向的）
+    """
+    path = os.path.join(service_dir(), 'service.key')
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o600)
+    except FileExistsError:
+        # 另一个进程可能正在写入密钥，读到不完整的内容时稍后重试
+        for _ in range(20):
+            with open(path, 'rb') as f:
+                key = f.read()
+            if len(key) == 32:
+                return key
+            time.sleep(0.05)
+        raise RuntimeError(f"IPC认证密钥文件无效: {path}")
+    key = os.urandom(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def default_service_address():
+    """
+    跟踪服务的默认本地IPC地址
+    Windows使用命名管道，名称带用户名和由密钥派生的后缀，其他用户无法预先占用；
+    其他系统使用私有目录中的Unix套接字
+    """
+    if os.name == 'nt':
+        token = hashlib.sha256(service_authkey()).hexdigest()[:16]
+        return rf'\\.\pipe\stt_new_tracker_{getpass.getuser()}_{token}'
+    return os.path.join(service_dir(), 'tracker.sock')
+
+
+def encode_message(message):
+    """IPC消息编码：紧凑的UTF-8 JSON"""
+    return json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def decode_message(data):
+    return json.loads(data.decode('utf-8'))
+
+
+class ServiceServer(threading.Thread):
+    """
+    跟踪服务的IPC服务端
+    接受界面客户端连接，向所有客户端推送消息；客户端发来的消息在各自的读取线程中交给on_message回调
+    """
+
+    def __init__(self, address, logger, on_connect, on_message, authkey=None):
+        super().__init__(name='ServiceServer', daemon=True)
+        self.address = address
+        self.authkey = authkey or service_authkey()
+        self.logger = logger
+        self.on_connect = on_connect
+        self.on_message = on_message
+        self._connections = []
+        self._lock = threading.Lock()
+        self._closed = False
+        if os.name != 'nt' and os.path.exists(address):
+            # 上次异常退出残留的套接字文件：确认没有服务在监听后删除
+            try:
+                Client(address, authkey=self.authkey).close()
+            except OSError:
+                os.unlink(address)
+            else:
+                raise RuntimeError(f"跟踪服务已在运行: {address}")
+        self.listener = Listener(address, authkey=self.authkey)
+
+    def run(self):
+        while not self._closed:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                if self._closed:
+                    break
+                self.logger.warning(f"接受客户端连接失败: {e}")
+                continue
+            if self._closed:
+                conn.close()
+                break
+            with self._lock:
+                self._connections.append(conn)
+            self.logger.info(f"客户端已连接 - 当前连接数: {len(self._connections)}")
+            threading.Thread(target=self._read_loop, args=(conn,), name='ServiceServerReader', daemon=True).start()
+            self.on_connect(conn)
+
+    def _read_loop(self, conn):
+        try:
+            while True:
+                self.on_message(conn, decode_message(conn.recv_bytes()))
+        except (EOFError, OSError, ValueError):
+            pass
+        finally:
+            self._drop(conn)
+
+    def _drop(self, conn):
+        with self._lock:
+            if conn not in self._connections:
+                return
+            self._connections.remove(conn)
+        try:
+            conn.close()
+        except OSError:
+            pass
+        self.logger.info(f"客户端已断开 - 当前连接数: {len(self._connections)}")
+
+    def send(self, conn, message):
+        """向单个客户端发送消息，发送失败时断开该客户端"""
+        try:
+            conn.send_bytes(encode_message(message))
+        except (OSError, ValueError):
+            self._drop(conn)
+
+    def broadcast(self, message):
+        """向所有客户端推送消息"""
+        with self._lock:
+            connections = list(self._connections)
+        if not connections:
+            return
+        data = encode_message(message)
+        for conn in connections:
+            try:
+                conn.send_bytes(data)
+            except (OSError, ValueError):
+                self._drop(conn)
+
+    def stop(self):
+        """停止接受连接并断开所有客户端"""
+        self._closed = True
+        # 连接一次自身，唤醒阻塞在accept上的线程
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except Exception:
+            pass
+        self.join(2)
+        self.listener.close()
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+
+class ServiceClient(threading.Thread):
+    """
+    界面连接跟踪服务的客户端
+    后台线程接收服务推送的消息放入队列，由Tk主循环取出处理；连接断开后定时重连
+    """
+
+    RECONNECT_INTERVAL = 2  # 重连间隔（秒）
+
+    def __init__(self, address, logger, authkey=None):
+        super().__init__(name='ServiceClient', daemon=True)
+        self.address = address
+        self.authkey = authkey or service_authkey()
+        self.logger = logger
+        self.messages = queue.Queue()
+        self.conn = None
+        self._closed = threading.Event()
+
+    def connect(self):
+        """连接跟踪服务，返回是否成功"""
+        try:
+            self.conn = Client(self.address, authkey=self.authkey)
+        except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+            self.logger.debug(f"连接跟踪服务失败: {e}")
+            return False
+        self.logger.info(f"已连接跟踪服务: {self.address}")
+        return True
+
+    def run(self):
+        while not self._closed.is_set():
+            if self.conn is None and not self.connect():
+                self._closed.wait(self.RECONNECT_INTERVAL)
+                continue
+            try:
+                while True:
+                    self.messages.put(decode_message(self.conn.recv_bytes()))
+            except (EOFError, OSError, ValueError):
+                if not self._closed.is_set():
+                    self.logger.warning("与跟踪服务的连接已断开，稍后重连")
+                self.conn = None
+
+    def send(self, message):
+        conn = self.conn
+        if conn is None:
+            return
+        try:
+            conn.send_bytes(encode_message(message))
+        except (OSError, ValueError):
+            pass
+
+    def close(self):
+        self._closed.set()
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+
+class ScreenTimeTracker:
+    """
+    与界面无关的屏幕时间跟踪核心：前台窗口采样、自动大小写规则、配置读取和数据持久化
+    由CapsLockChecker（tkinter界面）和TrackerService（无界面服务）共用，
+    子类需提供self.root（Tk根窗口或HeadlessScheduler，只使用after/after_cancel）
+    """
+    # 各数据库的结构版本（PRAGMA user_version）
+    # screen_time_history.db  2：增加整数时间戳列start_ts/day_key  3：增加按天按应用汇总表daily_app_totals
+    #                         4：程序名改为apps表中的整数id（字典编码）
+    # time_stream_history.db  2：增加整数时间戳列start_ts/day_key  3：程序名改为apps表中的整数id（字典编码）
+    #                         4：time_stream_rows增加(start_ts, app_id)唯一键，写入改为upsert
+    #                         5：删除logged_pixels表，改为watermarks表中的一条水位线记录
+    SCHEMA_VERSIONS = {'screen_time': 4, 'time_stream': 5}
+    EPOCH_SCHEMA_VERSION = 2
+    DAILY_TOTALS_SCHEMA_VERSION = 3
+    APPS_SCHEMA_VERSIONS = {'screen_time': 4, 'time_stream': 3}
+    STREAM_KEY_SCHEMA_VERSION = 4
+    PIXEL_WATERMARK_SCHEMA_VERSION = 5
+    # 整数时间戳迁移：每批回填的行数和批次间隔（毫秒）
+    MIGRATION_CHUNK_ROWS = 5000
+    MIGRATION_STEP_MS = 200
+    # 回填旧数据：timestamp为记录时刻的本地时间，起始时间 = 记录时刻 - 时长
+    EPOCH_BACKFILL_SQL = (
+        "UPDATE {table} SET "
+        "start_ts = CAST(strftime('%s', timestamp, 'utc') AS INTEGER) - CAST(duration AS INTEGER), "
+        "day_key = CAST(strftime('%Y%m%d', timestamp, printf('-%d seconds', CAST(duration AS INTEGER))) AS INTEGER) "
+        "WHERE id BETWEEN ? AND ? AND start_ts IS NULL"
+    )
+    # 迁移完成后创建的索引
+    EPOCH_INDEXES = {
+        'screen_time': ('CREATE INDEX IF NOT EXISTS idx_screen_time_day_app ON screen_time (day_key, app_name, duration)',),
+        'time_stream': ('CREATE INDEX IF NOT EXISTS idx_time_stream_start ON time_stream (start_ts)',),
+    }
+    # 字典编码：程序名只在apps表中保存一次，记录表{table}_rows只保存整数app_id，
+    # 原表名改为视图，查询语句保持不变
+    APPS_TABLE_SQL = 'CREATE TABLE IF NOT EXISTS apps (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)'
+    ROWS_TABLE_SQL = (
+        'CREATE TABLE IF NOT EXISTS {table}_rows ('
+        'id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, app_id INTEGER NOT NULL, '
+        'duration REAL NOT NULL, start_ts INTEGER, day_key INTEGER)'
+    )
+    ROWS_INDEXES = {
+        'screen_time': ('CREATE INDEX IF NOT EXISTS idx_screen_time_rows_timestamp ON screen_time_rows (timestamp)',
+                        'CREATE INDEX IF NOT EXISTS idx_screen_time_rows_day_app ON screen_time_rows (day_key, app_id, duration)'),
+        'time_stream': ('CREATE INDEX IF NOT EXISTS idx_time_stream_rows_timestamp ON time_stream_rows (timestamp)',
+                        'CREATE INDEX IF NOT EXISTS idx_time_stream_rows_start ON time_stream_rows (start_ts)'),
+    }
+    APPS_VIEW_SQL = (
+        'CREATE VIEW IF NOT EXISTS {table} AS '
+        'SELECT r.id, r.timestamp, a.name AS app_name, r.duration, r.start_ts, r.day_key '
+        'FROM {table}_rows r JOIN apps a ON a.id = r.app_id'
+    )
+    # 迁移期间视图同时包含尚未复制的旧记录
+    APPS_VIEW_LEGACY_SQL = APPS_VIEW_SQL + (
+        ' UNION ALL SELECT id, timestamp, app_name, duration, start_ts, day_key FROM {table}_legacy'
+    )
+    # 分批把旧表记录复制到新表：登记新程序名、按id范围复制并删除已复制的旧记录（同一事务）
+    APPS_COPY_SQL = (
+        'INSERT OR IGNORE INTO apps (name) SELECT DISTINCT app_name FROM {table}_legacy WHERE id BETWEEN ? AND ?',
+        'INSERT INTO {table}_rows (id, timestamp, app_id, duration, start_ts, day_key) '
+        'SELECT l.id, l.timestamp, a.id, l.duration, l.start_ts, l.day_key '
+        'FROM {table}_legacy l JOIN apps a ON a.name = l.app_name WHERE l.id BETWEEN ? AND ?',
+        'DELETE FROM {table}_legacy WHERE id BETWEEN ? AND ?',
+    )
+    # 时间流记录的唯一键：同一程序同一起始秒只有一条记录，重复写入同一时间段（如重启后重新加载的缓存）不会产生重复记录
+    # 起始时间在前，按起始时间的范围查询同样可以使用，取代原来的idx_time_stream_rows_start
+    STREAM_KEY_INDEX_SQL = 'CREATE UNIQUE INDEX IF NOT EXISTS idx_time_stream_rows_start_app ON time_stream_rows (start_ts, app_id)'
+    # 已有唯一键时的写入语句：同一时间段再次写入时只保留时长较长的一条
+    STREAM_UPSERT_SQL = (
+        'INSERT INTO time_stream_rows (timestamp, app_id, duration, start_ts, day_key) VALUES (?, {app_id}, ?, ?, ?) '
+        'ON CONFLICT (start_ts, app_id) DO UPDATE SET timestamp = excluded.timestamp, duration = excluded.duration '
+        'WHERE excluded.duration > duration'
+    )
+    # 唯一键迁移：按id分批删除重复记录，同一程序同一起始秒保留时长最长的一条（时长相同时保留id最小的）
+    STREAM_DEDUPE_SQL = (
+        'DELETE FROM time_stream_rows WHERE id BETWEEN ? AND ? AND EXISTS ('
+        'SELECT 1 FROM time_stream_rows o WHERE o.start_ts = time_stream_rows.start_ts AND o.app_id = time_stream_rows.app_id '
+        'AND (o.duration > time_stream_rows.duration OR (o.duration = time_stream_rows.duration AND o.id < time_stream_rows.id)))'
+    )
+    # 迁移期间新写入的记录可能取代已经检查过的旧记录，删除这些旧记录
+    STREAM_DEDUPE_SUPERSEDED_SQL = (
+        'DELETE FROM time_stream_rows WHERE id IN ('
+        'SELECT r.id FROM time_stream_rows n JOIN time_stream_rows r ON r.start_ts = n.start_ts AND r.app_id = n.app_id '
+        'WHERE n.id > ? AND (n.duration > r.duration OR (n.duration = r.duration AND n.id < r.id)))'
+    )
+    # 水位线表：每个名称只保存一个值，如已记录到日志的最后一个像素格的时间戳
+    WATERMARKS_TABLE_SQL = 'CREATE TABLE IF NOT EXISTS watermarks (name TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID'
+    WATERMARK_UPSERT_SQL = 'INSERT INTO watermarks (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = excluded.value'
+    PIXEL_WATERMARK = 'last_logged_pixel_time'
+    # 数据保留：超过raw_retention_days天的原始记录按分钟汇总到{table}_buckets，
+    # 超过minute_retention_days天的分钟桶再汇总为小时桶；每次处理一张表一天的数据，同一事务中写入汇总并删除明细
+    RETENTION_TABLES = ('screen_time', 'time_stream')
+    RETENTION_START_MS = 60000  # 启动后延迟开始，不与启动和迁移争用磁盘
+    RETENTION_STEP_MS = 1000  # 用户空闲时每批的间隔
+    RETENTION_ACTIVE_STEP_MS = 5000  # 用户活动时每批的间隔
+    RETENTION_INTERVAL_MS = 3600000  # 没有待处理的数据时每小时检查一次
+    RETENTION_VACUUM_PAGES = 2000  # 每批增量回收的空闲页数
+    BUCKETS_TABLE_SQL = (
+        'CREATE TABLE IF NOT EXISTS {table}_buckets ('
+        'resolution INTEGER NOT NULL, bucket_start INTEGER NOT NULL, app_id INTEGER NOT NULL, '
+        'day_key INTEGER NOT NULL, duration REAL NOT NULL, '
+        'PRIMARY KEY (resolution, bucket_start, app_id)) WITHOUT ROWID'
+    )
+    # 原始记录中一天的范围：screen_time按day_key（走idx_screen_time_rows_day_app），time_stream按start_ts（走唯一键索引）
+    RETENTION_DAY_FILTERS = {
+        'screen_time': 'day_key = :day_key',
+        'time_stream': 'start_ts >= :day_start AND start_ts < :day_end',
+    }
+    # 原始记录按起始时间所在的分钟汇总
+    DOWNSAMPLE_RAW_SQL = (
+        'INSERT INTO {table}_buckets (resolution, bucket_start, app_id, day_key, duration) '
+        'SELECT 60, start_ts - start_ts % 60, app_id, :day_key, SUM(duration) FROM {table}_rows WHERE {day_filter} '
+        'GROUP BY start_ts - start_ts % 60, app_id '
+        'ON CONFLICT (resolution, bucket_start, app_id) DO UPDATE SET duration = duration + excluded.duration'
+    )
+    # 分钟桶按本地小时汇总：小时从当天0点起算，非整点时区（如UTC+5:30）的小时桶也不会跨越午夜
+    DOWNSAMPLE_MINUTES_SQL = (
+        'INSERT INTO {table}_buckets (resolution, bucket_start, app_id, day_key, duration) '
+        'SELECT 3600, :day_start + (bucket_start - :day_start) / 3600 * 3600, app_id, :day_key, SUM(duration) FROM {table}_buckets '
+        'WHERE resolution = 60 AND bucket_start >= :day_start AND bucket_start < :day_end '
+        'GROUP BY (bucket_start - :day_start) / 3600, app_id '
+        'ON CONFLICT (resolution, bucket_start, app_id) DO UPDATE SET duration = duration + excluded.duration'
+    )
+
+    def init_tracking(self, window_provider=None):
+        """
+        读取配置后初始化跟踪状态：前台窗口信息提供者、Caps Lock状态、自动切换状态机和当前会话
+        Args:
+            window_provider: 前台窗口信息提供者（如ReplayWindowProvider），默认按配置使用win32事件钩子或轮询
+        """
+        self.window_provider = window_provider or self.create_window_provider()
+        # 初始化Caps Lock状态
+        self.caps_lock_on = self.read_caps_lock_state()
+        self.last_hwnd = None
+        self.usage_stats = {}
+        self.user_active = True  # 用户是否处于活动状态（由跟踪线程的自适应采样判断）
+        # 自动切换大小写的状态机
+        self.caps_toggler = CapsLockToggler(self.root, self.read_caps_lock_state, self.send_caps_lock_toggle,
+                                            self.on_caps_toggle_settled, self.logger)
+        self.tracker = None
+        
+        # 初始化应用跟踪变量
+        self.current_app_name = None
+        self.current_start_time = time.time()
+        self.last_flush_time = self.current_start_time
+        self.time_stream_write_interval = 30
+
+    def create_window_provider(self):
+        """按配置创建win32提供者：event为WinEvent钩子通知（默认），polling为定时轮询"""
+        if self.config.get('window_provider', 'event') == 'event':
+            return WinEventWindowProvider(self.logger)
+        return PollingWindowProvider(self.logger)
+
+    def init_cache(self):
+        """读取配置后初始化时间流缓存"""
+        self.grid_second_per_block = self.config.get('grid_second_per_block', 60)  # 设置grid_second_per_block属性
+        
+        # 时间流缓存：定长列式环形缓冲区，满时立即写入数据库
+        self.TIME_STREAM_CACHE_CAPACITY = 4096  # 缓存最大记录数（约40KB）
+        self.time_stream_cache = TimeStreamBuffer(self.TIME_STREAM_CACHE_CAPACITY)
+        self.last_cache_flush_time = time.time()  # 上次缓存刷新时间
+        # 缓存刷新到数据库的间隔（秒），尚未写入的数据由崩溃保护日志保护
+        self.cache_flush_interval = self.config.get('cache_flush_seconds', 300)
+        # 崩溃保护日志，只由负责跟踪的进程在start_tracking中打开
+        self.journal = None
+        self.journal_commit = None  # 日志切换后等待写入线程提交的确认
+        self.screen_time_committed = 0.0  # 已提交到数据库的屏幕时间的结束时间（由写入线程的提交回调更新）
+
+    def init_storage(self):
+        """读取配置后初始化时间流缓存和数据库"""
+        self.init_cache()
+        
+        # 初始化数据库（长连接由DatabaseManager统一管理）
+        self.db_manager = DatabaseManager(self.logger)
+        self.init_db()
+        # 启动后台写入线程，所有写操作通过队列分组提交
+        self.db_writer = DatabaseWriter(self.logger)
+        self.db_writer.start()
+        # 今天各应用使用时长的内存累计值，只在启动时查询一次数据库
+        self.today_totals = TodayTotals(self.day_key_for(), self.get_screen_time_from_db())
+        # 窗口切换时间段合并：短于min_segment_seconds的时间段并入相邻时间段后再写入数据库
+        self.segment_coalescer = SegmentCoalescer(self.write_screen_time, self.config.get('min_segment_seconds', 1.0))
+
+    def init_client_storage(self):
+        """
+        客户端模式：只读打开数据库读取历史数据，不做结构迁移、不启动写入线程
+        数据库结构状态和今天的统计由跟踪服务推送（schema、totals消息），写操作交给服务执行
+        """
+        self.init_cache()
+        self.db_manager = DatabaseManager(self.logger, read_only=True)
+        self.db_writer = None
+        # 收到服务推送的结构状态之前按旧结构查询
+        self.epoch_schema_ready = {}
+        self.daily_totals_ready = False
+        self.stream_key_ready = False
+        self.today_totals = TodayTotals(self.day_key_for())
+        # 客户端不写入屏幕时间，合并器始终为空
+        self.segment_coalescer = SegmentCoalescer(self.write_screen_time, self.config.get('min_segment_seconds', 1.0))
+
+    def schema_state(self):
+        """查询方式依赖的数据库结构状态（由跟踪服务推送给客户端）"""
+        return {'epoch': self.epoch_schema_ready, 'daily_totals': self.daily_totals_ready, 'stream_key': self.stream_key_ready}
+
+    def on_schema_state_changed(self):
+        """结构迁移切换了查询方式时调用，跟踪服务在此通知客户端"""
+
+    def start_tracking(self):
+        """重放崩溃保护日志，启动跟踪线程、缓存刷新和数据库结构迁移"""
+        self.open_journal()
+        
+        # 前台窗口和Caps Lock状态采样 - 在独立的跟踪线程中进行，主循环每100ms处理其发布的快照
+        # 事件驱动的提供者在变化时唤醒跟踪线程，否则每200ms轮询一次
+        # 用户空闲或锁屏时采样间隔逐步退避，有输入后恢复
+        self.tracker = ForegroundTracker(self.sample_foreground, self.resolve_foreground_app, self.logger,
+                                         sample_interval=0.2, segment_interval=self.grid_second_per_block,
+                                         activity=self.sample_activity, idle_threshold=self.config.get('idle_threshold', 60))
+        if self.window_provider.event_driven:
+            try:
+                self.window_provider.start(self.tracker.notify)
+                self.tracker.event_driven = True
+            except Exception as e:
+                self.logger.warning(f"无法启用事件驱动的窗口跟踪，改为轮询: {e}")
+        self.tracker.start()
+        self.drain_tracker_snapshots()
+        
+        # 缓存刷新 - 默认5分钟
+        self.root.after(self.cache_flush_interval * 1000, self.schedule_cache_flush)
+        
+        # 数据库结构迁移 - 分批回填旧数据（仅在需要时运行）
+        self.run_schema_migration_step()
+        
+        # 数据保留 - 启动1分钟后开始，分批汇总超出保留期的历史记录
+        self.retention_days_processed = 0
+        self.retention_commit = None  # 已提交给写入线程、尚未提交到数据库的汇总任务
+        self.vacuumed_db_files = set()
+        self.retention_id = self.root.after(self.RETENTION_START_MS, self.run_retention_step)
+
+    def stop_tracking(self):
+        """停止跟踪：处理剩余的快照，记录当前应用的使用时间，并把时间流缓存写入数据库"""
+        # 停止跟踪线程，并处理队列中剩余的快照
+        if self.tracker:
+            self.tracker.stop()
+            self.root.after_cancel(self.tracker_drain_id)
+            self.apply_pending_snapshots()
+            self.root.after_cancel(self.retention_id)
+        self.window_provider.stop()
+        
+        # 将当前应用的使用时间写入数据库
+        if self.current_app_name and self.current_start_time:
+            elapsed = time.time() - self.current_start_time
+            if elapsed > 0:
+                # 记录当前应用使用时间
+                self.logger.info(f"记录最后应用使用时间 - 应用: {self.current_app_name}, 时长: {self.format_duration(elapsed)}")
+                # 只记录屏幕使用时间（用于统计显示）
+                self.record_screen_time(self.current_app_name, elapsed)
+        
+        # 写入合并器中暂存的时间段，并记录合并效果
+        coalescer = self.segment_coalescer
+        coalescer.flush()
+        self.logger.info(f"时间段合并 - 时间段: {coalescer.segment_count}, 写入记录: {coalescer.row_count}, "
+                         f"同程序合并: {coalescer.merged_count}, 短时间段并入: {coalescer.absorbed_count}")
+        
+        # 将缓存中的时间流数据写入数据库
+        if self.time_stream_cache:
+            self.logger.info("程序退出 - 将缓存中的时间流数据写入数据库")
+            self.flush_time_stream_cache()
+        
+        # 取消尚未执行的大小写切换校验
+        self.caps_toggler.cancel()
+
+    def close_storage(self):
+        """
+        停止后台写入线程（确保队列中的数据全部写入数据库），删除崩溃保护日志并关闭数据库长连接
+        写入线程超时未结束时保留日志，下次启动时重放
+        """
+        finished = self.db_writer.stop() if self.db_writer else True
+        if self.journal:
+            self.journal.close(discard=finished)
+        self.db_manager.close_all()
+
+    def journal_file(self):
+        """获取崩溃保护日志文件名"""
+        return "tracking_journal.bin"
+
+    def open_journal(self):
+        """
+        重放上次异常退出（崩溃、注销、断电）时留下的崩溃保护日志，补写尚未写入数据库的数据，然后开始新的日志
+        时间流时间段按(start_ts, app_id)唯一键upsert，重复写入不会重复计入；
+        屏幕时间只补写各会话中水位线之后的部分
+        另一个实例正在使用日志（同时在本地模式下跟踪）时拒绝启动，不重放也不删除它的日志
+        """
+        journal = TrackingJournal(self.journal_file(), self.logger)
+        if not journal.acquire_lock():
+            raise RuntimeError(f"另一个实例正在跟踪（崩溃保护日志已被锁定）: {self.journal_file()}")
+        self.journal = journal
+        try:
+            segments, sessions, _ = self.journal.replay()
+            if segments:
+                rows = [(self.stream_timestamp(start_ts, duration), app_name, duration, start_ts, self.day_key_for(start_ts))
+                        for app_name, start_ts, duration in segments]
+                self.db_writer.submit(self.time_stream_db_file(), self.history_insert_statements('time_stream', rows))
+            recovered = 0.0
+            for app_name, start, seen in sessions:
+                self.write_screen_time(app_name, start, seen)
+                recovered += seen - start
+            if segments or recovered:
+                self.logger.warning(f"上次未正常退出 - 从崩溃保护日志恢复 {len(segments)} 条时间流记录, "
+                                    f"屏幕时间 {self.format_duration(recovered)}")
+                # 等待补写的数据提交后重新加载今天的累计值
+                self.db_writer.flush(timeout=5)
+                self.today_totals.reset(self.day_key_for(), self.get_screen_time_from_db())
+        except Exception as e:
+            self.logger.error(f"重放崩溃保护日志时出错: {e}")
+        try:
+            self.journal.start()
+        except OSError as e:
+            self.logger.error(f"无法创建崩溃保护日志，本次运行不记录: {e}")
+            self.journal.close()
+            self.journal = None
+
+    def maintain_journal(self):
+        """
+        主循环每次处理跟踪快照后调用：写入当前会话的检查点和已提交的屏幕时间水位线，
+        定期fsync；切换前的数据已由写入线程提交时删除旧日志文件
+        """
+        if not self.journal:
+            return
+        # 检查点是定长记录，每次处理都写入，崩溃时最多丢失一个处理间隔（活动时100ms）
+        if self.current_app_name:
+            self.journal.checkpoint(self.current_app_name, self.current_start_time, time.time())
+        committed = self.screen_time_committed
+        if committed > self.journal.persisted_until:
+            self.journal.persisted(committed)
+        self.journal.sync()
+        if self.journal_commit and self.journal_commit.is_set():
+            self.journal.discard_old()
+            self.journal_commit = None
+
+    def update_caps_lock_display(self, caps_lock_on):
+        """记录Caps Lock状态，界面子类在此更新显示"""
+        self.caps_lock_on = caps_lock_on
+
+    def schedule_cache_flush(self):
+        """缓存刷新任务"""
+        # 刷新缓存到数据库
+        self.flush_time_stream_cache()
+        
+        # 计划下次执行
+        self.root.after(self.cache_flush_interval * 1000, self.schedule_cache_flush)
+
+    def setup_logging(self):
+        """设置日志系统"""
+        # 创建logs文件夹
+        log_folder = 'logs'
+        if not os.path.exists(log_folder):
+            os.makedirs(log_folder)
+        
+        # 生成日志文件名
+        today = datetime.date.today()
+        log_filename = os.path.join(log_folder, 'log_{}.txt'.format(today.strftime('%Y-%m-%d')))
+        
+        # 配置日志 - 将日志级别从DEBUG改为INFO，减少日志输出
+        logging.basicConfig(
+            filename=log_filename,
+            level=logging.INFO,  # 改为INFO级别，减少DEBUG级别的日志
+            format='%(asctime)s - %(levelname)s - %(message)s',
+            encoding='utf-8'
+        )
+        
+        # Initialize logger instance
+        self.logger = logging.getLogger(__name__)
+        
+        # 记录程序启动日志
+        self.logger.info("程序启动 - 屏幕时间追踪器初始化开始")
+
+    def read_config(self):
+        """读取配置文件"""
+        # 默认配置
+        self.config = {
+            'color_caps_on': '#fa6666',
+            'color_caps_off': '#4CAF50',
+            'color_titlebar': '#2c3e50',
+            'window_width': 300,
+            'window_height': 240,
+            'window_x': -1,
+            'window_y': -1,
+            'always_on_top': 1,
+            'software_list': ['CAXA', 'CAD', 'SOLIDWORKS'],
+
+            'grid_second_per_block': 30,
+            'time_stream_renderer': 'canvas',  # 时间流渲染方式：canvas（同一行连续方块合并为一个矩形）或 bitmap（单个位图）
+            'render_frame_budget_ms': 50,  # 两次画布重绘之间的最小间隔，单位：毫秒
+            'window_provider': 'event',  # 前台窗口跟踪方式：event（WinEvent钩子通知）或 polling（每200ms轮询）
+            'idle_threshold': 60,  # 无键盘鼠标输入多少秒后降低采样和刷新频率，0表示不降低
+            'min_segment_seconds': 1.0,  # 短于该秒数的窗口切换时间段并入相邻时间段后再写入数据库，0表示只合并同一程序的连续时间段
+            'raw_retention_days': 14,  # 原始记录保留天数，更早的记录汇总为每分钟每程序的时长，0表示永久保留原始记录
+            'minute_retention_days': 90,  # 分钟汇总保留天数，更早的汇总为每小时每程序的时长
+            'cache_flush_seconds': 300,  # 时间流缓存写入数据库的间隔，未写入的数据由崩溃保护日志保护
+
+            'screen_time_refresh_frequency': 10  # 屏幕显示时间刷新率，单位：次/10秒
+        }
+        
+        if os.path.exists('config.txt'):
+            with open('config.txt', 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+                
+            # 使用字典映射处理配置键值，提高效率
+            config_handlers = {
+                'color_caps_on': str,
+                'color_caps_off': str,
+                'color_titlebar': str,
+                'window_width': int,
+                'window_height': int,
+                'window_x': int,
+                'window_y': int,
+                'always_on_top': lambda v: v.strip().lower() in ['true', '1', 'yes', 'on'],
+                'software_list': lambda v: [item.strip() for item in v.split(',') if item.strip()],
+
+                'grid_second_per_block': int,
+                'time_stream_renderer': lambda v: v.strip().lower() if v.strip().lower() in ['canvas', 'bitmap'] else 'canvas',
+                'render_frame_budget_ms': lambda v: max(0, int(v)),
+                'window_provider': lambda v: v.strip().lower() if v.strip().lower() in ['event', 'polling'] else 'event',
+                'idle_threshold': lambda v: max(0, int(v)),
+                'min_segment_seconds': lambda v: max(0.0, float(v)),
+                'raw_retention_days': lambda v: max(0, int(v)),
+                'minute_retention_days': lambda v: max(0, int(v)),
+                'cache_flush_seconds': lambda v: max(10, int(v)),
+
+                'screen_time_refresh_frequency': int
+            }
+            
+            # 初始化进程配置字典
+            self.config['process_config'] = {}
+            current_section = None  # 当前章节名（进程名）
+            
+            for line in lines:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                
+                # 检查是否为章节头 [process.exe]
+                if line.startswith('[') and line.endswith(']'):
+                    current_section = line[1:-1].strip()
+                    # 初始化进程配置
+                    if current_section not in self.config['process_config']:
+                        self.config['process_config'][current_section] = {
+                            'display_name': current_section,
+                            'show_in_screen_time': True,
+                            'show_in_time_stream': True
+                        }
+                    continue
+                
+                # 处理键值对
+                if '=' in line:
+                    key, value = line.split('=', 1)
+                    key = key.strip()
+                    value = value.strip()
+                    
+                    # 处理注释
+                    if ';' in value:
+                        value = value.split(';')[0].strip()
+                    
+                    # 区分全局配置和进程配置
+                    if current_section is None:
+                        # 全局配置
+                        if key in config_handlers:
+                            self.config[key] = config_handlers[key](value)
+                    else:
+                        # 进程配置
+                        if key == 'display_name':
+                            self.config['process_config'][current_section]['display_name'] = value
+                        elif key == 'show_in_screen_time':
+                            self.config['process_config'][current_section]['show_in_screen_time'] = \
+                                value.strip().lower() in ['true', '1', 'yes', 'on']
+                        elif key == 'show_in_time_stream':
+                            self.config['process_config'][current_section]['show_in_time_stream'] = \
+                                value.strip().lower() in ['true', '1', 'yes', 'on']
+            # 保持 backward compatibility - 将 software_list 转换为新格式
+            if 'software_list' not in self.config:
+                self.config['software_list'] = []
+        else:
+            # 配置文件不存在，生成默认配置文件
+            # 初始化默认进程配置
+            self.config['process_config'] = {
+                'explorer.exe': {
+                    'display_name': 'Windows Explorer',
+                    'show_in_screen_time': True,
+                    'show_in_time_stream': True
+                },
+                'chrome.exe': {
+                    'display_name': 'Google Chrome',
+                    'show_in_screen_time': True,
+                    'show_in_time_stream': True
+                },
+                'wechat.exe': {
+                    'display_name': '微信',
+                    'show_in_screen_time': True,
+                    'show_in_time_stream': True
+                },
+                'code.exe': {
+                    'display_name': 'Visual Studio Code',
+                    'show_in_screen_time': True,
+                    'show_in_time_stream': True
+                },
+                'QQ.exe': {
+                    'display_name': 'QQ',
+                    'show_in_screen_time': True,
+                    'show_in_time_stream': True
+                },
+                'CAXA.exe': {
+                    'display_name': 'CAXA',
+                    'show_in_screen_time': True,
+                    'show_in_time_stream': True
+                },
+                'edge.exe': {
+                    'display_name': 'Microsoft Edge',
+                    'show_in_screen_time': True,
+                    'show_in_time_stream': True
+                },
+                'LockApp.exe': {
+                    'display_name': 'Lock Screen',
+                    'show_in_screen_time': False,
+                    'show_in_time_stream': True
+                }
+            }
+            self.write_config_file()
+        
+        # 重新建立进程配置的查找索引和自动大写软件匹配器
+        self.build_process_config_index()
+        self.software_matcher = SoftwareMatcher(self.config.get('software_list', []), self.logger)
+
+    def build_process_config_index(self):
+        """
+        根据process_config建立查找索引，读取配置时调用一次，避免每次查找都遍历全部进程配置
+        process_display_names: 进程名（casefold）-> 显示名称
+        app_display_flags: 显示名称 -> {'show_in_screen_time': bool, 'show_in_time_stream': bool}
+        """
+        self.process_display_names = {}
+        self.app_display_flags = {}
+        # 与原来的遍历查找保持一致：多个配置匹配时以先出现的为准
+        for proc_name, config in self.config.get('process_config', {}).items():
+            self.process_display_names.setdefault(proc_name.casefold(), config['display_name'])
+            self.app_display_flags.setdefault(config['display_name'], config)
+
+    def write_config_file(self, save_size=True):
+        """将配置写入文件"""
+        # 确保配置字典包含所有必要的键
+        # 添加时间流和刷新率配置的默认值
+        self.config.setdefault('grid_second_per_block', 30)
+        self.config.setdefault('screen_time_refresh_frequency', 10)
+        
+        with open('config.txt', 'w', encoding='utf-8') as f:
+            f.write('# Caps Lock 检测器配置文件\n')
+            f.write('# 颜色设置\n')
+            f.write('# color_caps_on: Caps Lock开启时的指示灯颜色\n')
+            f.write(f"color_caps_on = {self.config['color_caps_on']}\n")
+            f.write('# color_caps_off: Caps Lock关闭时的指示灯颜色\n')
+            f.write(f"color_caps_off = {self.config['color_caps_off']}\n")
+            f.write('# color_titlebar: 窗口标题栏颜色\n')
+            f.write(f"color_titlebar = {self.config['color_titlebar']}\n")
+            f.write('\n# 窗口设置\n')
+            f.write('# window_width: 窗口宽度(像素)\n')
+            if save_size:
+                f.write(f"window_width = {self.config['window_width']}\n")
+            f.write('# window_height: 窗口高度(像素)\n')
+            if save_size:
+                f.write(f"window_height = {self.config['window_height']}\n")
+            f.write('# window_x: 窗口X坐标位置(-1表示居中)\n')
+            f.write(f"window_x = {self.config['window_x']}\n")
+            f.write('# window_y: 窗口Y坐标位置(-1表示居中)\n')
+            f.write(f"window_y = {self.config['window_y']}\n")
+            f.write('\n# 其他设置\n')
+            f.write('# always_on_top: 窗口是否始终置顶(true/false)\n')
+            f.write(f"always_on_top = {'true' if self.config['always_on_top'] else 'false'}\n")
+            f.write('# software_list: 自动切换为大写锁定的软件列表(逗号分隔)，其他软件自动切换为小写\n')
+            f.write('#   匹配程序名或窗口标题，不区分大小写：普通文本为包含匹配，=开头为完全匹配，re:开头为正则表达式\n')
+            f.write(f"software_list = {','.join(self.config['software_list'])}\n")  # 写入软件列表
+            f.write('# grid_second_per_block: 时间流可视化中每个方块代表的秒数(默认30秒)\n')
+            f.write(f"grid_second_per_block = {self.config.get('grid_second_per_block', 30)}\n")
+            f.write('# time_stream_renderer: 时间流渲染方式，canvas为同一行连续方块合并为一个图形，bitmap为整条时间流绘制在一张位图中(默认canvas)\n')
+            f.write(f"time_stream_renderer = {self.config.get('time_stream_renderer', 'canvas')}\n")
+            f.write('# render_frame_budget_ms: 两次画布重绘之间的最小间隔，单位毫秒(默认50)\n')
+            f.write(f"render_frame_budget_ms = {self.config.get('render_frame_budget_ms', 50)}\n")
+            f.write('# window_provider: 前台窗口跟踪方式，event为窗口切换时由系统通知，polling为每200ms轮询(默认event，重启后生效)\n')
+            f.write(f"window_provider = {self.config.get('window_provider', 'event')}\n")
+            f.write('# idle_threshold: 无键盘鼠标输入多少秒后降低采样和刷新频率，锁屏时立即降低，0表示不降低(默认60，重启后生效)\n')
+            f.write(f"idle_threshold = {self.config.get('idle_threshold', 60)}\n")
+            f.write('# min_segment_seconds: 短于该秒数的窗口切换(如Alt+Tab、短暂弹窗)并入相邻时间段后再写入数据库，0表示只合并同一程序的连续时间段(默认1，重启后生效)\n')
+            f.write(f"min_segment_seconds = {self.config.get('min_segment_seconds', 1.0)}\n")
+            f.write('# raw_retention_days: 原始记录保留天数，更早的记录在后台汇总为每分钟每程序的时长后删除，0表示永久保留原始记录(默认14)\n')
+            f.write(f"raw_retention_days = {self.config.get('raw_retention_days', 14)}\n")
+            f.write('# minute_retention_days: 分钟汇总保留天数，更早的汇总为每小时每程序的时长(默认90)\n')
+            f.write(f"minute_retention_days = {self.config.get('minute_retention_days', 90)}\n")
+            f.write('# cache_flush_seconds: 时间流缓存写入数据库的间隔秒数，异常退出时未写入的数据从崩溃保护日志恢复(默认300，重启后生效)\n')
+            f.write(f"cache_flush_seconds = {self.config.get('cache_flush_seconds', 300)}\n")
+
+            f.write('# screen_time_refresh_frequency: 屏幕时间刷新频率，单位次/10秒(默认10次)\n')
+            f.write(f"screen_time_refresh_frequency = {self.config.get('screen_time_refresh_frequency', 10)}\n")  # 写入屏幕显示时间刷新率（单位：次/10秒）
+            
+            # 写入进程配置（新格式，带进程头）
+            f.write('\n# 进程配置\n')
+            f.write('# 格式：[进程名称]\n')
+            f.write('# display_name: 在界面中显示的名称\n')
+            f.write('# show_in_screen_time: 是否在屏幕时间统计中显示(true/false)\n')
+            f.write('# show_in_time_stream: 是否在时间流中显示(true/false)\n')
+            
+            # 获取所有进程配置
+            process_config = self.config.get('process_config', {})
+            
+            # 只写入现有的进程配置，不再添加默认进程配置
+            # 这样可以保留用户的自定义设置
+            for process_name, config in process_config.items():
+                f.write(f'\n[{process_name}]\n')
+                f.write(f"display_name = {config.get('display_name', process_name)}\n")
+                f.write(f"show_in_screen_time = {'true' if config.get('show_in_screen_time', True) else 'false'}\n")
+                f.write(f"show_in_time_stream = {'true' if config.get('show_in_time_stream', True) else 'false'}\n")
+        # 默认配置文件已生成
+
+    def get_display_name(self, process_name):
+        """返回进程配置中的显示名称（进程名不区分大小写），没有配置时返回原进程名"""
+        return self.process_display_names.get(process_name.casefold(), process_name)
+
+    def get_app_name_from_hwnd(self, hwnd, window_info):
+        """
+        获取窗口所属程序名，并应用配置的显示名称
+        Args:
+            window_info: 提供者返回的(窗口标题, 窗口类名)
+        """
+        title, class_name = window_info
+        
+        # 特殊处理LockApp.exe
+        if class_name == "LockAppFrame" or (title == "" and "LockApp" in class_name):
+            # 检查进程配置，返回显示名称
+            if 'process_config' in self.config and 'LockApp.exe' in self.config['process_config']:
+                return self.config['process_config']['LockApp.exe']['display_name']
+            return "LockApp.exe"
+        
+        # 特殊处理任务管理器窗口
+        if class_name == "TaskManagerWindow" or "任务管理器" in title or "Task Manager" in title:
+            # 检查进程配置，返回显示名称
+            if 'process_config' in self.config and 'Taskmgr.exe' in self.config['process_config']:
+                return self.config['process_config']['Taskmgr.exe']['display_name']
+            return "任务管理器"
+        
+        # 常规进程名称获取，返回配置的显示名称，没有配置时返回原进程名
+        process_name = self.window_provider.process_name(hwnd)
+        if process_name:
+            return self.get_display_name(process_name)
+        
+        # 无法获取进程名（如权限问题）时回退到窗口标题
+        return title or "Unknown"
+
+    def read_caps_lock_state(self):
+        """读取当前Caps Lock状态"""
+        return self.window_provider.read_caps_lock_state()
+
+    def send_caps_lock_toggle(self):
+        """模拟按下并松开Caps Lock键"""
+        self.window_provider.send_caps_lock_toggle()
+
+    def on_caps_toggle_settled(self, state):
+        """自动切换结束后同步状态和显示"""
+        self.update_caps_lock_display(state)
+
+    def sample_foreground(self):
+        """跟踪线程的采样函数：返回前台窗口句柄和Caps Lock状态"""
+        return self.window_provider.foreground_window(), self.read_caps_lock_state()
+
+    def resolve_foreground_app(self, hwnd):
+        """跟踪线程的解析函数：窗口无效时返回None，否则返回(程序名, 窗口标题)"""
+        window_info = self.window_provider.window_info(hwnd)
+        if window_info is None:
+            return None
+        return self.get_app_name_from_hwnd(hwnd, window_info), window_info[0]
+
+    def sample_activity(self, hwnd):
+        """跟踪线程的活动检测函数：返回距最后一次输入的秒数和是否锁屏"""
+        return self.window_provider.idle_seconds(), self.window_provider.is_locked(hwnd)
+
+    def drain_tracker_snapshots(self):
+        """Tk主循环定时取出跟踪线程发布的快照并处理，用户空闲或锁屏时降低处理频率"""
+        self.apply_pending_snapshots()
+        self.segment_coalescer.release(self.current_app_name, self.current_start_time, time.time())
+        self.maintain_journal()
+        active = self.tracker.active
+        if active != self.user_active:
+            self.user_active = active
+            self.on_user_activity_changed(active)
+        # 继续下一次处理
+        self.tracker_drain_id = self.root.after(100 if active else 1000, self.drain_tracker_snapshots)
+
+    def on_user_activity_changed(self, active):
+        """用户空闲/锁屏与恢复活动之间切换时调用，界面子类在此调整定时任务"""
+
+    def apply_pending_snapshots(self):
+        """按发布顺序处理队列中的全部快照"""
+        while True:
+            try:
+                snapshot = self.tracker.snapshots.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if snapshot.kind == 'switch':
+                    self.handle_window_switch(snapshot.hwnd, snapshot.app_name, snapshot.timestamp)
+                    self.check_caps_lock(snapshot)
+                elif snapshot.kind == 'caps':
+                    self.update_caps_lock_display(snapshot.caps_lock_on)
+                elif snapshot.kind == 'segment':
+                    self.update_time_stream_cache(snapshot.app_name, snapshot.timestamp - snapshot.segment_start, snapshot.timestamp)
+            except Exception as e:
+                self.logger.error(f"处理跟踪快照时出错: {e}")
+
+    def check_caps_lock(self, snapshot):
+        """窗口切换后检查是否需要自动切换大小写（程序名、窗口标题和Caps Lock状态均来自跟踪线程的快照）"""
+        current_status = snapshot.caps_lock_on
+        app_name = snapshot.app_name
+        window_title = snapshot.window_title or ""
+        try:
+            # 检查是否是需要大写的软件（通过程序名或窗口标题，规则已预编译并缓存匹配结果）
+            matched_rule = self.software_matcher.match(app_name, window_title)
+            is_caps_required_software = matched_rule is not None
+            if is_caps_required_software:
+                # 减少日志输出，只在DEBUG模式下记录
+                self.logger.debug(f"检测到需要大写的软件: {matched_rule} (程序: {app_name}, 标题: {window_title})")
+            
+            # 根据软件类型自动切换大小写（切换进行中时也交给状态机，以便更新目标）
+            if is_caps_required_software != current_status or self.caps_toggler.pending:
+                # 减少日志输出，改为DEBUG级别
+                if is_caps_required_software:
+                    self.logger.debug(f"切换到大写 - 检测到软件: {app_name}")
+                else:
+                    self.logger.debug(f"切换到小写 - 当前软件: {app_name}")
+                # 发送按键后由状态机延迟校验，不阻塞主线程
+                self.caps_toggler.request(is_caps_required_software)
+            else:
+                # 状态已正确，只更新显示
+                self.update_caps_lock_display(current_status)
+        except Exception as e:
+            self.logger.error(f"处理窗口切换时出错: {e}")
+            # 即使出错也要更新状态
+            self.update_caps_lock_display(current_status)
+
+    def handle_window_switch(self, hwnd, app_name, now):
+        """
+        窗口切换时记录时长并切换当前程序
+        Args:
+            hwnd: 新的前台窗口句柄（跟踪线程已验证有效性）
+            app_name: 跟踪线程解析出的程序名
+            now: 跟踪线程检测到切换的时间，会话时长按此计算，不受主循环处理延迟影响
+        """
+        # 先处理跨越午夜，保证会话时长记到正确的日期
+        self.check_day_rollover()
+        
+        if self.current_app_name and now > self.current_start_time:
+            elapsed = now - self.current_start_time
+            # 只记录屏幕使用时间（用于统计显示）
+            self.record_screen_time(self.current_app_name, elapsed, end_time=now)
+        
+        self.current_app_name = app_name
+        self.current_start_time = now
+        self.last_hwnd = hwnd
+
+    def record_screen_time(self, app_name, duration, end_time=None):
+        """
+        记录屏幕使用时间（用于统计显示）
+        会话先交给时间段合并器，合并后的记录由write_screen_time写入数据库并累加到今天的内存统计
+        Args:
+            end_time: 会话结束时间（秒），默认为当前时间
+        """
+        if end_time is None:
+            end_time = time.time()
+        start_time = end_time - duration
+        # 会话结束的最终检查点，写入数据库之前异常退出时可以从日志恢复
+        if self.journal:
+            self.journal.checkpoint(app_name, start_time, end_time)
+        self.segment_coalescer.add(app_name, start_time, end_time)
+
+    def write_screen_time(self, app_name, start_time, end_time):
+        """把合并后的时间段写入屏幕时间数据库，并按写入的记录累加今天的统计（与重启后从数据库重建的结果一致）"""
+        timestamp = datetime.datetime.fromtimestamp(end_time).strftime('%Y-%m-%d %H:%M:%S')
+        start_ts = int(start_time)
+        day_key = self.day_key_for(start_ts)
+        # 提交后才推进崩溃保护日志的水位线（由maintain_journal写入日志），提交前崩溃时可以从日志恢复
+        self.write_to_db((timestamp, app_name, end_time - start_time, start_ts, day_key),
+                         on_commit=lambda: setattr(self, 'screen_time_committed', end_time))
+        if day_key == self.today_totals.day_key:
+            self.today_totals.add(app_name, end_time - start_time)
+
+    def check_day_rollover(self):
+        """检测是否跨越午夜：拆分进行中的会话，午夜前的部分记到前一天，并重置今天的累计值"""
+        today_key = self.day_key_for()
+        if today_key == self.today_totals.day_key:
+            return
+        
+        midnight = datetime.datetime.combine(datetime.date.today(), datetime.time.min).timestamp()
+        if self.current_app_name and self.current_start_time < midnight:
+            self.record_screen_time(self.current_app_name, midnight - self.current_start_time, end_time=midnight)
+            self.current_start_time = midnight
+        # 前一天的时间段不与新一天的合并
+        self.segment_coalescer.flush()
+        
+        self.today_totals.reset(today_key)
+        self.logger.info(f"跨越午夜 - 今日统计已重置，日期: {today_key}")
+        
+        # 把前一天的时间流缓存写入数据库，时间流从新的一天重新开始
+        self.flush_time_stream_cache()
+
+    def get_today_stats(self):
+        """
+        获取今天各应用的使用时长（内存累计值 + 当前应用进行中的时长），不访问数据库
+        Returns:
+            list: 按时长降序排列的[(app_name, seconds), ...]
+        """
+        self.check_day_rollover()
+        in_progress = self.pending_screen_time()
+        if self.current_app_name:
+            in_progress.append((self.current_app_name, time.time() - self.current_start_time))
+        return self.today_totals.ranked(in_progress)
+
+    def pending_screen_time(self):
+        """合并器暂存、尚未写入数据库的今天的时间段 [(app_name, seconds)]"""
+        pending = self.segment_coalescer.pending
+        if pending and self.day_key_for(int(pending[1])) == self.today_totals.day_key:
+            return [(pending[0], pending[2] - pending[1])]
+        return []
+
+    def record_time_stream(self, app_name, duration):
+        """记录时间流数据（仅记录窗口切换时的原始数据）"""
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        start_ts, day_key = self.epoch_columns(timestamp, duration)
+        self.write_to_time_stream_db((timestamp, app_name, duration, start_ts, day_key))
+        # 不再写入30分钟数据块，改为使用内存缓存机制
+
+    def update_time_stream_cache(self, app_name, elapsed, end_time):
+        """
+        优化的时间流缓存更新
+        Args:
+            app_name: 时间段内的前台程序
+            elapsed: 时间段长度（秒），由跟踪线程计算
+            end_time: 时间段结束时间
+        """
+        # 只记录有效的时间段（大于0）
+        if app_name and elapsed > 0:
+            # 起始时间与epoch_columns的算法一致（按双精度时长计算），作为(start_ts, app_id)唯一键
+            start_ts = int(end_time) - int(elapsed)
+            self.time_stream_cache.append(app_name, start_ts, elapsed)
+            # 同时写入崩溃保护日志，并更新当前会话的检查点
+            if self.journal:
+                self.journal.segment(app_name, start_ts, elapsed)
+                if self.current_app_name:
+                    self.journal.checkpoint(self.current_app_name, self.current_start_time, end_time)
+            # 缓冲区已满（长时间未能刷新），立即写入数据库，避免覆盖尚未写入的记录
+            if self.time_stream_cache.full:
+                self.logger.warning("时间流缓存已满，提前写入数据库")
+                self.flush_time_stream_cache()
+
+    def flush_time_stream_cache(self):
+        """优化的缓存刷新，减少数据库操作"""
+        if not self.time_stream_cache:
+            return
+        
+        # 减少缓存刷新日志，只在有大量数据时记录
+        total_records = len(self.time_stream_cache)
+        if total_records > 50:  # 只在记录数较多时记录日志
+            self.logger.info(f"缓存刷新 - 应用数: {self.time_stream_cache.app_count()}, 记录数: {total_records}")
+        
+        # 准备插入数据：已写入过的时间段（如重启后重新加载的缓存）由(start_ts, app_id)唯一键upsert合并，无需预先查询
+        records_to_insert = []
+        for start_ts, app_name, duration in self.time_stream_cache:
+            timestamp = self.stream_timestamp(start_ts, duration)
+            records_to_insert.append((timestamp, app_name, duration, start_ts, self.day_key_for(start_ts)))
+        
+        # 批量写入（同一事务）
+        if records_to_insert:
+            self.db_writer.submit(self.time_stream_db_file(), self.history_insert_statements('time_stream', records_to_insert))
+            # 缓存已交给写入线程，切换崩溃保护日志，旧文件在写入线程提交后删除
+            if self.journal and self.journal.rotate():
+                self.journal_commit = self.db_writer.commit_event()
+            
+            # 减少日志输出，只在有大量数据时记录
+            if len(records_to_insert) > 50:
+                self.logger.info(f"缓存刷新完成 - 写入 {len(records_to_insert)} 条记录")
+        
+        # 清空缓存
+        self.time_stream_cache.clear()
+        
+        # 强制垃圾回收
+        gc.collect()
+
+    def format_duration(self, seconds):
+        """格式化时长"""
+        seconds = int(seconds)
+        h = seconds // 3600
+        m = (seconds % 3600) // 60
+        s = seconds % 60
+        if h > 0:
+            return f"{h:02d}:{m:02d}:{s:02d}"
+        return f"{m:02d}:{s:02d}"
+
+    def db_file(self):
+        """获取SQLite数据库文件名"""
+        return "screen_time_history.db"
+
+    def time_stream_db_file(self):
+        """获取时间流SQLite数据库文件名"""
+        return "time_stream_history.db"
+
+    def init_db(self):
+        """初始化SQLite数据库，创建表"""
+        # 整数时间戳列的迁移状态：表名 -> 是否已完成回填并可使用整数列查询
+        self.epoch_schema_ready = {}
+        # 按天按应用汇总表是否已完成重建，可直接用于统计查询
+        self.daily_totals_ready = False
+        # 字典编码的状态：表名 -> 新记录是否写入{table}_rows；数据库路径 -> {程序名: app_id}
+        self.apps_schema_live = {}
+        self.app_ids = {}
+        # time_stream_rows是否已有唯一键，可以使用upsert写入
+        self.stream_key_ready = False
+        # 待执行的分批迁移任务
+        self.schema_migrations = []
+        
+        # 初始化屏幕使用时间数据库
+        conn = self.db_manager.get_connection(self.db_file())
+        cursor = conn.cursor()
+        # 按天按应用的汇总表，与screen_time在同一事务中增量更新，统计图表只需读取几十行
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS daily_app_totals (
+                day_key INTEGER NOT NULL,
+                app_name TEXT NOT NULL,
+                total_duration REAL NOT NULL,
+                PRIMARY KEY (day_key, app_name)
+            ) WITHOUT ROWID
+        ''')
+        if self.schema_object_type(conn, 'screen_time') is None:
+            # 新数据库直接创建最新结构
+            self.create_dictionary_schema(conn, 'screen_time')
+            self.daily_totals_ready = True
+        else:
+            # start_ts: 起始时间（UTC秒数），day_key: 起始时间的本地日期（如20251125）
+            if self.schema_object_type(conn, 'screen_time') == 'table':
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_screen_time_timestamp ON screen_time (timestamp)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_screen_time_app ON screen_time (app_name)')
+            conn.commit()
+            self.prepare_epoch_schema(conn, self.db_file(), 'screen_time')
+            self.prepare_daily_totals(conn)
+        self.prepare_apps_schema(conn, self.db_file(), 'screen_time')
+        
+        # 初始化时间流数据库
+        conn = self.db_manager.get_connection(self.time_stream_db_file())
+        cursor = conn.cursor()
+        if self.schema_object_type(conn, 'time_stream') is None:
+            self.create_dictionary_schema(conn, 'time_stream')
+        elif self.schema_object_type(conn, 'time_stream') == 'table':
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_time_stream_timestamp ON time_stream (timestamp)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_time_stream_app ON time_stream (app_name)')
+        
+        # 水位线表：已记录到日志的最后一个像素格时间戳只保存一行，取代逐条记录的logged_pixels表
+        cursor.execute(self.WATERMARKS_TABLE_SQL)
+        
+        conn.commit()
+        self.prepare_epoch_schema(conn, self.time_stream_db_file(), 'time_stream')
+        self.prepare_apps_schema(conn, self.time_stream_db_file(), 'time_stream')
+        self.prepare_stream_key(conn)
+        self.prepare_pixel_watermark(conn)
+
+    def schema_object_type(self, conn, name):
+        """返回数据库对象的类型（'table'、'view'等），不存在时返回None"""
+        row = conn.execute('SELECT type FROM sqlite_master WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def dictionary_schema_statements(self, table, legacy=False):
+        """字典编码结构的建表、建索引和视图语句（均可重复执行）"""
+        view_sql = self.APPS_VIEW_LEGACY_SQL if legacy else self.APPS_VIEW_SQL
+        statements = [self.APPS_TABLE_SQL, self.ROWS_TABLE_SQL.format(table=table)]
+        statements.extend(self.ROWS_INDEXES[table])
+        statements.append(view_sql.format(table=table))
+        return [(sql, None) for sql in statements]
+
+    def stream_key_statements(self):
+        """创建time_stream_rows唯一键的语句，删除被其取代的起始时间索引"""
+        return [(self.STREAM_KEY_INDEX_SQL, None), ('DROP INDEX IF EXISTS idx_time_stream_rows_start', None)]
+
+    def create_dictionary_schema(self, conn, table):
+        """新数据库：直接创建字典编码结构并更新到最新版本"""
+        statements = self.dictionary_schema_statements(table)
+        if table == 'time_stream':
+            statements.extend(self.stream_key_statements())
+            self.stream_key_ready = True
+        for sql, _ in statements:
+            conn.execute(sql)
+        conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSIONS[table]}')
+        conn.commit()
+        self.epoch_schema_ready[table] = True
+
+    def prepare_epoch_schema(self, conn, db_path, table):
+        """
+        检查数据库结构版本，为旧数据库增加整数时间戳列并登记分批回填任务
+        新增列操作只修改表定义，耗时与数据量无关；耗时的回填和建索引由run_schema_migration_step分批完成
+        """
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= self.EPOCH_SCHEMA_VERSION:
+            self.epoch_schema_ready[table] = True
+            return
+        
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        for column in ('start_ts', 'day_key'):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} INTEGER')
+        conn.commit()
+        
+        max_id = conn.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0]
+        if max_id is None:
+            # 空表直接建索引，并更新到字典编码之前的最新版本（字典编码迁移随后执行）
+            for index_sql in self.EPOCH_INDEXES[table]:
+                conn.execute(index_sql)
+            conn.execute(f'PRAGMA user_version = {self.APPS_SCHEMA_VERSIONS[table] - 1}')
+            conn.commit()
+            self.epoch_schema_ready[table] = True
+            return
+        
+        self.epoch_schema_ready[table] = False
+        self.schema_migrations.append({
+            'kind': 'epoch',
+            'db_path': db_path,
+            'table': table,
+            'next_id': None,  # 下一批回填的起始id，None表示尚未定位
+            'max_id': max_id,  # 迁移开始时的最大id，之后写入的记录已带整数时间戳
+            'finalizing': False
+        })
+        self.logger.info(f"数据库结构迁移 - {table}表需要回填整数时间戳，最大id: {max_id}")
+
+    def prepare_daily_totals(self, conn):
+        """检查汇总表版本，旧数据库登记一次汇总表重建任务（在整数时间戳回填之后执行）"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= self.DAILY_TOTALS_SCHEMA_VERSION:
+            self.daily_totals_ready = True
+            return
+        
+        self.schema_migrations.append({
+            'kind': 'daily_totals',
+            'db_path': self.db_file(),
+            'table': 'daily_app_totals',
+            'finalizing': False
+        })
+        self.logger.info("数据库结构迁移 - 需要根据历史数据重建daily_app_totals汇总表")
+
+    def prepare_apps_schema(self, conn, db_path, table):
+        """检查字典编码的版本，旧数据库登记迁移任务（在整数时间戳和汇总表迁移之后执行）"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= self.APPS_SCHEMA_VERSIONS[table]:
+            self.apps_schema_live[table] = True
+            self.load_app_ids(conn, db_path)
+            return
+        
+        # 上次迁移中断时旧表已改名，新记录已在写入新表
+        resumed = self.schema_object_type(conn, f'{table}_legacy') is not None
+        self.apps_schema_live[table] = resumed
+        if resumed:
+            self.load_app_ids(conn, db_path)
+        self.schema_migrations.append({
+            'kind': 'apps',
+            'db_path': db_path,
+            'table': table,
+            'started': False,
+            'next_id': None,
+            'max_id': None,
+            'finalizing': False
+        })
+        self.logger.info(f"数据库结构迁移 - {table}表需要把程序名改为字典编码{'（继续上次的迁移）' if resumed else ''}")
+
+    def prepare_stream_key(self, conn):
+        """检查time_stream唯一键的版本，旧数据库登记去重和建唯一键任务（在字典编码迁移之后执行）"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= self.STREAM_KEY_SCHEMA_VERSION:
+            self.stream_key_ready = True
+            return
+        
+        self.schema_migrations.append({
+            'kind': 'stream_key',
+            'db_path': self.time_stream_db_file(),
+            'table': 'time_stream',
+            'next_id': None,
+            'max_id': None,  # 迁移开始时的最大id，之后写入的记录在最后一步统一去重
+            'finalizing': False
+        })
+        self.logger.info("数据库结构迁移 - time_stream表需要去除重复记录并建立唯一键")
+
+    def prepare_pixel_watermark(self, conn):
+        """检查像素格水位线的版本，旧数据库登记删除logged_pixels表的任务（在唯一键迁移之后执行）"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= self.PIXEL_WATERMARK_SCHEMA_VERSION:
+            return
+        
+        self.schema_migrations.append({
+            'kind': 'pixel_watermark',
+            'db_path': self.time_stream_db_file(),
+            'table': 'logged_pixels',
+            'finalizing': False
+        })
+        self.logger.info("数据库结构迁移 - logged_pixels表将改为水位线记录")
+
+    def load_app_ids(self, conn, db_path):
+        """加载程序名到app_id的映射，写入记录时直接使用整数id"""
+        self.app_ids[db_path] = dict(conn.execute('SELECT name, id FROM apps'))
+
+    def intern_app_id(self, db_path, app_name):
+        """
+        返回程序名的app_id，内存中没有时查询apps表（新程序名在写入线程提交之前查不到）
+        Returns:
+            int或None: None表示程序名尚未写入apps表
+        """
+        app_ids = self.app_ids.setdefault(db_path, {})
+        app_id = app_ids.get(app_name)
+        if app_id is None:
+            try:
+                row = self.db_manager.get_connection(db_path).execute(
+                    'SELECT id FROM apps WHERE name = ?', (app_name,)
+                ).fetchone()
+            except sqlite3.OperationalError:
+                # 迁移刚开始，apps表尚未由写入线程创建
+                row = None
+            if row:
+                app_id = app_ids[app_name] = row[0]
+        return app_id
+
+    def history_db_file(self, table):
+        """返回记录表所在的数据库文件"""
+        return self.db_file() if table == 'screen_time' else self.time_stream_db_file()
+
+    def history_insert_statements(self, table, rows):
+        """
+        生成写入screen_time/time_stream记录的语句
+        Args:
+            rows: [(timestamp, app_name, duration, start_ts, day_key), ...]
+        """
+        if not self.apps_schema_live.get(table):
+            return [(f'INSERT INTO {table} (timestamp, app_name, duration, start_ts, day_key) VALUES (?, ?, ?, ?, ?)', rows)]
+        
+        db_path = self.history_db_file(table)
+        known_rows = []
+        new_rows = []
+        new_names = set()
+        for row in rows:
+            app_id = self.intern_app_id(db_path, row[1])
+            if app_id is None:
+                new_rows.append(row)
+                new_names.add(row[1])
+            else:
+                known_rows.append((row[0], app_id, row[2], row[3], row[4]))
+        
+        if table == 'time_stream' and self.stream_key_ready:
+            insert_sql = self.STREAM_UPSERT_SQL
+        else:
+            insert_sql = f'INSERT INTO {table}_rows (timestamp, app_id, duration, start_ts, day_key) VALUES (?, {{app_id}}, ?, ?, ?)'
+        statements = []
+        if new_names:
+            # 新程序名先登记到apps表，记录在同一事务中按名称查出id
+            statements.append(('INSERT OR IGNORE INTO apps (name) VALUES (?)', [(name,) for name in new_names]))
+            statements.append((insert_sql.format(app_id='(SELECT id FROM apps WHERE name = ?)'), new_rows))
+        if known_rows:
+            statements.append((insert_sql.format(app_id='?'), known_rows))
+        return statements
+
+    def daily_totals_rebuild_statements(self):
+        """
+        重建汇总表的语句，在写入线程的同一事务中执行，读取方始终看到完整的旧数据或新数据
+        超出保留期的原始记录已汇总到screen_time_buckets，一并计入
+        """
+        source = 'SELECT day_key, app_name, duration FROM screen_time'
+        if self.schema_object_type(self.db_manager.get_connection(self.db_file()), 'screen_time_buckets'):
+            source += ' UNION ALL SELECT b.day_key, a.name, b.duration FROM screen_time_buckets b JOIN apps a ON a.id = b.app_id'
+        return [
+            ('DELETE FROM daily_app_totals', None),
+            ('INSERT INTO daily_app_totals (day_key, app_name, total_duration) '
+             f'SELECT day_key, app_name, SUM(duration) FROM ({source}) '
+             'WHERE day_key IS NOT NULL GROUP BY day_key, app_name', None),
+        ]
+
+    def rebuild_daily_app_totals(self):
+        """根据screen_time原始数据重建按天按应用汇总表（右键菜单“重建统计”）"""
+        self.logger.info("重建统计 - 开始根据历史数据重建daily_app_totals汇总表")
+        self.db_writer.submit(self.db_file(), self.daily_totals_rebuild_statements())
+
+    def run_schema_migration_step(self):
+        """分批执行数据库结构迁移，每次只提交一小段工作给后台写入线程，不阻塞启动和UI"""
+        if not self.schema_migrations:
+            return
+        
+        task = self.schema_migrations[0]
+        table = task['table']
+        try:
+            conn = self.db_manager.get_connection(task['db_path'])
+            if task['finalizing']:
+                # 等待写入线程提交完成，确认版本号已更新后再切换查询方式
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if task['kind'] == 'epoch' and version >= self.EPOCH_SCHEMA_VERSION:
+                    self.epoch_schema_ready[table] = True
+                    self.schema_migrations.pop(0)
+                    self.on_schema_state_changed()
+                    self.logger.info(f"数据库结构迁移完成 - {table}表已切换为整数时间戳查询")
+                elif task['kind'] == 'daily_totals' and version >= self.DAILY_TOTALS_SCHEMA_VERSION:
+                    self.daily_totals_ready = True
+                    self.schema_migrations.pop(0)
+                    self.on_schema_state_changed()
+                    self.logger.info("数据库结构迁移完成 - 统计查询已切换为daily_app_totals汇总表")
+                elif task['kind'] == 'apps' and version >= self.APPS_SCHEMA_VERSIONS[table]:
+                    self.schema_migrations.pop(0)
+                    self.logger.info(f"数据库结构迁移完成 - {table}表已改为字典编码")
+                elif task['kind'] == 'stream_key' and version >= self.STREAM_KEY_SCHEMA_VERSION:
+                    self.stream_key_ready = True
+                    self.schema_migrations.pop(0)
+                    self.on_schema_state_changed()
+                    self.logger.info("数据库结构迁移完成 - time_stream表已建立唯一键，写入改为upsert")
+                elif task['kind'] == 'pixel_watermark' and version >= self.PIXEL_WATERMARK_SCHEMA_VERSION:
+                    self.schema_migrations.pop(0)
+                    self.logger.info("数据库结构迁移完成 - logged_pixels表已删除，改为水位线记录")
+            elif task['kind'] == 'apps':
+                self.run_apps_migration_step(conn, task)
+            elif task['kind'] == 'stream_key':
+                self.run_stream_key_migration_step(conn, task)
+            elif task['kind'] == 'pixel_watermark':
+                # 用旧表中最后一个像素格的时间戳初始化水位线（已有水位线时保留），然后删除旧表及其索引
+                statements = [('SAVEPOINT pixel_watermark', None)]
+                if self.schema_object_type(conn, 'logged_pixels') == 'table':
+                    statements.append((
+                        'INSERT OR IGNORE INTO watermarks (name, value) '
+                        'SELECT ?, MAX(time_range_start) FROM logged_pixels HAVING MAX(time_range_start) IS NOT NULL',
+                        [(self.PIXEL_WATERMARK,)]
+                    ))
+                    statements.append(('DROP TABLE logged_pixels', None))
+                statements.append((f'PRAGMA user_version = {self.PIXEL_WATERMARK_SCHEMA_VERSION}', None))
+                statements.append(('RELEASE pixel_watermark', None))
+                self.db_writer.submit(task['db_path'], statements)
+                task['finalizing'] = True
+            elif task['kind'] == 'daily_totals':
+                # 汇总表依赖day_key，必须在screen_time回填完成之后重建
+                statements = self.daily_totals_rebuild_statements()
+                statements.append((f'PRAGMA user_version = {self.DAILY_TOTALS_SCHEMA_VERSION}', None))
+                self.db_writer.submit(task['db_path'], statements)
+                task['finalizing'] = True
+            else:
+                if task['next_id'] is None:
+                    # 按主键顺序定位第一条未回填的记录（支持中断后继续迁移）
+                    row = conn.execute(
+                        f'SELECT id FROM {table} WHERE start_ts IS NULL AND id <= ? ORDER BY id LIMIT 1',
+                        (task['max_id'],)
+                    ).fetchone()
+                    task['next_id'] = row[0] if row else task['max_id'] + 1
+                
+                if task['next_id'] <= task['max_id']:
+                    last_id = task['next_id'] + self.MIGRATION_CHUNK_ROWS - 1
+                    self.db_writer.submit(task['db_path'], [
+                        (self.EPOCH_BACKFILL_SQL.format(table=table), [(task['next_id'], last_id)])
+                    ])
+                    task['next_id'] = last_id + 1
+                
+                if task['next_id'] > task['max_id']:
+                    # 回填完成后再建索引，避免回填过程中逐行维护索引
+                    statements = [(index_sql, None) for index_sql in self.EPOCH_INDEXES[table]]
+                    statements.append((f'PRAGMA user_version = {self.EPOCH_SCHEMA_VERSION}', None))
+                    self.db_writer.submit(task['db_path'], statements)
+                    task['finalizing'] = True
+        except Exception as e:
+            self.logger.error(f"数据库结构迁移出错 ({table}): {e}")
+        
+        self.root.after(self.MIGRATION_STEP_MS, self.run_schema_migration_step)
+
+    def run_apps_migration_step(self, conn, task):
+        """
+        字典编码迁移的一步
+        第一步把旧表改名为{table}_legacy并创建新表和视图，之后的新记录写入新表；
+        然后按id分批把旧记录复制到新表，最后删除旧表并把视图改为只读取新表
+        """
+        table = task['table']
+        legacy = f'{table}_legacy'
+        if not task['started']:
+            # 改名和建表在同一个保存点中执行，读取方始终能看到完整的表或视图
+            statements = [('SAVEPOINT apps_schema', None)]
+            if self.schema_object_type(conn, table) == 'table':
+                statements.append((f'ALTER TABLE {table} RENAME TO {legacy}', None))
+            statements.extend(self.dictionary_schema_statements(table, legacy=True))
+            # 新记录的id从旧表的最大id之后开始，复制的旧记录保留原id
+            statements.append((
+                f"INSERT INTO sqlite_sequence (name, seq) SELECT '{table}_rows', (SELECT COALESCE(MAX(id), 0) FROM {legacy}) "
+                f"WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = '{table}_rows')", None
+            ))
+            statements.append(('RELEASE apps_schema', None))
+            self.db_writer.submit(task['db_path'], statements)
+            # 写入线程按提交顺序执行，之后提交的记录都会在新表创建之后写入
+            self.apps_schema_live[table] = True
+            task['started'] = True
+            return
+        
+        if task['next_id'] is None:
+            if self.schema_object_type(conn, legacy) is None:
+                # 等待写入线程完成改名
+                return
+            min_id, max_id = conn.execute(f'SELECT MIN(id), MAX(id) FROM {legacy}').fetchone()
+            task['next_id'], task['max_id'] = (min_id, max_id) if min_id is not None else (1, 0)
+        
+        if task['next_id'] <= task['max_id']:
+            last_id = task['next_id'] + self.MIGRATION_CHUNK_ROWS - 1
+            params = [(task['next_id'], last_id)]
+            self.db_writer.submit(task['db_path'], [(sql.format(table=table), params) for sql in self.APPS_COPY_SQL])
+            task['next_id'] = last_id + 1
+        
+        if task['next_id'] > task['max_id']:
+            self.db_writer.submit(task['db_path'], [
+                ('SAVEPOINT apps_schema', None),
+                (f'DROP VIEW IF EXISTS {table}', None),
+                (self.APPS_VIEW_SQL.format(table=table), None),
+                (f'DROP TABLE IF EXISTS {legacy}', None),
+                (f'PRAGMA user_version = {self.APPS_SCHEMA_VERSIONS[table]}', None),
+                ('RELEASE apps_schema', None),
+            ])
+            task['finalizing'] = True
+
+    def run_stream_key_migration_step(self, conn, task):
+        """
+        唯一键迁移的一步：按id分批删除重复记录，最后在同一个保存点中处理迁移期间新写入的记录并建立唯一键
+        唯一键建立之前新记录仍使用普通INSERT写入
+        """
+        if task['next_id'] is None:
+            min_id, max_id = conn.execute('SELECT MIN(id), MAX(id) FROM time_stream_rows').fetchone()
+            task['next_id'], task['max_id'] = (min_id, max_id) if min_id is not None else (1, 0)
+        
+        if task['next_id'] <= task['max_id']:
+            last_id = task['next_id'] + self.MIGRATION_CHUNK_ROWS - 1
+            self.db_writer.submit(task['db_path'], [(self.STREAM_DEDUPE_SQL, [(task['next_id'], last_id)])])
+            task['next_id'] = last_id + 1
+        
+        if task['next_id'] > task['max_id']:
+            statements = [
+                ('SAVEPOINT stream_key', None),
+                (self.STREAM_DEDUPE_SQL, [(task['max_id'] + 1, 2 ** 63 - 1)]),
+                (self.STREAM_DEDUPE_SUPERSEDED_SQL, [(task['max_id'],)]),
+            ]
+            statements.extend(self.stream_key_statements())
+            statements.append((f'PRAGMA user_version = {self.STREAM_KEY_SCHEMA_VERSION}', None))
+            statements.append(('RELEASE stream_key', None))
+            self.db_writer.submit(task['db_path'], statements)
+            task['finalizing'] = True
+
+    def run_retention_step(self):
+        """
+        数据保留的后台任务：数据库结构迁移完成后，每批处理一张表一天的数据，
+        全部处理完后分批回收空闲页，然后每小时检查一次
+        """
+        delay = self.RETENTION_INTERVAL_MS
+        try:
+            if self.schema_migrations:
+                # 等待结构迁移完成（需要字典编码和唯一键）
+                delay = self.RETENTION_START_MS
+            elif self.config.get('raw_retention_days', 14) > 0 and (self.downsample_oldest_day() or self.reclaim_free_pages()):
+                delay = self.RETENTION_ACTIVE_STEP_MS if self.user_active else self.RETENTION_STEP_MS
+            elif self.retention_days_processed:
+                self.logger.info(f"数据保留 - 已汇总 {self.retention_days_processed} 天的历史记录")
+                self.retention_days_processed = 0
+        except Exception as e:
+            self.logger.error(f"数据保留任务出错: {e}")
+        
+        self.retention_id = self.root.after(delay, self.run_retention_step)
+
+    def downsample_oldest_day(self):
+        """
+        把最早一天超出保留期的数据提交给写入线程汇总：先处理原始记录，再处理分钟桶
+        上一批提交之后才查找下一天，不会重复提交同一天，处理天数也只在提交后计入
+        Returns:
+            bool: 是否提交了汇总任务（或仍在等待上一批提交）
+        """
+        if self.retention_commit is not None:
+            if not self.retention_commit.is_set():
+                return True
+            self.retention_commit = None
+            self.retention_days_processed += 1
+        
+        today = datetime.date.today()
+        raw_days = self.config.get('raw_retention_days', 14)
+        minute_days = max(raw_days, self.config.get('minute_retention_days', 90))
+        raw_cutoff = int((today - datetime.timedelta(days=raw_days)).strftime('%Y%m%d'))
+        minute_cutoff = int((today - datetime.timedelta(days=minute_days)).strftime('%Y%m%d'))
+        
+        for table in self.RETENTION_TABLES:
+            db_path = self.history_db_file(table)
+            conn = self.db_manager.get_connection(db_path)
+            buckets_sql = (self.BUCKETS_TABLE_SQL.format(table=table), None)
+            
+            if table == 'screen_time':
+                day_key = conn.execute('SELECT MIN(day_key) FROM screen_time_rows').fetchone()[0]
+            else:
+                oldest = conn.execute('SELECT MIN(start_ts) FROM time_stream_rows').fetchone()[0]
+                day_key = self.day_key_for(oldest) if oldest is not None else None
+            if day_key is not None and day_key < raw_cutoff:
+                day_start, day_end = self.day_epoch_range(day_key)
+                params = [{'day_key': day_key, 'day_start': day_start, 'day_end': day_end}]
+                day_filter = self.RETENTION_DAY_FILTERS[table]
+                self.db_writer.submit(db_path, [
+                    buckets_sql,
+                    (self.DOWNSAMPLE_RAW_SQL.format(table=table, day_filter=day_filter), params),
+                    (f'DELETE FROM {table}_rows WHERE {day_filter}', params),
+                ])
+                self.retention_commit = self.db_writer.commit_event()
+                self.logger.debug(f"数据保留 - {table}表{day_key}的原始记录汇总为分钟桶")
+                return True
+            
+            if not self.schema_object_type(conn, f'{table}_buckets'):
+                continue
+            oldest = conn.execute(f'SELECT MIN(bucket_start) FROM {table}_buckets WHERE resolution = 60').fetchone()[0]
+            day_key = self.day_key_for(oldest) if oldest is not None else None
+            if day_key is not None and day_key < minute_cutoff:
+                day_start, day_end = self.day_epoch_range(day_key)
+                params = [{'day_key': day_key, 'day_start': day_start, 'day_end': day_end}]
+                self.db_writer.submit(db_path, [
+                    (self.DOWNSAMPLE_MINUTES_SQL.format(table=table), params),
+                    (f'DELETE FROM {table}_buckets WHERE resolution = 60 AND bucket_start >= :day_start AND bucket_start < :day_end', params),
+                ])
+                self.retention_commit = self.db_writer.commit_event()
+                self.logger.debug(f"数据保留 - {table}表{day_key}的分钟桶汇总为小时桶")
+                return True
+        return False
+
+    def reclaim_free_pages(self):
+        """
+        把删除数据后的空闲页归还给文件系统：增量回收模式下每批回收一部分；
+        旧数据库（未启用自动回收）空闲页超过四分之一时执行一次VACUUM并切换为增量回收。
+        VACUUM执行期间写入线程的其他提交都要等待，只在用户空闲时提交，退出时由写入线程中断
+        Returns:
+            bool: 是否提交了回收任务
+        """
+        for db_path in (self.db_file(), self.time_stream_db_file()):
+            conn = self.db_manager.get_connection(db_path)
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free_pages:
+                continue
+            auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+            if auto_vacuum == 2:
+                self.db_writer.submit_maintenance(db_path, [f'PRAGMA incremental_vacuum({self.RETENTION_VACUUM_PAGES})'])
+                return True
+            page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+            if auto_vacuum == 0 and free_pages > page_count // 4 and db_path not in self.vacuumed_db_files:
+                if self.user_active:
+                    # 等待用户空闲后再整理
+                    return True
+                self.logger.info(f"数据保留 - 空闲页 {free_pages}/{page_count}，整理数据库并启用增量回收: {db_path}")
+                self.db_writer.submit_maintenance(db_path, ['PRAGMA auto_vacuum = INCREMENTAL', 'VACUUM'])
+                self.vacuumed_db_files.add(db_path)
+                return True
+        return False
+
+    def epoch_columns(self, timestamp, duration):
+        """
+        由记录时刻的本地时间字符串和时长计算整数时间戳列
+        Returns:
+            tuple: (start_ts, day_key) 起始时间的UTC秒数和本地日期键
+        """
+        end_ts = int(time.mktime(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S')))
+        start_ts = end_ts - int(duration)
+        return start_ts, self.day_key_for(start_ts)
+
+    def stream_timestamp(self, start_ts, duration):
+        """由起始时间和时长还原记录时刻的本地时间字符串（epoch_columns的逆运算）"""
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_ts + int(duration)))
+
+    def day_key_for(self, epoch_seconds=None):
+        """获取指定时间（默认当前时间）的本地日期键，如20251125"""
+        return int(time.strftime('%Y%m%d', time.localtime(epoch_seconds)))
+
+    def day_epoch_range(self, day_key):
+        """
+        获取指定日期键当天的整数时间范围
+        Returns:
+            tuple: (当天0点的UTC秒数, 次日0点的UTC秒数)
+        """
+        day_start = datetime.datetime.strptime(str(day_key), '%Y%m%d')
+        day_end = day_start + datetime.timedelta(days=1)
+        return int(day_start.timestamp()), int(day_end.timestamp())
+
+    def today_epoch_range(self):
+        """
+        获取今天的整数时间范围
+        Returns:
+            tuple: (今天0点的UTC秒数, 明天0点的UTC秒数, 今天的日期键)
+        """
+        today = datetime.date.today()
+        day_start = datetime.datetime.combine(today, datetime.time.min)
+        day_end = day_start + datetime.timedelta(days=1)
+        return int(day_start.timestamp()), int(day_end.timestamp()), int(today.strftime('%Y%m%d'))
+
+    def write_to_db(self, data, on_commit=None):
+        """将数据写入SQLite数据库，并在同一事务中累加按天按应用汇总表"""
+        timestamp, app_name, duration, start_ts, day_key = data
+        # 由后台写入线程分组提交，避免在UI线程中等待磁盘同步
+        self.db_writer.submit(self.db_file(), self.history_insert_statements('screen_time', [data]) + [
+            ('INSERT INTO daily_app_totals (day_key, app_name, total_duration) VALUES (?, ?, ?) '
+             'ON CONFLICT (day_key, app_name) DO UPDATE SET total_duration = total_duration + excluded.total_duration',
+             [(day_key, app_name, duration)]),
+        ], on_commit)
+
+    def write_to_time_stream_db(self, data):
+        """将数据写入时间流SQLite数据库"""
+        self.db_writer.submit(self.time_stream_db_file(), self.history_insert_statements('time_stream', [data]))
+
+    def get_today_time_stream_from_db(self):
+        """从时间流数据库获取今天的全部历史记录"""
+        conn = self.db_manager.get_connection(self.time_stream_db_file())
+        cursor = conn.cursor()
+        if self.epoch_schema_ready.get('time_stream'):
+            # 按起始时间的整数范围查询，走idx_time_stream_start索引
+            day_start, day_end, _ = self.today_epoch_range()
+            cursor.execute(
+                'SELECT timestamp, app_name, duration FROM time_stream WHERE start_ts >= ? AND start_ts < ? ORDER BY start_ts',
+                (day_start, day_end)
+            )
+        else:
+            # 迁移完成前使用文本时间戳的范围查询，同样可以走idx_time_stream_timestamp索引
+            today = datetime.date.today()
+            cursor.execute(
+                'SELECT timestamp, app_name, duration FROM time_stream WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp',
+                (today.strftime('%Y-%m-%d'), (today + datetime.timedelta(days=1)).strftime('%Y-%m-%d'))
+            )
+        rows = cursor.fetchall()
+        return rows
+
+    def get_screen_time_from_db(self):
+        """从数据库获取按应用分组的屏幕使用时间数据"""
+        conn = self.db_manager.get_connection(self.db_file())
+        cursor = conn.cursor()
+        if self.daily_totals_ready:
+            # 直接读取汇总表，按主键查询今天的几十行，与历史数据量无关
+            _, _, today_key = self.today_epoch_range()
+            cursor.execute(
+                'SELECT app_name, total_duration FROM daily_app_totals WHERE day_key = ?',
+                (today_key,)
+            )
+        elif self.epoch_schema_ready.get('screen_time'):
+            # 按本地日期键查询，idx_screen_time_day_app为覆盖索引，无需回表
+            _, _, today_key = self.today_epoch_range()
+            cursor.execute(
+                'SELECT app_name, SUM(duration) AS total_duration FROM screen_time WHERE day_key = ? GROUP BY app_name',
+                (today_key,)
+            )
+        else:
+            # 迁移完成前使用文本时间戳的范围查询
+            today = datetime.date.today()
+            cursor.execute(
+                'SELECT app_name, SUM(duration) AS total_duration FROM screen_time WHERE timestamp >= ? AND timestamp < ? GROUP BY app_name',
+                (today.strftime('%Y-%m-%d'), (today + datetime.timedelta(days=1)).strftime('%Y-%m-%d'))
+            )
+        rows = cursor.fetchall()
+        
+        # 将结果转换为字典格式
+        screen_time_dict = {}
+        for app_name, total_duration in rows:
+            screen_time_dict[app_name] = total_duration
+        
+        return screen_time_dict
+
+
+class TrackerService(ScreenTimeTracker):
+    """
+    无界面的跟踪服务：采样、自动大小写规则和数据持久化
+    通过本地IPC向界面客户端推送当前状态、今天的统计和尚未写入数据库的时间流，
+    界面可以随时关闭或重启而不中断跟踪，也可以同时连接多个界面
+    """
+
+    def __init__(self, root, address=None, window_provider=None):
+        """
+        Args:
+            address: 本地IPC地址，默认为当前用户私有的地址（见default_service_address）
+        """
+        self.root = root
+        self.server = None
+        address = address or default_service_address()
+        self.setup_logging()
+        self.read_config()
+        self.init_tracking(window_provider)
+        self.init_storage()
+        
+        # 客户端的连接和消息在IPC线程中到达，交给主循环处理
+        self.server = ServiceServer(address, self.logger,
+                                    on_connect=lambda conn: self.root.after(0, self.send_welcome, conn),
+                                    on_message=lambda conn, message: self.root.after(0, self.handle_client_message, conn, message))
+        self.server.start()
+        self.start_tracking()
+        self.schedule_rollover_check()
+        self.logger.info(f"跟踪服务已启动 - 地址: {address}")
+
+    def schedule_rollover_check(self):
+        """定时检测跨越午夜（本地模式下由界面的屏幕时间刷新任务负责）"""
+        self.check_day_rollover()
+        self.root.after(10000, self.schedule_rollover_check)
+
+    def shutdown(self):
+        """停止跟踪、写入剩余数据并断开所有客户端"""
+        self.logger.info("跟踪服务退出 - 开始写入剩余数据")
+        self.stop_tracking()
+        self.server.stop()
+        self.close_storage()
+        self.logger.info("跟踪服务退出完成")
+
+    def state_message(self):
+        return {'t': 'state', 'app': self.current_app_name, 'start': self.current_start_time, 'caps': self.caps_lock_on}
+
+    def totals_message(self):
+        # 合并器暂存的时间段稍后才写入，一并推送，客户端只需再加上当前会话
+        totals = self.today_totals.as_dict()
+        for app_name, seconds in self.pending_screen_time():
+            totals[app_name] = totals.get(app_name, 0.0) + seconds
+        return {'t': 'totals', 'day': self.today_totals.day_key, 'totals': totals}
+
+    def schema_message(self):
+        return {'t': 'schema', **self.schema_state()}
+
+    def send_welcome(self, conn):
+        """新客户端连接：推送数据库结构状态、当前状态、今天的统计和尚未写入数据库的时间流"""
+        self.server.send(conn, {'t': 'hello'})
+        self.server.send(conn, self.schema_message())
+        self.server.send(conn, self.state_message())
+        self.server.send(conn, self.totals_message())
+        for start_ts, app_name, duration in self.time_stream_cache:
+            self.server.send(conn, {'t': 'seg', 'app': app_name, 'start': start_ts, 'd': duration})
+
+    def on_schema_state_changed(self):
+        self.server.broadcast(self.schema_message())
+
+    def handle_client_message(self, conn, message):
+        """
+        处理客户端消息（客户端只读打开数据库，写操作都由服务执行）
+        reload: 重新读取配置文件
+        rebuild: 重建daily_app_totals汇总表
+        watermark: 更新像素格日志的水位线
+        stop: 停止服务
+        """
+        kind = message.get('t')
+        if kind == 'reload':
+            self.read_config()
+            self.logger.info("跟踪服务已重新读取配置")
+        elif kind == 'rebuild':
+            self.rebuild_daily_app_totals()
+        elif kind == 'watermark':
+            self.db_writer.submit(self.time_stream_db_file(), [
+                (self.WATERMARK_UPSERT_SQL, [(self.PIXEL_WATERMARK, message['value'])])
+            ])
+        elif kind == 'stop':
+            self.root.quit()
+
+    def handle_window_switch(self, hwnd, app_name, now):
+        super().handle_window_switch(hwnd, app_name, now)
+        # 上一个会话已计入统计，推送新的统计和当前状态
+        self.server.broadcast(self.totals_message())
+        self.server.broadcast(self.state_message())
+
+    def update_caps_lock_display(self, caps_lock_on):
+        changed = caps_lock_on != self.caps_lock_on
+        super().update_caps_lock_display(caps_lock_on)
+        if changed and self.server:
+            self.server.broadcast(self.state_message())
+
+    def update_time_stream_cache(self, app_name, elapsed, end_time):
+        super().update_time_stream_cache(app_name, elapsed, end_time)
+        if app_name and elapsed > 0:
+            start_ts = int(end_time) - int(elapsed)
+            self.server.broadcast({'t': 'seg', 'app': app_name, 'start': start_ts, 'd': elapsed})
+
+    def check_day_rollover(self):
+        day_key = self.today_totals.day_key
+        super().check_day_rollover()
+        if self.today_totals.day_key != day_key:
+            self.server.broadcast(self.totals_message())
+            self.server.broadcast(self.state_message())
+
+    def flush_time_stream_cache(self):
+        if not self.time_stream_cache:
+            return
+        super().flush_time_stream_cache()
+        # 写入线程提交后再通知客户端（不阻塞采样），客户端清空缓存后可以从数据库读到这些记录
+        self.notify_flushed(self.db_writer.commit_event())
+
+    def notify_flushed(self, committed):
+        """
+        已写入的时间流提交后通知客户端清空缓存，并重新推送刷新之后新增的时间段
+        （这些时间段在等待提交期间已推送过，会被flushed一并清掉）
+        """
+        if not committed.is_set():
+            self.root.after(50, self.notify_flushed, committed)
+            return
+        self.server.broadcast({'t': 'flushed'})
+        for start_ts, app_name, duration in self.time_stream_cache:
+            self.server.broadcast({'t': 'seg', 'app': app_name, 'start': start_ts, 'd': duration})
+
+
+class CapsLockChecker(ScreenTimeTracker):
+    """
+    tkinter界面：Caps Lock状态指示、屏幕时间统计图表和时间流
+    本地模式下在本进程内跟踪；客户端模式下连接TrackerService，只显示服务推送的状态和统计
+    """
+    
+    def __init__(self, root, service_address=None, window_provider=None):
+        """
+        Args:
+            service_address: 跟踪服务的IPC地址，提供时以客户端模式运行
+            window_provider: 前台窗口信息提供者（仅本地模式使用），默认按配置选择win32实现
+        """
         self.root = root
         self.root.title("Caps Lock 状态检测")
+        self.service_client = None
         
         # 初始化日志功能
         self.setup_logging()
@@ -58,18 +3548,14 @@ class CapsLockChecker:
         
         # 设置窗口初始大小和位置
         self.root.geometry("250x180+100+100")
-        # 初始化Caps Lock状态
-        self.caps_lock_on = win32api.GetKeyState(win32con.VK_CAPITAL) & 1 != 0
-        self.last_hwnd = None
-        self.usage_stats = {}
-        
-        # 初始化应用跟踪变量
-        self.current_app_name = None
-        self.current_start_time = time.time()
-        self.last_flush_time = self.current_start_time
-        self.time_stream_write_interval = 30
+        # 读取配置文件
+        self.read_config()
+        # 初始化跟踪状态（前台窗口信息提供者、Caps Lock状态、当前会话）
+        self.init_tracking(window_provider)
         self.stats_window = None
         self.stats_canvas = None
+        self.stats_chart_items = {}  # 直方图中每个应用的图形item id及上次绘制的参数
+        self.stats_canvas_height = None
         
         # 创建主框架，填充整个窗口
         self.main_frame = tk.Frame(self.root, bg=self.color_caps_on if self.caps_lock_on else self.color_caps_off)
@@ -84,21 +3570,25 @@ class CapsLockChecker:
         # 创建UI组件
         self._create_ui_components()
 
-        # 读取配置文件
-        self.read_config()
-        self.grid_second_per_block = self.config.get('grid_second_per_block', 60)  # 设置grid_second_per_block属性
-        
-        # 优化后的内存缓存机制 - 使用deque限制大小
-        self.MAX_CACHE_SIZE = 1000  # 限制缓存最大记录数
-        self.time_stream_cache = {}  # 存储时间流像素格数据 {app_name: deque([(timestamp, duration), ...], maxlen=100)}
-        self.last_cache_flush_time = time.time()  # 上次缓存刷新时间
-        self.cache_flush_interval = 60  # 60秒刷新一次缓存到数据库
-        self.last_grid_update_time = time.time()  # 上次网格更新时间
+        # 客户端模式：连接无界面跟踪服务，由服务负责采样、自动大小写和数据持久化
+        if service_address:
+            self.service_client = ServiceClient(service_address, self.logger)
+            if not self.service_client.connect():
+                self.logger.warning(f"无法连接跟踪服务 {service_address}，改为在本进程内跟踪")
+                self.service_client = None
+        
+        # 初始化时间流缓存和数据库（客户端模式下只读打开数据库，只用于读取历史数据）
+        if self.service_client:
+            self.init_client_storage()
+        else:
+            self.init_storage()
         
         # 分离的定时器管理
         self.last_stats_update_time = time.time()
         self.last_history_render_time = time.time()
         self.last_window_check_time = time.time()
+        self.screen_time_refresh_id = None
+        self.grid_update_id = None
         
         # Canvas事件绑定缓存，避免重复绑定
         self.bound_canvas_tags = set()
@@ -109,8 +3599,10 @@ class CapsLockChecker:
         self.height_change_detected = False  # 是否检测到高度变化
         self.auto_restore_timer = None  # 自动恢复窗口高度的计时器
         
-        # 初始化数据库
-        self.init_db()
+        # 画布重绘调度器：统计图表先于时间流渲染（统计图表渲染时会标记时间流）
+        self.render_scheduler = RenderScheduler(self.root, self.logger, self.config.get('render_frame_budget_ms', 50))
+        self.render_scheduler.register('stats_chart', self.render_stats_chart)
+        self.render_scheduler.register('time_stream', self.render_history_stream)
         
         # 设置初始化标志，用于像素格渲染优化
         self._is_initializing = True
@@ -121,11 +3613,14 @@ class CapsLockChecker:
         # 初始化最后记录的像素格时间戳
         self.init_last_logged_pixel_time()
         
-        # 立即绘制历史流
-        self.render_history_stream(log_new_pixels=False)
+        # 绘制历史流
+        self.render_scheduler.invalidate('time_stream')
         # 绑定窗口大小变化事件，仅在宽度变化时重绘
         self.last_history_canvas_width = self.history_canvas.winfo_width()
         self.history_canvas.bind("<Configure>", self.on_history_canvas_configure)
+        # 通过鼠标坐标计算方块，显示对应应用的tooltip
+        self.history_canvas.bind("<Motion>", self.on_history_canvas_motion)
+        self.history_canvas.bind("<Leave>", self.on_history_canvas_leave)
         
         # 启动优化后的定时任务
         self.start_scheduled_tasks()
@@ -153,341 +3648,99 @@ class CapsLockChecker:
             self.update_status()
             # 如果统计面板打开，重新渲染
             if self.stats_toggle_var.get():
-                self.render_stats_chart()
-                self.render_history_stream(log_new_pixels=False)
+                self.render_scheduler.invalidate('stats_chart')
             self.logger.debug("延迟初始化完成，界面已刷新")
         except Exception as e:
             self.logger.error(f"延迟初始化时出错: {e}")
     
-    def start_scheduled_tasks(self):
-        """启动所有定时任务，分离各个功能的执行频率"""
-        # 1. Caps Lock状态检查 - 200ms（已优化）
-        self.check_caps_lock()
-        
-        # 2. 屏幕时间和UI刷新 - 基于screen_time_refresh_frequency
-        self.schedule_screen_time_refresh()
-        
-        # 3. 时间流网格更新 - 基于grid_second_per_block
-        self.schedule_grid_update()
-        
-        # 4. 缓存刷新 - 60秒
-        self.schedule_cache_flush()
-    
-    def schedule_screen_time_refresh(self):
-        """基于screen_time_refresh_frequency的刷新任务"""
-        refresh_interval = self.config.get('screen_time_refresh_frequency', 10)
-        interval_ms = max(1000, int(10000 / refresh_interval))  # 转换为毫秒
-        
-        # 执行刷新
-        if self.stats_toggle_var.get():
-            self.update_stats_window()
-            self.render_stats_chart()
-        
-        # 检测窗口高度变化
-        self.check_window_height_change()
-        
-        # 计划下次执行
-        self.root.after(interval_ms, self.schedule_screen_time_refresh)
-    
-    def schedule_grid_update(self):
-        """时间流网格更新任务"""
-        interval_ms = self.grid_second_per_block * 1000
-        
-        # 更新时间流缓存
-        self.update_time_stream_cache()
-        
-        # 每30秒更新一次历史流渲染
-        current_time = time.time()
-        if current_time - self.last_history_render_time >= 30:
-            self.render_history_stream(log_new_pixels=True)
-            self.last_history_render_time = current_time
-        
-        # 计划下次执行
-        self.root.after(interval_ms, self.schedule_grid_update)
-    
-    def schedule_cache_flush(self):
-        """缓存刷新任务"""
-        # 刷新缓存到数据库
-        self.flush_time_stream_cache()
-        
-        # 清理过大的缓存
-        self.cleanup_oversized_cache()
-        
-        # 计划下次执行
-        self.root.after(60000, self.schedule_cache_flush)  # 60秒
-    
-    def cleanup_oversized_cache(self):
-        """清理过大的缓存，防止内存无限增长"""
-        for app_name in list(self.time_stream_cache.keys()):
-            if app_name in self.time_stream_cache:
-                cache = self.time_stream_cache[app_name]
-                if isinstance(cache, list) and len(cache) > 100:
-                    # 保留最新的100条记录
-                    self.time_stream_cache[app_name] = deque(cache[-100:], maxlen=100)
-                elif isinstance(cache, deque) and len(cache) > 100:
-                    # deque会自动限制大小，但这里做额外检查
-                    pass
-    
-    def update_status(self):
-        """更新界面显示的Caps Lock状态"""
-        if self.caps_lock_on:
-            status_text = "ON"
-        else:
-            status_text = "OFF"
-
-        # 更新状态文本
-        self.status_value_label.configure(text=status_text)
-
-    def get_app_name_from_hwnd(self, hwnd):
-        """获取窗口所属程序名，并应用配置的显示名称 - 修复win32api句柄泄漏"""
-        # 验证窗口句柄有效性
-        if not hwnd or not win32gui.IsWindow(hwnd):
-            return "Unknown"
-        
-        try:
-            # 特殊处理LockApp.exe
-            title = win32gui.GetWindowText(hwnd)
-            class_name = win32gui.GetClassName(hwnd)
-            
-            # 检查是否是LockApp窗口
-            if class_name == "LockAppFrame" or (title == "" and "LockApp" in class_name):
-                # 检查进程配置，返回显示名称
-                if 'process_config' in self.config and 'LockApp.exe' in self.config['process_config']:
-                    return self.config['process_config']['LockApp.exe']['display_name']
-                return "LockApp.exe"
-            
-            # 特殊处理任务管理器窗口
-            if class_name == "TaskManagerWindow" or "任务管理器" in title or "Task Manager" in title:
-                # 检查进程配置，返回显示名称
-                if 'process_config' in self.config and 'Taskmgr.exe' in self.config['process_config']:
-                    return self.config['process_config']['Taskmgr.exe']['display_name']
-                return "任务管理器"
-            
-            # 常规进程名称获取 - 修复句柄泄漏
-            tid, pid = win32process.GetWindowThreadProcessId(hwnd)
-            
-            # 修复：更严格的句柄管理
-            hproc = win32api.OpenProcess(win32con.PROCESS_QUERY_INFORMATION | win32con.PROCESS_VM_READ, False, pid)
-            if hproc and hproc != 0:  # 检查句柄有效性
-                try:
-                    modules = win32process.EnumProcessModules(hproc)
-                    if modules and len(modules) > 0:
-                        path = win32process.GetModuleFileNameEx(hproc, modules[0])
-                        process_name = os.path.basename(path)
-                        
-                        # 检查进程配置，返回显示名称
-                        if 'process_config' in self.config:
-                            for proc_name, config in self.config['process_config'].items():
-                                if process_name.lower() == proc_name.lower():
-                                    return config['display_name']  # 返回配置的显示名称
-                        
-                        # 如果没有配置，返回原进程名
-                        return process_name
-                finally:
-                    # 确保句柄被关闭
-                    win32api.CloseHandle(hproc)
-            else:
-                # 如果无法打开进程（权限问题），尝试通过窗口类名和标题识别
-                if class_name == "TaskManagerWindow" or "任务管理器" in title or "Task Manager" in title:
-                    return "任务管理器"
-                # 尝试通过窗口标题识别
-                if title:
-                    return title
-            
-            # 如果所有方法都失败，回退到窗口标题
-            title = win32gui.GetWindowText(hwnd)
-            return title or "Unknown"
-        except Exception as e:
-            # 捕获所有可能的异常，返回默认值
-            # 尝试通过窗口类名和标题识别
-            try:
-                title = win32gui.GetWindowText(hwnd)
-                class_name = win32gui.GetClassName(hwnd)
-                if class_name == "TaskManagerWindow" or "任务管理器" in title or "Task Manager" in title:
-                    return "任务管理器"
-                if title:
-                    return title
-            except:
-                pass
-            return "Unknown"
-
-    def db_file(self):
-        """获取SQLite数据库文件名"""
-        return "screen_time_history.db"
-    
-    def time_stream_db_file(self):
-        """获取时间流SQLite数据库文件名"""
-        return "time_stream_history.db"
-    
-    def init_db(self):
-        """初始化SQLite数据库，创建表"""
-        # 初始化屏幕使用时间数据库
-        db_path = self.db_file()
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS screen_time (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                app_name TEXT NOT NULL,
-                duration REAL NOT NULL
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_screen_time_timestamp ON screen_time (timestamp)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_screen_time_app ON screen_time (app_name)')
-        conn.commit()
-        conn.close()
-        
-        # 初始化时间流数据库
-        time_stream_db_path = self.time_stream_db_file()
-        conn = sqlite3.connect(time_stream_db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS time_stream (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                app_name TEXT NOT NULL,
-                duration REAL NOT NULL
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_time_stream_timestamp ON time_stream (timestamp)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_time_stream_app ON time_stream (app_name)')
-        
-        # 新增：创建已记录像素格表，用于跟踪已记录的像素格数据
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS logged_pixels (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                app_name TEXT NOT NULL,
-                time_range_start TEXT NOT NULL,
-                time_range_end TEXT NOT NULL,
-                duration REAL NOT NULL,
-                log_timestamp TEXT NOT NULL,
-                UNIQUE(app_name, time_range_start, time_range_end)
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_logged_pixels_app ON logged_pixels (app_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_logged_pixels_time_range ON logged_pixels (time_range_start, time_range_end)')
-        
-        conn.commit()
-        conn.close()
-    
-    def write_to_db(self, data):
-        """将数据写入SQLite数据库"""
-        with sqlite3.connect(self.db_file()) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                'INSERT INTO screen_time (timestamp, app_name, duration) VALUES (?, ?, ?)',
-                data
-            )
-            conn.commit()
-    
-    def write_to_time_stream_db(self, data):
-        """将数据写入时间流SQLite数据库"""
-        with sqlite3.connect(self.time_stream_db_file()) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                'INSERT INTO time_stream (timestamp, app_name, duration) VALUES (?, ?, ?)',
-                data
-            )
-            conn.commit()
-    
-    def get_today_time_stream_from_db(self):
-        """从时间流数据库获取今天的全部历史记录"""
-        # 获取今天的本地日期
-        today = datetime.datetime.now().strftime('%Y-%m-%d')
-        
-        with sqlite3.connect(self.time_stream_db_file()) as conn:
-            cursor = conn.cursor()
-            # 获取当天00:00到当前时间的全部数据，包含时间戳
-            cursor.execute(
-                f'SELECT timestamp, app_name, duration FROM time_stream WHERE DATE(timestamp) = "{today}" ORDER BY timestamp',
-            )
-            rows = cursor.fetchall()
-            return rows
-            
-    def get_screen_time_from_db(self):
-        """从数据库获取按应用分组的屏幕使用时间数据"""
-        with sqlite3.connect(self.db_file()) as conn:
-            cursor = conn.cursor()
-            # 获取今天的本地日期
-            today = datetime.datetime.now().strftime('%Y-%m-%d')
-            # 使用本地日期查询
-            cursor.execute(
-                f'SELECT app_name, SUM(duration) AS total_duration FROM screen_time WHERE DATE(timestamp) = "{today}" GROUP BY app_name'
-            )
-            rows = cursor.fetchall()
-            
-            # 将结果转换为字典格式
-            screen_time_dict = {}
-            for app_name, total_duration in rows:
-                screen_time_dict[app_name] = total_duration
-            
-            return screen_time_dict
-    
-    def handle_window_switch(self, hwnd):
-        """窗口切换时记录时长并切换当前程序"""
-        # 验证窗口句柄有效性
-        if not hwnd or not win32gui.IsWindow(hwnd):
-            return
-            
-        now = time.time()
-        if self.current_app_name:
-            elapsed = now - self.current_start_time
-            # 只记录屏幕使用时间（用于统计显示）
-            self.record_screen_time(self.current_app_name, elapsed)
+    def start_scheduled_tasks(self):
+        """启动所有定时任务，分离各个功能的执行频率"""
+        # 1. 前台窗口跟踪：本地模式启动跟踪线程、缓存刷新和数据库结构迁移；客户端模式接收跟踪服务推送的消息
+        if self.service_client:
+            self.service_client.start()
+            self.drain_service_messages()
+        else:
+            self.start_tracking()
         
-        try:
-            self.current_app_name = self.get_app_name_from_hwnd(hwnd)
-            self.current_start_time = now
-            self.last_hwnd = hwnd
-        except Exception as e:
-            # 处理获取应用名称时的异常
-            self.logger.error(f"Error handling window switch: {e}")
-            # 保持当前应用不变，避免数据丢失
+        # 2. 屏幕时间和UI刷新 - 基于screen_time_refresh_frequency
+        self.schedule_screen_time_refresh()
+        
+        # 3. 时间流网格更新 - 基于grid_second_per_block
+        self.schedule_grid_update()
     
-    def record_screen_time(self, app_name, duration):
-        """记录屏幕使用时间（用于统计显示）"""
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.write_to_db((timestamp, app_name, duration))
+    def schedule_screen_time_refresh(self):
+        """基于screen_time_refresh_frequency的刷新任务，统计面板隐藏或用户空闲时降为每10秒一次"""
+        refresh_interval = self.config.get('screen_time_refresh_frequency', 10)
+        interval_ms = max(1000, int(10000 / refresh_interval))  # 转换为毫秒
+        if not self.stats_toggle_var.get() or not self.user_active:
+            interval_ms = max(interval_ms, 10000)
+        
+        # 检测跨越午夜（统计面板关闭时也需要按时拆分会话；客户端模式下由跟踪服务处理）
+        self.check_day_rollover()
+        
+        # 标记统计图表需要刷新（图表渲染时同时更新右侧时间文本）
+        if self.stats_toggle_var.get():
+            self.render_scheduler.invalidate('stats_chart')
+        
+        # 检测窗口高度变化
+        self.check_window_height_change()
+        
+        # 计划下次执行
+        self.screen_time_refresh_id = self.root.after(interval_ms, self.schedule_screen_time_refresh)
     
-    def record_time_stream(self, app_name, duration):
-        """记录时间流数据（仅记录窗口切换时的原始数据）"""
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.write_to_time_stream_db((timestamp, app_name, duration))
-        # 不再写入30分钟数据块，改为使用内存缓存机制
+    def schedule_grid_update(self):
+        """时间流网格更新任务，用户空闲或锁屏时降为每5分钟一次"""
+        interval_ms = self.grid_second_per_block * 1000
+        if not self.user_active:
+            interval_ms = max(interval_ms, 300000)
+        
+        # 时间流缓存由跟踪线程发布的时间段快照更新，这里只负责定时重绘
+        # 每30秒更新一次历史流渲染
+        current_time = time.time()
+        if current_time - self.last_history_render_time >= 30:
+            self.render_scheduler.invalidate('time_stream', log_new_pixels=True)
+            self.last_history_render_time = current_time
+        
+        # 计划下次执行
+        self.grid_update_id = self.root.after(interval_ms, self.schedule_grid_update)
     
-    def update_time_stream_cache(self):
-        """优化的时间流缓存更新"""
-        if self.current_app_name:
-            current_time = time.time()
-            # 计算自上次更新以来的时间
-            elapsed = current_time - self.last_grid_update_time
-            
-            # 只记录有效的时间段（大于0）
-            if elapsed > 0:
-                # 更新缓存中的时间流数据
-                timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                if self.current_app_name not in self.time_stream_cache:
-                    # 使用deque限制每个应用的缓存大小
-                    self.time_stream_cache[self.current_app_name] = deque(maxlen=100)
-                
-                # 添加到缓存
-                self.time_stream_cache[self.current_app_name].append((timestamp, elapsed))
-            
-            self.last_grid_update_time = current_time
+    def restart_screen_time_refresh(self):
+        """立即刷新一次屏幕时间并按当前状态重新计时（统计面板显示或用户恢复活动时调用）"""
+        if self.screen_time_refresh_id is None:
+            return
+        self.root.after_cancel(self.screen_time_refresh_id)
+        self.schedule_screen_time_refresh()
+    
+    def on_user_activity_changed(self, active):
+        """用户恢复活动时立即刷新统计和时间流，恢复正常刷新频率"""
+        if not active or self.grid_update_id is None:
+            return
+        self.restart_screen_time_refresh()
+        self.root.after_cancel(self.grid_update_id)
+        self.schedule_grid_update()
     
+    def update_status(self):
+        """更新界面显示的Caps Lock状态"""
+        if self.caps_lock_on:
+            status_text = "ON"
+        else:
+            status_text = "OFF"
+
+        # 更新状态文本
+        self.status_value_label.configure(text=status_text)
+
     def init_last_logged_pixel_time(self):
-        """初始化最后记录的像素格时间戳，用于检测新增像素格"""
+        """从水位线表读取最后记录的像素格时间戳，用于检测新增像素格"""
         try:
-            with sqlite3.connect(self.time_stream_db_file()) as conn:
-                cursor = conn.cursor()
-                # 获取最近记录的像素格时间戳
-                cursor.execute(
-                    'SELECT MAX(log_timestamp) FROM logged_pixels'
-                )
-                result = cursor.fetchone()
-                self.last_logged_pixel_time = result[0] if result and result[0] else None
-                self.logger.debug(f"初始化最后记录像素格时间戳: {self.last_logged_pixel_time}")
+            conn = self.db_manager.get_connection(self.time_stream_db_file())
+            cursor = conn.cursor()
+            cursor.execute('SELECT value FROM watermarks WHERE name = ?', (self.PIXEL_WATERMARK,))
+            result = cursor.fetchone()
+            if result is None and self.schema_object_type(conn, 'logged_pixels') == 'table':
+                # 旧表尚未迁移，按索引读取最后一个像素格的时间戳
+                result = cursor.execute('SELECT MAX(time_range_start) FROM logged_pixels').fetchone()
+            self.last_logged_pixel_time = result[0] if result and result[0] else None
+            self.logger.debug(f"初始化最后记录像素格时间戳: {self.last_logged_pixel_time}")
         except Exception as e:
             self.logger.error(f"初始化最后记录像素格时间戳时出错: {e}")
             self.last_logged_pixel_time = None
@@ -518,7 +3771,7 @@ class CapsLockChecker:
     
     def log_new_pixels(self, new_pixels):
         """
-        记录新增的像素格数据到数据库
+        按应用汇总新增的像素格写入日志，并把水位线更新为最后一个像素格的时间戳
         Args:
             new_pixels: 新增的像素格数据列表，格式为[(timestamp, app_name, duration), ...]
         """
@@ -526,152 +3779,69 @@ class CapsLockChecker:
             return
         
         try:
-            with sqlite3.connect(self.time_stream_db_file()) as conn:
-                cursor = conn.cursor()
-                
-                # 按应用分组
-                app_pixels = {}
-                for timestamp, app_name, duration in new_pixels:
-                    if app_name not in app_pixels:
-                        app_pixels[app_name] = []
-                    app_pixels[app_name].append((timestamp, duration))
-                
-                # 记录日志
-                log_lines = ["新增像素格记录:"]
-                total_new_pixels = 0
-                app_details = []
-                
-                # 记录到数据库
-                for app_name, pixels in app_pixels.items():
-                    for timestamp, duration in pixels:
-                        # 计算时间范围（简化处理，使用当前时间戳作为时间范围）
-                        time_range_start = timestamp
-                        time_range_end = timestamp
-                        log_timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        
-                        # 插入数据库
-                        cursor.execute(
-                            'INSERT OR IGNORE INTO logged_pixels (app_name, time_range_start, time_range_end, duration, log_timestamp) VALUES (?, ?, ?, ?, ?)',
-                            (app_name, time_range_start, time_range_end, duration, log_timestamp)
-                        )
-                        
-                        total_new_pixels += 1
-                    
-                    # 计算总时长
-                    total_duration = sum(duration for _, duration in pixels)
-                    formatted_time = self.format_duration(total_duration)
-                    app_details.append(f"{app_name}: {len(pixels)}个像素格, 总时长: {formatted_time}")
-                
-                # 更新最后记录时间戳
-                if new_pixels:
-                    latest_timestamp = max(timestamp for timestamp, _, _ in new_pixels)
-                    self.last_logged_pixel_time = latest_timestamp
-                
-                # 提交事务
-                conn.commit()
-                
-                # 记录日志 - 合并为一行
-                if app_details:
-                    log_line = f"新增像素格记录: {'; '.join(app_details)}; 总计: {total_new_pixels}个新增像素格"
-                    self.logger.info(log_line)
-                
+            # 按应用分组
+            app_pixels = {}
+            for timestamp, app_name, duration in new_pixels:
+                if app_name not in app_pixels:
+                    app_pixels[app_name] = []
+                app_pixels[app_name].append((timestamp, duration))
+            
+            # 记录日志
+            total_new_pixels = len(new_pixels)
+            app_details = []
+            for app_name, pixels in app_pixels.items():
+                # 计算总时长
+                total_duration = sum(duration for _, duration in pixels)
+                formatted_time = self.format_duration(total_duration)
+                app_details.append(f"{app_name}: {len(pixels)}个像素格, 总时长: {formatted_time}")
+            
+            # 更新水位线（只写一行），由后台写入线程提交；客户端模式下交给跟踪服务写入
+            latest_timestamp = max(timestamp for timestamp, _, _ in new_pixels)
+            self.last_logged_pixel_time = latest_timestamp
+            if self.service_client:
+                self.service_client.send({'t': 'watermark', 'value': latest_timestamp})
+            else:
+                self.db_writer.submit(self.time_stream_db_file(), [
+                    (self.WATERMARK_UPSERT_SQL, [(self.PIXEL_WATERMARK, latest_timestamp)])
+                ])
+            
+            # 记录日志 - 合并为一行
+            if app_details:
+                log_line = f"新增像素格记录: {'; '.join(app_details)}; 总计: {total_new_pixels}个新增像素格"
+                self.logger.info(log_line)
+            
         except Exception as e:
             self.logger.error(f"记录新增像素格时出错: {e}")
     
     def load_recent_cache_data(self):
-        """加载最近的缓存数据（优化版）"""
+        """
+        加载最近15分钟的时间流记录到缓存
+        重新加载的记录按原来的(start_ts, app_id)写回，由唯一键upsert合并，不会重复计入；
+        唯一键迁移完成之前不加载（界面从数据库读取今天的记录，不影响显示）
+        """
+        if not self.stream_key_ready:
+            return
         try:
-            # 获取当前时间前15分钟的时间点
-            fifteen_minutes_ago = datetime.datetime.now() - datetime.timedelta(minutes=15)
-            fifteen_minutes_ago_str = fifteen_minutes_ago.strftime('%Y-%m-%d %H:%M:%S')
+            fifteen_minutes_ago = int(time.time()) - 15 * 60
             
-            with sqlite3.connect(self.time_stream_db_file()) as conn:
-                cursor = conn.cursor()
-                # 只获取最近15分钟的数据
-                cursor.execute(
-                    'SELECT timestamp, app_name, duration FROM time_stream WHERE timestamp >= ? ORDER BY timestamp',
-                    (fifteen_minutes_ago_str,)
-                )
-                rows = cursor.fetchall()
-                
-                # 记录已加载的数据时间戳范围，避免重复
-                self.cache_data_timestamps = set()
-                
-                # 将数据加载到缓存中，限制每个应用最多100条
-                for timestamp, app_name, duration in rows[-self.MAX_CACHE_SIZE:]:
-                    if app_name not in self.time_stream_cache:
-                        self.time_stream_cache[app_name] = deque(maxlen=100)
-                    self.time_stream_cache[app_name].append((timestamp, duration))
-                    # 记录已加载的时间戳
-                    self.cache_data_timestamps.add(timestamp)
-                
-                if rows:
-                    self.logger.info(f"加载了 {len(rows)} 条最近的缓存数据")
-        except Exception as e:
-            self.logger.error(f"加载缓存数据时出错: {e}")
-    
-    def flush_time_stream_cache(self):
-        """优化的缓存刷新，减少数据库操作"""
-        if not self.time_stream_cache:
-            return
-        
-        # 减少缓存刷新日志，只在有大量数据时记录
-        total_apps = len(self.time_stream_cache)
-        total_records = sum(len(records) for records in self.time_stream_cache.values())
-        if total_records > 50:  # 只在记录数较多时记录日志
-            self.logger.info(f"缓存刷新 - 应用数: {total_apps}, 记录数: {total_records}")
-        
-        # 批量准备数据
-        records_to_insert = []
-        
-        # 一次性获取已存在的时间戳
-        with sqlite3.connect(self.time_stream_db_file()) as conn:
+            conn = self.db_manager.get_connection(self.time_stream_db_file())
             cursor = conn.cursor()
-            one_hour_ago = (datetime.datetime.now() - datetime.timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute('SELECT timestamp FROM time_stream WHERE timestamp >= ?', (one_hour_ago,))
-            existing_timestamps = {row[0] for row in cursor.fetchall()}
-        
-        # 准备插入数据
-        for app_name, records in self.time_stream_cache.items():
-            if isinstance(records, deque):
-                records = list(records)
-            for timestamp, duration in records:
-                if timestamp not in existing_timestamps:
-                    records_to_insert.append((timestamp, app_name, duration))
-                    existing_timestamps.add(timestamp)
-        
-        # 批量插入
-        if records_to_insert:
-            with sqlite3.connect(self.time_stream_db_file()) as conn:
-                cursor = conn.cursor()
-                cursor.executemany(
-                    'INSERT INTO time_stream (timestamp, app_name, duration) VALUES (?, ?, ?)',
-                    records_to_insert
-                )
-                conn.commit()
+            # 按起始时间的范围查询，走idx_time_stream_rows_start_app唯一键索引
+            cursor.execute(
+                'SELECT start_ts, app_name, duration FROM time_stream WHERE start_ts >= ? ORDER BY start_ts',
+                (fifteen_minutes_ago,)
+            )
+            rows = cursor.fetchall()
             
-            # 减少日志输出，只在有大量数据时记录
-            if len(records_to_insert) > 50:
-                self.logger.info(f"缓存刷新完成 - 写入 {len(records_to_insert)} 条记录")
-        
-        # 清空缓存
-        self.time_stream_cache.clear()
-        
-        # 强制垃圾回收
-        gc.collect()
+            # 将数据加载到缓存中，不超过缓存容量的一半，给之后的时间段留出空间
+            for start_ts, app_name, duration in rows[-(self.TIME_STREAM_CACHE_CAPACITY // 2):]:
+                self.time_stream_cache.append(app_name, start_ts, duration)
+            
+            if rows:
+                self.logger.info(f"加载了 {len(rows)} 条最近的缓存数据")
+        except Exception as e:
+            self.logger.error(f"加载缓存数据时出错: {e}")
     
-
-
-    def format_duration(self, seconds):
-        """格式化时长"""
-        seconds = int(seconds)
-        h = seconds // 3600
-        m = (seconds % 3600) // 60
-        s = seconds % 60
-        if h > 0:
-            return f"{h:02d}:{m:02d}:{s:02d}"
-        return f"{m:02d}:{s:02d}"
-
     def show_stats_window(self):
         """切换主UI中的统计显示/隐藏"""
         # 切换统计显示开关的状态
@@ -699,9 +3869,10 @@ class CapsLockChecker:
             
             # 显示统计组件
             self.stats_container_frame.pack(expand=False, fill=tk.BOTH, pady=10)
-            # 立即绘制统计图表和历史流条
-            self.render_stats_chart()
-            self.render_history_stream()
+            # 绘制统计图表和历史流条
+            self.render_scheduler.invalidate('stats_chart')
+            # 恢复正常的刷新频率
+            self.restart_screen_time_refresh()
             
 
         else:
@@ -713,6 +3884,8 @@ class CapsLockChecker:
     def render_history_stream(self, log_new_pixels=False):
         """
         优化的历史流渲染，修复内存泄漏问题
+        采用追加式增量渲染：已绘制的方块保持不变，只追加上次渲染之后新增的方块，
+        当前应用进行中的尾部方块原地更新；只有宽度、配置变化或历史数据被改写时才整体重新布局
         Args:
             log_new_pixels: 是否记录新增像素的日志，默认为False
         """
@@ -723,36 +3896,38 @@ class CapsLockChecker:
         
         # 合并缓存数据
         cache_data = []
-        cache_timestamps = set()
-        for app_name, records in self.time_stream_cache.items():
-            if isinstance(records, deque):
-                records = list(records)
-            for timestamp, duration in records:
-                cache_timestamps.add(timestamp)
-                cache_data.append((timestamp, app_name, duration))
-        
-        # 过滤重复
+        cache_keys = set()
+        for start_ts, app_name, duration in self.time_stream_cache:
+            timestamp = self.stream_timestamp(start_ts, duration)
+            cache_keys.add((timestamp, app_name))
+            cache_data.append((timestamp, app_name, duration))
+        
+        # 过滤重复（同一秒内不同程序的记录都保留）
         filtered_db_history = []
         for timestamp, app_name, duration in db_history:
-            if timestamp not in cache_timestamps:
+            if (timestamp, app_name) not in cache_keys:
                 filtered_db_history.append((timestamp, app_name, duration))
         
         # 合并并排序
         all_history = filtered_db_history + cache_data
         all_history.sort(key=lambda x: x[0])
         
-        # 添加当前应用
+        # 过滤（已完成的历史记录）
+        committed_history = []
+        for timestamp, app, duration in all_history:
+            if duration > 0 and self.check_app_display_config(app, 'show_in_time_stream'):
+                committed_history.append((app, duration))
+        
+        # 当前应用进行中的部分，作为可原地更新的尾部单独绘制
+        tail = None
         if self.current_app_name:
             elapsed = time.time() - self.current_start_time
             if elapsed > 0:
                 current_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 all_history.append((current_time, self.current_app_name, elapsed))
-        
-        # 过滤
-        valid_history = []
-        for timestamp, app, duration in all_history:
-            if duration > 0 and self.check_app_display_config(app, 'show_in_time_stream'):
-                valid_history.append((app, duration))
+                if self.check_app_display_config(self.current_app_name, 'show_in_time_stream'):
+                    tail = (self.current_app_name, elapsed)
+        valid_history = committed_history + [tail] if tail else committed_history
         
         # 检查是否需要更新
         current_history_hash = hash(tuple(valid_history))
@@ -777,6 +3952,78 @@ class CapsLockChecker:
         if w <= 0:
             return
         
+        block_size = 5
+        max_cols = max(1, w // block_size)
+        renderer = self.config.get('time_stream_renderer', 'canvas')
+        layout = self.stream_layout
+        rendered = layout['entries'] if layout else None
+        full_relayout = (
+            layout is None or layout['max_cols'] != max_cols
+            or layout['block_seconds'] != self.grid_second_per_block
+            or layout['renderer'] != renderer
+            or len(rendered) > len(committed_history)
+            or committed_history[:len(rendered)] != rendered
+        )
+        if full_relayout:
+            # 宽度/配置变化或历史数据被改写，整体重新布局
+            self._reset_history_canvas()
+            layout = self.stream_layout = {
+                'renderer': renderer,
+                'max_cols': max_cols,
+                'block_seconds': self.grid_second_per_block,
+                'entries': [],  # 已绘制的已完成历史记录
+                'block_apps': [],  # 已完成记录展开后每个方块对应的应用
+                'tail_apps': [],  # 尾部（当前应用）每个方块对应的应用
+                'runs': [],  # canvas模式：已完成方块的连续段 [item_id, app, 行号, 起始列, 结束列]
+                'tail_items': [],  # canvas模式：尾部连续段的canvas item id
+                'grid_height': None,  # canvas模式：网格覆盖层对应的画布高度
+                'painted': [],  # bitmap模式：位图中每个方块当前绘制的应用
+                'bg': None  # bitmap模式：绘制位图时使用的背景色
+            }
+            new_entries = committed_history
+        else:
+            new_entries = committed_history[len(rendered):]
+        
+        # 确保颜色分配
+        for app, dur in new_entries:
+            if app not in self.app_color_map:
+                color_index = len(self.app_color_map) % len(self.color_palette)
+                self.app_color_map[app] = self.color_palette[color_index]
+        if tail and tail[0] not in self.app_color_map:
+            self.app_color_map[tail[0]] = self.color_palette[len(self.app_color_map) % len(self.color_palette)]
+        
+        # 布局：把新增记录展开为方块序列，追加到已完成方块之后
+        first_new_block = len(layout['block_apps'])
+        for app, dur in new_entries:
+            layout['block_apps'].extend([app] * self._stream_block_count(dur, layout['block_seconds']))
+        layout['entries'].extend(new_entries)
+        # 尾部方块不计入已完成序列，下次渲染时原地替换
+        tail_apps = [tail[0]] * self._stream_block_count(tail[1], layout['block_seconds']) if tail else []
+        layout['tail_apps'] = tail_apps
+        
+        # 更新画布高度
+        total_blocks_needed = len(layout['block_apps']) + len(tail_apps)
+        total_rows_needed = max(20, (total_blocks_needed + max_cols - 1) // max_cols)
+        new_height = total_rows_needed * block_size
+        if new_height != self.history_bar_h:
+            self.history_bar_h = new_height
+            self.history_canvas.configure(height=self.history_bar_h)
+        
+        # 绘制
+        if renderer == 'bitmap':
+            self._paint_stream_bitmap(layout, first_new_block, tail_apps, full_relayout)
+        else:
+            self._draw_stream_canvas(layout, first_new_block, tail_apps, log_new_pixels)
+        
+        # 记录日志：时间流渲染完成（改为DEBUG级别，减少日志噪音）
+        self.logger.debug(f"时间流渲染完成 - 渲染方式: {renderer}, 总应用数: {len(valid_history)}, 新增记录数: {len(new_entries)}, 总像素格数: {total_blocks_needed}, 画布宽度: {w}px, 画布高度: {self.history_bar_h}px")
+
+    def _stream_block_count(self, dur, interval_seconds):
+        """计算一条记录占用的方块数"""
+        return max(1, int(dur / interval_seconds)) if dur >= interval_seconds else 1
+
+    def _reset_history_canvas(self):
+        """清空时间流画布和事件绑定，准备整体重新布局"""
         # 清理旧的事件绑定（修复内存泄漏的关键）
         for tag in self.bound_canvas_tags:
             for event in ["<Enter>", "<Leave>", "<Motion>"]:
@@ -788,92 +4035,209 @@ class CapsLockChecker:
         
         # 清空canvas
         self.history_canvas.delete("all")
+        # 释放时间流位图
+        self.stream_image = None
         # 清除历史点击绑定
         if hasattr(self, 'history_click_bindings'):
             self.history_click_bindings.clear()
-        # 清空已绘制像素格记录
-        if hasattr(self, 'drawn_pixels'):
-            self.drawn_pixels.clear()
+        self.stream_layout = None
+
+    def _draw_stream_canvas(self, layout, first_new_block, tail_apps, log_new_pixels=False):
+        """
+        canvas模式：同一行内连续相同应用的方块合并为一个矩形（run），只追加新增方块，尾部删除后重画
+        方块之间的1像素间隙由背景色网格覆盖层呈现，画布上的图形数量与连续段数量而不是方块数量成正比
+        """
+        # 删除上次绘制的尾部
+        for item in layout['tail_items']:
+            self.history_canvas.delete(item)
+        
+        runs = layout['runs']
+        block_apps = layout['block_apps']
+        for app, row, first_col, last_col in self._stream_runs(first_new_block, block_apps[first_new_block:], layout['max_cols']):
+            last_run = runs[-1] if runs else None
+            if last_run and last_run[1] == app and last_run[2] == row and last_run[4] + 1 == first_col:
+                # 与上一段相连，直接延长上一段矩形
+                last_run[4] = last_col
+                self.history_canvas.coords(last_run[0], *self._stream_run_coords(row, last_run[3], last_col))
+            else:
+                item = self._create_stream_run(app, row, first_col, last_col)
+                runs.append([item, app, row, first_col, last_col])
+            if log_new_pixels:
+                # 改为DEBUG级别，减少日志噪音
+                self.logger.debug(f"绘制时间流像素格 - 应用: {app}, 行: {row}, 列: {first_col}-{last_col}, 方块数: {last_col - first_col + 1}")
+        
+        layout['tail_items'] = [
+            self._create_stream_run(app, row, first_col, last_col)
+            for app, row, first_col, last_col in self._stream_runs(len(block_apps), tail_apps, layout['max_cols'])
+        ]
         
-        if not valid_history:
+        self._update_stream_grid_overlay(layout)
+        # 新建的连续段在最上层，把网格覆盖层整体提到最上层
+        # （不能在创建时tag_lower(item, "stream_grid")：整体重新布局后覆盖层尚未创建，Tk会报错）
+        self.history_canvas.tag_raise("stream_grid")
+
+    def _stream_runs(self, start_index, apps, max_cols):
+        """
+        把从start_index开始的方块序列按行切分为连续段
+        Returns:
+            list: [(app, 行号, 起始列, 结束列), ...]
+        """
+        runs = []
+        for index, app in enumerate(apps, start_index):
+            row, col = divmod(index, max_cols)
+            if runs and runs[-1][0] == app and runs[-1][1] == row:
+                runs[-1][3] = col
+            else:
+                runs.append([app, row, col, col])
+        return [tuple(run) for run in runs]
+
+    def _stream_run_coords(self, row, first_col, last_col):
+        """连续段矩形的坐标：覆盖从起始方块到结束方块（含中间的间隙列）"""
+        block_size = 5
+        return (first_col * block_size, row * block_size,
+                last_col * block_size + block_size - 1, row * block_size + block_size - 1)
+
+    def _create_stream_run(self, app, row, first_col, last_col):
+        """创建一个连续段矩形（由_draw_stream_canvas统一把网格覆盖层提到其上方）"""
+        return self.history_canvas.create_rectangle(
+            *self._stream_run_coords(row, first_col, last_col),
+            fill=self.app_color_map[app],
+            outline="",
+            tags=("stream_run", app)
+        )
+
+    def _update_stream_grid_overlay(self, layout):
+        """
+        背景色网格覆盖层：每列、每行方块右侧和下方的1像素间隙各一个细长矩形
+        数量只与画布的行列数有关，画布高度变化时重建
+        """
+        if layout['grid_height'] == self.history_bar_h:
             return
         
-        # 确保颜色分配
-        for app, dur in valid_history:
-            if app not in self.app_color_map:
-                color_index = len(self.app_color_map) % len(self.color_palette)
-                self.app_color_map[app] = self.color_palette[color_index]
-        
-        # 绘制方块
         block_size = 5
-        interval_seconds = self.grid_second_per_block
-        
-        block_counts = []
-        for app, dur in valid_history:
-            count = max(1, int(dur / interval_seconds)) if dur >= interval_seconds else 1
-            block_counts.append(count)
-        
-        total_blocks_needed = sum(block_counts)
-        
-        current_col = 0
-        current_row = 0
-        max_cols = max(1, w // block_size)
-        
-        # 更新画布高度
-        total_rows_needed = max(20, (total_blocks_needed + max_cols - 1) // max_cols)
-        new_height = total_rows_needed * block_size
-        if new_height != self.history_bar_h:
-            self.history_bar_h = new_height
-            self.history_canvas.configure(height=self.history_bar_h)
+        bg = self.history_canvas['bg']
+        width = layout['max_cols'] * block_size
+        self.history_canvas.delete("stream_grid")
+        for col in range(layout['max_cols']):
+            x = col * block_size + block_size - 1
+            self.history_canvas.create_rectangle(x, 0, x + 1, self.history_bar_h, fill=bg, outline="", tags=("stream_grid",))
+        for row in range(self.history_bar_h // block_size):
+            y = row * block_size + block_size - 1
+            self.history_canvas.create_rectangle(0, y, width, y + 1, fill=bg, outline="", tags=("stream_grid",))
+        layout['grid_height'] = self.history_bar_h
+
+    def _paint_stream_bitmap(self, layout, first_new_block, tail_apps, full_relayout):
+        """
+        bitmap模式：所有方块绘制在同一个PhotoImage中，画布上只有一个图像item
+        整体重新布局时一次性写入全部像素，增量渲染时只重写发生变化的方块
+        """
+        block_size = 5
+        bg = self.history_canvas['bg']
+        width = layout['max_cols'] * block_size
+        target = layout['block_apps'] + tail_apps
         
-        # 初始化已绘制像素格记录（用于优化日志）
-        if not hasattr(self, 'drawn_pixels'):
-            self.drawn_pixels = set()
+        if full_relayout or self.stream_image is None or layout['bg'] != bg:
+            # 整体写入：一次put调用写入整张位图
+            self.history_canvas.delete("all")
+            self.stream_image = tk.PhotoImage(master=self.history_canvas, width=width, height=self.history_bar_h)
+            self.history_canvas.create_image(0, 0, image=self.stream_image, anchor="nw")
+            if target:
+                self.stream_image.put(self._stream_bitmap_data(target, layout['max_cols'], bg), to=(0, 0))
+            layout['painted'] = list(target)
+            layout['bg'] = bg
+            return
         
-        # 批量绘制方块
-        for i, (app, dur) in enumerate(valid_history):
-            count = block_counts[i]
-            color = self.app_color_map[app]
-            
-            # 绘制所有方块
-            for _ in range(count):
-                x = current_col * block_size
-                y = current_row * block_size
-                
-                # 创建像素格的唯一标识
-                pixel_key = (app, x, y)
-                
-                rect_id = self.history_canvas.create_rectangle(
-                    x, y, 
-                    x + block_size - 1, y + block_size - 1,
-                    fill=color, 
-                    outline="",
-                    tags=(app,)
-                )
-                
-                # 只对新增像素格记录日志（仅在log_new_pixels为True时）
-                is_new_pixel = pixel_key not in self.drawn_pixels
-                if is_new_pixel:
-                    if log_new_pixels:
-                        # 改为DEBUG级别，减少日志噪音
-                        self.logger.debug(f"绘制时间流像素格 - 应用: {app}, 位置: ({x}, {y}), 颜色: {color}, 持续时间: {dur:.2f}秒")
-                    self.drawn_pixels.add(pixel_key)
-                
-                current_col += 1
-                if current_col >= max_cols:
-                    current_col = 0
-                    current_row += 1
-            
-            # 只绑定一次事件（修复内存泄漏的关键）
-            if app not in self.bound_canvas_tags:
-                self.history_canvas.tag_bind(app, "<Enter>", lambda e, a=app: self.show_tooltip(e, a))
-                self.history_canvas.tag_bind(app, "<Leave>", self.hide_tooltip)
-                self.history_canvas.tag_bind(app, "<Motion>", lambda e, a=app: self.move_tooltip(e, a))
-                self.bound_canvas_tags.add(app)
+        if self.stream_image.height() < self.history_bar_h:
+            # 画布变高时扩展位图，新增区域透明，显示画布背景色
+            self.stream_image.configure(height=self.history_bar_h)
+        
+        # 增量写入：已完成方块之前的部分不会变化，只比较新增方块和尾部
+        painted = layout['painted']
+        start = min(first_new_block, len(painted))
+        for index in range(start, len(target)):
+            app = target[index]
+            if index < len(painted):
+                if painted[index] == app:
+                    continue
+                painted[index] = app
+            else:
+                painted.append(app)
+            self._put_stream_block(index, self.app_color_map[app], layout['max_cols'])
+        # 尾部缩短时用背景色擦除多余的方块
+        for index in range(len(target), len(painted)):
+            self._put_stream_block(index, bg, layout['max_cols'])
+        del painted[len(target):]
+
+    def _put_stream_block(self, index, color, max_cols):
+        """在位图中绘制单个方块（4x4像素，右侧和下方各留1像素间隙）"""
+        block_size = 5
+        x = (index % max_cols) * block_size
+        y = (index // max_cols) * block_size
+        self.stream_image.put(color, to=(x, y, x + block_size - 1, y + block_size - 1))
+
+    def _stream_bitmap_data(self, block_apps, max_cols, bg):
+        """生成整张位图的像素数据（Tk photo的行列表格式），间隙像素使用背景色"""
+        block_size = 5
+        rows = []
+        gap_row = '{' + ' '.join([bg] * (max_cols * block_size)) + '}'
+        for start in range(0, len(block_apps), max_cols):
+            row_apps = block_apps[start:start + max_cols]
+            pixels = []
+            for app in row_apps:
+                pixels.extend([self.app_color_map[app]] * (block_size - 1))
+                pixels.append(bg)
+            pixels.extend([bg] * ((max_cols - len(row_apps)) * block_size))
+            pixel_row = '{' + ' '.join(pixels) + '}'
+            rows.extend([pixel_row] * (block_size - 1))
+            rows.append(gap_row)
+        return ' '.join(rows)
+
+    def refresh_stream_background(self):
+        """背景色变化后更新时间流：canvas模式更新网格覆盖层颜色，bitmap模式用已绘制的方块数据重新写入位图"""
+        layout = getattr(self, 'stream_layout', None)
+        if not layout:
+            return
+        bg = self.history_canvas['bg']
+        if layout['renderer'] != 'bitmap':
+            self.history_canvas.itemconfig("stream_grid", fill=bg)
+            return
+        if self.stream_image is None or layout['bg'] == bg:
+            return
+        self.stream_image.blank()
+        if layout['painted']:
+            self.stream_image.put(self._stream_bitmap_data(layout['painted'], layout['max_cols'], bg), to=(0, 0))
+        layout['bg'] = bg
+
+    def on_history_canvas_motion(self, event):
+        """时间流tooltip：根据鼠标坐标计算方块序号，找到对应的应用（不依赖逐个图形的事件绑定）"""
+        layout = self.stream_layout
+        if not layout:
+            return
         
-        # 记录日志：时间流渲染完成（改为DEBUG级别，减少日志噪音）
-        total_blocks = sum(block_counts)
-        self.logger.debug(f"时间流渲染完成 - 总应用数: {len(valid_history)}, 总像素格数: {total_blocks}, 画布宽度: {w}px, 画布高度: {self.history_bar_h}px")
+        block_size = 5
+        col = event.x // block_size
+        row = event.y // block_size
+        index = row * layout['max_cols'] + col
+        app = None
+        if 0 <= col < layout['max_cols'] and index >= 0:
+            block_apps = layout['block_apps']
+            if index < len(block_apps):
+                app = block_apps[index]
+            elif index - len(block_apps) < len(layout['tail_apps']):
+                app = layout['tail_apps'][index - len(block_apps)]
+        
+        if app is None:
+            if self.current_tooltip_app is not None:
+                self.hide_tooltip(event)
+        elif app != self.current_tooltip_app:
+            self.show_tooltip(event, app)
+        else:
+            self.move_tooltip(event, app)
+
+    def on_history_canvas_leave(self, event):
+        """鼠标离开时间流时隐藏tooltip"""
+        if self.current_tooltip_app is not None:
+            self.hide_tooltip(event)
 
     def _log_render_data(self, valid_history):
         """
@@ -933,46 +4297,39 @@ class CapsLockChecker:
         Args:
         config_type: 'show_in_screen_time' 或 'show_in_time_stream'
         """
-        if 'process_config' not in self.config:
-            return True  # 默认显示
-            
-        for proc_name, config in self.config['process_config'].items():
-            if app_name == config['display_name']:
-                return config.get(config_type, True)  # 默认显示
-                
-        return True  # 未找到配置则默认显示
+        config = self.app_display_flags.get(app_name)
+        if config is None:
+            return True  # 未找到配置则默认显示
+        return config.get(config_type, True)  # 默认显示
+
+    def get_top_screen_time_items(self, limit=50):
+        """获取需要在屏幕时间中显示的前limit个应用，按时长降序排列"""
+        items = []
+        for app, sec in self.get_today_stats():
+            if self.check_app_display_config(app, 'show_in_screen_time'):
+                items.append((app, sec))
+                if len(items) >= limit:
+                    break
+        return items
 
     def render_stats_chart(self):
-        """绘制横向条形图，仅使用数据库数据"""
+        """
+        绘制横向条形图（保留模式）
+        每个应用的条形、名称和时长文本的item id保存在stats_chart_items中，刷新时用coords/itemconfig原地更新，
+        只有应用进入或离开前50名时才创建或删除图形
+        """
         if not self.stats_canvas:
             return
         self.stats_canvas.update_idletasks()
         w = self.stats_canvas.winfo_width()
         
-        # 从数据库获取今天的屏幕使用时间数据
-        stats = self.get_screen_time_from_db()
-        
-        # 添加当前应用的临时时间
-        if self.current_app_name:
-            stats[self.current_app_name] = stats.get(self.current_app_name, 0) + (time.time() - self.current_start_time)
-            
-        # 过滤掉不需要在屏幕时间中显示的应用
-        filtered_stats = {}
-        for app, sec in stats.items():
-            if self.check_app_display_config(app, 'show_in_screen_time'):
-                filtered_stats[app] = sec
-                
-        items = sorted(filtered_stats.items(), key=lambda x: x[1], reverse=True)
-        
-        # 移除哈希检查，确保按照screen_time_refresh_frequency刷新
-        # 计算当前统计数据的哈希值，避免重复渲染
-        # current_stats_hash = hash(tuple(items))
-        # if current_stats_hash == self.last_stats_hash:
-        #     return
-        # self.last_stats_hash = current_stats_hash
+        # 从内存累计值获取今天的屏幕使用时间数据（已按时长降序排列）
+        items = self.get_top_screen_time_items()
         
-        # 彻底清理画布内存
-        self.cleanup_chart_memory()
+        # 删除已离开前50名的应用的图形
+        current_apps = {app for app, _ in items}
+        for app in [app for app in self.stats_chart_items if app not in current_apps]:
+            self._delete_stats_chart_entry(app)
         
         if not items:
             return
@@ -983,174 +4340,156 @@ class CapsLockChecker:
         label_w = 20  # 调整柱形图起始位置，使其居左
         y = gap
         
-        # 计算所需高度（至少容纳7个进程）
-        num_items = max(len(items[:50]), 7)
-        required_h = (bar_h + gap) * num_items + gap
-        
-        # 设置canvas高度（固定显示7个项目 + 底部历史流条）
+        # 设置canvas高度（固定显示7个项目 + 底部历史流条），只在变化时设置
         visible_items = 7
-        self.stats_canvas.configure(height=(bar_h + gap) * (visible_items + 1) + gap)
+        canvas_h = (bar_h + gap) * (visible_items + 1) + gap
+        if self.stats_canvas_height != canvas_h:
+            self.stats_canvas.configure(height=canvas_h)
+            self.stats_canvas_height = canvas_h
         
-        # 绘制每个条形图
-        for i, (app, sec) in enumerate(items[:50]):
+        # 更新或创建每个条形图
+        for app, sec in items:
             width = int((w - label_w - 10) * (sec / max_val)) if max_val > 0 else 1  # 减少右侧边距，增加条宽度
             # 使用与时间流一致的颜色映射
             if app not in self.app_color_map:
                 self.app_color_map[app] = self.color_palette[len(self.app_color_map) % len(self.color_palette)]
             color = self.app_color_map[app]
-            # 绘制条形图
-            self.stats_canvas.create_rectangle(label_w, y, label_w + width, y + bar_h, fill=color, outline="")
-            # 在条形图内部绘制应用名称（左对齐）
-            self.stats_canvas.create_text(label_w + 8, y + bar_h/2, anchor="w", text=app, fill="#ffffff", font=('Arial', 10))
-            # 在条形图上方绘制时长（居中）
-            canvas_width = self.stats_canvas.winfo_width()
-            self.stats_canvas.create_text(canvas_width - 10, y + bar_h/2, anchor="e", text=self.format_duration(sec), fill="#ffffff", font=('Arial', 10))
+            bar_coords = (label_w, y, label_w + width, y + bar_h)
+            # 在条形图内部左对齐显示应用名称，最右侧显示时长
+            name_coords = (label_w + 8, y + bar_h/2)
+            time_coords = (w - 10, y + bar_h/2)
+            time_text = self.format_duration(sec)
+            
+            entry = self.stats_chart_items.get(app)
+            if entry is None:
+                self.stats_chart_items[app] = {
+                    'bar': self.stats_canvas.create_rectangle(*bar_coords, fill=color, outline=""),
+                    'name': self.stats_canvas.create_text(*name_coords, anchor="w", text=app, fill="#ffffff", font=('Arial', 10)),
+                    'time': self.stats_canvas.create_text(*time_coords, anchor="e", text=time_text, fill="#ffffff", font=('Arial', 10)),
+                    'bar_coords': bar_coords,
+                    'time_coords': time_coords,
+                    'time_text': time_text,
+                    'color': color,
+                }
+            else:
+                if entry['bar_coords'] != bar_coords:
+                    self.stats_canvas.coords(entry['bar'], *bar_coords)
+                    self.stats_canvas.coords(entry['name'], *name_coords)
+                    entry['bar_coords'] = bar_coords
+                if entry['time_coords'] != time_coords:
+                    self.stats_canvas.coords(entry['time'], *time_coords)
+                    entry['time_coords'] = time_coords
+                if entry['time_text'] != time_text:
+                    self.stats_canvas.itemconfig(entry['time'], text=time_text)
+                    entry['time_text'] = time_text
+                if entry['color'] != color:
+                    self.stats_canvas.itemconfig(entry['bar'], fill=color)
+                    entry['color'] = color
             y += bar_h + gap
         
-        # 绘制历史流条到独立的canvas
-        self.render_history_stream(log_new_pixels=False)
+        # 标记历史流条需要绘制（在同一帧内紧接着渲染）
+        self.render_scheduler.invalidate('time_stream')
         
         # 设置滚动区域
         self.stats_canvas.config(scrollregion=self.stats_canvas.bbox("all"))
 
+    def _delete_stats_chart_entry(self, app):
+        """删除某个应用在直方图中的条形、名称和时长文本"""
+        entry = self.stats_chart_items.pop(app)
+        self.stats_canvas.delete(entry['bar'], entry['name'], entry['time'])
 
-    
-
-            
-    
     def update_stats_window(self):
         """刷新统计窗口（只更新右侧时间显示，不更新直方图）"""
         if not self.stats_canvas or not self.stats_toggle_var.get():
             return
             
-        # 获取当前的统计数据
-        stats = self.get_screen_time_from_db()
-        
-        # 添加当前应用的临时时间
-        if self.current_app_name:
-            stats[self.current_app_name] = stats.get(self.current_app_name, 0) + (time.time() - self.current_start_time)
-            
-        # 过滤掉不需要在屏幕时间中显示的应用
-        filtered_stats = {}
-        for app, sec in stats.items():
-            if self.check_app_display_config(app, 'show_in_screen_time'):
-                filtered_stats[app] = sec
-                
-        items = sorted(filtered_stats.items(), key=lambda x: x[1], reverse=True)
-        
-        # 只更新右侧的时间文本，不重新绘制整个直方图
-        canvas_width = self.stats_canvas.winfo_width()
-        bar_h = 24
-        gap = 6
-        y = gap
-        
-        # 遍历现有的时间文本项并更新
-        for i, (app, sec) in enumerate(items[:50]):
-            # 查找并更新右侧的时间文本
-            time_text = self.stats_canvas.find_overlapping(canvas_width - 100, y, canvas_width, y + bar_h)
-            for item in time_text:
-                # 检查是否是文本项
-                if self.stats_canvas.type(item) == "text":
-                    # 获取当前文本内容，如果是时间格式则更新
-                    current_text = self.stats_canvas.itemcget(item, "text")
-                    if ":" in current_text and len(current_text) <= 8:  # 简单判断是否是时间格式
-                        self.stats_canvas.itemconfig(item, text=self.format_duration(sec))
-                        break
-            y += bar_h + gap
+        # 通过应用到图形的映射直接更新右侧的时间文本，不重新绘制整个直方图
+        for app, sec in self.get_top_screen_time_items():
+            entry = self.stats_chart_items.get(app)
+            if entry is None:
+                continue
+            time_text = self.format_duration(sec)
+            if entry['time_text'] != time_text:
+                self.stats_canvas.itemconfig(entry['time'], text=time_text)
+                entry['time_text'] = time_text
         
 
     def on_history_canvas_configure(self, event):
         prev_w = getattr(self, 'last_history_canvas_width', None)
         if prev_w is not None and event.width == prev_w:
             return
-        self.last_history_canvas_width = event.width
-        self.render_history_stream(log_new_pixels=False)
+        self.last_history_canvas_width = event.width
+        # 拖动窗口时会连续触发Configure事件，只标记为脏，由调度器合并为一次重绘
+        self.render_scheduler.invalidate('time_stream')
+
+
+    
+    def update_caps_lock_display(self, caps_lock_on):
+        """仅在状态真正改变时更新UI"""
+        if self.caps_lock_on != caps_lock_on:
+            self.caps_lock_on = caps_lock_on
+            self.update_main_frame_bg()
+            self.update_status()
+            # 更新历史流背景颜色
+            if hasattr(self, 'history_canvas'):
+                self.history_canvas.configure(bg=self.main_frame['bg'])
+
+    def rebuild_daily_app_totals(self):
+        """客户端模式下数据库为只读，请求跟踪服务重建汇总表"""
+        if self.service_client:
+            self.service_client.send({'t': 'rebuild'})
+            return
+        super().rebuild_daily_app_totals()
 
+    def check_day_rollover(self):
+        """客户端模式下会话拆分和统计重置由跟踪服务完成，界面只接收新的统计快照"""
+        if self.service_client:
+            return
+        super().check_day_rollover()
 
-    
-    def check_caps_lock(self):
-        """优化后：仅检查Caps Lock状态和窗口切换，不做其他刷新操作"""
-        # 获取当前状态
-        current_status = win32api.GetKeyState(win32con.VK_CAPITAL) & 1 != 0
-        hwnd = win32gui.GetForegroundWindow()
-        
-        # 检查窗口切换
-        if hwnd != self.last_hwnd:
-            self.handle_window_switch(hwnd)
-            
-            # 获取当前窗口的程序名（使用更准确的方法）
+    def drain_service_messages(self):
+        """客户端模式：Tk主循环定时取出跟踪服务推送的消息并处理"""
+        while True:
             try:
-                app_name = self.get_app_name_from_hwnd(hwnd)
-                window_title = win32gui.GetWindowText(hwnd)
-                
-                # 检查是否是需要大写的软件（通过程序名或窗口标题）
-                software_list = self.config.get('software_list', ['CAXA', 'CAD', 'SOLIDWORKS'])
-                is_caps_required_software = False
-                
-                # 检查程序名和窗口标题
-                for software in software_list:
-                    if (software.lower() in app_name.lower() or 
-                        software.lower() in window_title.lower()):
-                        is_caps_required_software = True
-                        # 减少日志输出，只在DEBUG模式下记录
-                        self.logger.debug(f"检测到需要大写的软件: {software} (程序: {app_name}, 标题: {window_title})")
-                        break
-                
-                # 根据软件类型自动切换大小写
-                if is_caps_required_software and not current_status:
-                    # 需要大写但当前是小写，切换为大写
-                    # 减少日志输出，改为DEBUG级别
-                    self.logger.debug(f"切换到大写 - 检测到软件: {app_name}")
-                    win32api.keybd_event(win32con.VK_CAPITAL, 0, 0, 0)
-                    win32api.keybd_event(win32con.VK_CAPITAL, 0, win32con.KEYEVENTF_KEYUP, 0)
-                    time.sleep(0.05)  # 等待系统响应
-                    # 重新获取状态以确保同步
-                    current_status = win32api.GetKeyState(win32con.VK_CAPITAL) & 1 != 0
-                    self.caps_lock_on = current_status
-                    self.update_main_frame_bg()
-                    self.update_status()
-                elif not is_caps_required_software and current_status:
-                    # 不需要大写但当前是大写，切换为小写
-                    # 减少日志输出，改为DEBUG级别
-                    self.logger.debug(f"切换到小写 - 当前软件: {app_name}")
-                    win32api.keybd_event(win32con.VK_CAPITAL, 0, 0, 0)
-                    win32api.keybd_event(win32con.VK_CAPITAL, 0, win32con.KEYEVENTF_KEYUP, 0)
-                    time.sleep(0.05)  # 等待系统响应
-                    # 重新获取状态以确保同步
-                    current_status = win32api.GetKeyState(win32con.VK_CAPITAL) & 1 != 0
-                    self.caps_lock_on = current_status
-                    self.update_main_frame_bg()
-                    self.update_status()
-                else:
-                    # 状态已正确，只更新显示
-                    if self.caps_lock_on != current_status:
-                        self.caps_lock_on = current_status
-                        self.update_main_frame_bg()
-                        self.update_status()
+                message = self.service_client.messages.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self.apply_service_message(message)
             except Exception as e:
-                self.logger.error(f"处理窗口切换时出错: {e}")
-                # 即使出错也要更新状态
-                if self.caps_lock_on != current_status:
-                    self.caps_lock_on = current_status
-                    self.update_main_frame_bg()
-                    self.update_status()
-        else:
-            # 仅在状态真正改变时更新UI
-            if self.caps_lock_on != current_status:
-                self.caps_lock_on = current_status
-                self.update_main_frame_bg()
-                self.update_status()
-                # 更新历史流背景颜色
-                if hasattr(self, 'history_canvas'):
-                    self.history_canvas.configure(bg=self.main_frame['bg'])
-        
-        # 继续下一次检查（增加检查间隔以减少CPU占用）
-        self.root.after(200, self.check_caps_lock)
-    
-
+                self.logger.error(f"处理跟踪服务消息时出错: {e}")
+        # 继续下一次处理
+        self.service_drain_id = self.root.after(100, self.drain_service_messages)
 
+    def apply_service_message(self, message):
+        """
+        应用跟踪服务推送的消息
+        hello: 新连接，清空显示用的时间流缓存，随后推送完整状态
+        schema: 数据库结构状态（迁移完成后切换查询方式）
+        state: 当前应用、开始时间和Caps Lock状态
+        totals: 今天各应用的累计时长
+        seg: 尚未写入数据库的时间流时间段（仅用于显示，由服务负责写入）
+        flushed: 服务已把时间流缓存写入数据库
+        """
+        kind = message.get('t')
+        if kind == 'state':
+            self.current_app_name = message['app']
+            self.current_start_time = message['start']
+            self.update_caps_lock_display(message['caps'])
+        elif kind == 'schema':
+            changed = (message['epoch'], message['daily_totals']) != (self.epoch_schema_ready, self.daily_totals_ready)
+            self.epoch_schema_ready = message['epoch']
+            self.daily_totals_ready = message['daily_totals']
+            self.stream_key_ready = message['stream_key']
+            if changed:
+                self.render_scheduler.invalidate('time_stream')
+        elif kind == 'totals':
+            self.today_totals.reset(message['day'], message['totals'])
+        elif kind == 'seg':
+            self.time_stream_cache.append(message['app'], message['start'], message['d'])
+        elif kind in ('hello', 'flushed'):
+            self.time_stream_cache.clear()
 
-    
     def hide_titlebar(self):
         """隐藏自定义标题栏"""
         if self.titlebar_visible:
@@ -1225,6 +4564,8 @@ class CapsLockChecker:
     
     def get_mouse_screen_info(self):
         """获取鼠标所在屏幕的矩形信息 (left, top, right, bottom)"""
+        if win32api is None:
+            return (0, 0, self.root.winfo_screenwidth(), self.root.winfo_screenheight())
         point = win32api.GetCursorPos()
         monitors = win32api.EnumDisplayMonitors()
         for monitor in monitors:
@@ -1297,25 +4638,25 @@ class CapsLockChecker:
         # 记录程序退出日志
         self.logger.info("程序退出 - 开始清理资源并关闭应用程序")
         
-        # 在应用关闭时，将当前应用的使用时间写入数据库
-        if self.current_app_name and self.current_start_time:
-            elapsed = time.time() - self.current_start_time
-            if elapsed > 0:
-                # 记录当前应用使用时间
-                self.logger.info(f"记录最后应用使用时间 - 应用: {self.current_app_name}, 时长: {self.format_duration(elapsed)}")
-                # 只记录屏幕使用时间（用于统计显示）
-                self.record_screen_time(self.current_app_name, elapsed)
+        # 本地模式：停止跟踪并写入当前会话和时间流缓存；客户端模式：断开与跟踪服务的连接，跟踪继续在服务中进行
+        if self.service_client:
+            self.service_client.close()
+        else:
+            self.stop_tracking()
         
-        # 将缓存中的时间流数据写入数据库
-        if hasattr(self, 'time_stream_cache') and self.time_stream_cache:
-            self.logger.info("程序退出 - 将缓存中的时间流数据写入数据库")
-            self.flush_time_stream_cache()
+        # 取消尚未执行的画布重绘
+        if hasattr(self, 'render_scheduler'):
+            self.render_scheduler.cancel()
+        
+        # 停止后台写入线程并关闭数据库长连接
+        self.close_storage()
         
         # 清理Canvas资源
         if hasattr(self, 'history_canvas'):
             self.history_canvas.delete("all")
         if hasattr(self, 'stats_canvas'):
             self.stats_canvas.delete("all")
+            self.stats_chart_items.clear()
         
         self.save_window_position()
         
@@ -1346,6 +4687,7 @@ class CapsLockChecker:
         # 更新历史流背景色
         if hasattr(self, 'history_canvas') and self.history_canvas:
             self.history_canvas.configure(bg=current_color)
+            self.refresh_stream_background()
     
     def center_window(self):
         """将窗口居中显示在屏幕上"""
@@ -1404,8 +4746,11 @@ class CapsLockChecker:
         # 设置历史流canvas的宽度为窗口宽度（如果存在）
         if hasattr(self, 'history_canvas'):
             self.history_canvas.configure(width=width)
-        # 更新历史流显示
-        self.render_history_stream()
+        # 更新历史流显示（配置可能影响布局，整体重新布局）
+        self.stream_layout = None
+        self.last_history_hash = None
+        self.render_scheduler.invalidate('time_stream')
+        self.render_scheduler.frame_budget_ms = self.config.get('render_frame_budget_ms', 50)
         
         # 应用颜色设置
         self.color_caps_on = self.config.get("color_caps_on", "#fa6666")
@@ -1429,142 +4774,6 @@ class CapsLockChecker:
         # 重新绘制统计图表以应用新颜色
         self.update_stats_window()
     
-    def read_config(self):
-        """读取配置文件"""
-        # 默认配置
-        self.config = {
-            'color_caps_on': '#fa6666',
-            'color_caps_off': '#4CAF50',
-            'color_titlebar': '#2c3e50',
-            'window_width': 300,
-            'window_height': 240,
-            'window_x': -1,
-            'window_y': -1,
-            'always_on_top': 1,
-            'software_list': ['CAXA', 'CAD', 'SOLIDWORKS'],
-
-            'grid_second_per_block': 30,
-
-            'screen_time_refresh_frequency': 10  # 屏幕显示时间刷新率，单位：次/10秒
-        }
-        
-        if os.path.exists('config.txt'):
-            with open('config.txt', 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                
-            # 使用字典映射处理配置键值，提高效率
-            config_handlers = {
-                'color_caps_on': str,
-                'color_caps_off': str,
-                'color_titlebar': str,
-                'window_width': int,
-                'window_height': int,
-                'window_x': int,
-                'window_y': int,
-                'always_on_top': lambda v: v.strip().lower() in ['true', '1', 'yes', 'on'],
-                'software_list': lambda v: [item.strip() for item in v.split(',') if item.strip()],
-
-                'grid_second_per_block': int,
-
-                'screen_time_refresh_frequency': int
-            }
-            
-            # 初始化进程配置字典
-            self.config['process_config'] = {}
-            current_section = None  # 当前章节名（进程名）
-            
-            for line in lines:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                
-                # 检查是否为章节头 [process.exe]
-                if line.startswith('[') and line.endswith(']'):
-                    current_section = line[1:-1].strip()
-                    # 初始化进程配置
-                    if current_section not in self.config['process_config']:
-                        self.config['process_config'][current_section] = {
-                            'display_name': current_section,
-                            'show_in_screen_time': True,
-                            'show_in_time_stream': True
-                        }
-                    continue
-                
-                # 处理键值对
-                if '=' in line:
-                    key, value = line.split('=', 1)
-                    key = key.strip()
-                    value = value.strip()
-                    
-                    # 处理注释
-                    if ';' in value:
-                        value = value.split(';')[0].strip()
-                    
-                    # 区分全局配置和进程配置
-                    if current_section is None:
-                        # 全局配置
-                        if key in config_handlers:
-                            self.config[key] = config_handlers[key](value)
-                    else:
-                        # 进程配置
-                        if key == 'display_name':
-                            self.config['process_config'][current_section]['display_name'] = value
-                        elif key == 'show_in_screen_time':
-                            self.config['process_config'][current_section]['show_in_screen_time'] = \
-                                value.strip().lower() in ['true', '1', 'yes', 'on']
-                        elif key == 'show_in_time_stream':
-                            self.config['process_config'][current_section]['show_in_time_stream'] = \
-                                value.strip().lower() in ['true', '1', 'yes', 'on']
-            # 保持 backward compatibility - 将 software_list 转换为新格式
-            if 'software_list' not in self.config:
-                self.config['software_list'] = []
-        else:
-            # 配置文件不存在，生成默认配置文件
-            # 初始化默认进程配置
-            self.config['process_config'] = {
-                'explorer.exe': {
-                    'display_name': 'Windows Explorer',
-                    'show_in_screen_time': True,
-                    'show_in_time_stream': True
-                },
-                'chrome.exe': {
-                    'display_name': 'Google Chrome',
-                    'show_in_screen_time': True,
-                    'show_in_time_stream': True
-                },
-                'wechat.exe': {
-                    'display_name': '微信',
-                    'show_in_screen_time': True,
-                    'show_in_time_stream': True
-                },
-                'code.exe': {
-                    'display_name': 'Visual Studio Code',
-                    'show_in_screen_time': True,
-                    'show_in_time_stream': True
-                },
-                'QQ.exe': {
-                    'display_name': 'QQ',
-                    'show_in_screen_time': True,
-                    'show_in_time_stream': True
-                },
-                'CAXA.exe': {
-                    'display_name': 'CAXA',
-                    'show_in_screen_time': True,
-                    'show_in_time_stream': True
-                },
-                'edge.exe': {
-                    'display_name': 'Microsoft Edge',
-                    'show_in_screen_time': True,
-                    'show_in_time_stream': True
-                },
-                'LockApp.exe': {
-                    'display_name': 'Lock Screen',
-                    'show_in_screen_time': False,
-                    'show_in_time_stream': True
-                }
-            }
-            self.write_config_file()
-    
     def save_window_state(self):
         """保存窗口状态到配置"""
         try:
@@ -1580,63 +4789,6 @@ class CapsLockChecker:
         except Exception as e:
             self.logger.error(f"保存窗口状态时出错: {e}")
     
-    def write_config_file(self, save_size=True):
-        """将配置写入文件"""
-        # 确保配置字典包含所有必要的键
-        # 添加时间流和刷新率配置的默认值
-        self.config.setdefault('grid_second_per_block', 30)
-        self.config.setdefault('screen_time_refresh_frequency', 10)
-        
-        with open('config.txt', 'w', encoding='utf-8') as f:
-            f.write('# Caps Lock 检测器配置文件\n')
-            f.write('# 颜色设置\n')
-            f.write('# color_caps_on: Caps Lock开启时的指示灯颜色\n')
-            f.write(f"color_caps_on = {self.config['color_caps_on']}\n")
-            f.write('# color_caps_off: Caps Lock关闭时的指示灯颜色\n')
-            f.write(f"color_caps_off = {self.config['color_caps_off']}\n")
-            f.write('# color_titlebar: 窗口标题栏颜色\n')
-            f.write(f"color_titlebar = {self.config['color_titlebar']}\n")
-            f.write('\n# 窗口设置\n')
-            f.write('# window_width: 窗口宽度(像素)\n')
-            if save_size:
-                f.write(f"window_width = {self.config['window_width']}\n")
-            f.write('# window_height: 窗口高度(像素)\n')
-            if save_size:
-                f.write(f"window_height = {self.config['window_height']}\n")
-            f.write('# window_x: 窗口X坐标位置(-1表示居中)\n')
-            f.write(f"window_x = {self.config['window_x']}\n")
-            f.write('# window_y: 窗口Y坐标位置(-1表示居中)\n')
-            f.write(f"window_y = {self.config['window_y']}\n")
-            f.write('\n# 其他设置\n')
-            f.write('# always_on_top: 窗口是否始终置顶(true/false)\n')
-            f.write(f"always_on_top = {'true' if self.config['always_on_top'] else 'false'}\n")
-            f.write('# software_list: 自动切换为大写锁定的软件列表(逗号分隔)，其他软件自动切换为小写\n')
-            f.write(f"software_list = {','.join(self.config['software_list'])}\n")  # 写入软件列表
-            f.write('# grid_second_per_block: 时间流可视化中每个方块代表的秒数(默认30秒)\n')
-            f.write(f"grid_second_per_block = {self.config.get('grid_second_per_block', 30)}\n")
-
-            f.write('# screen_time_refresh_frequency: 屏幕时间刷新频率，单位次/10秒(默认10次)\n')
-            f.write(f"screen_time_refresh_frequency = {self.config.get('screen_time_refresh_frequency', 10)}\n")  # 写入屏幕显示时间刷新率（单位：次/10秒）
-            
-            # 写入进程配置（新格式，带进程头）
-            f.write('\n# 进程配置\n')
-            f.write('# 格式：[进程名称]\n')
-            f.write('# display_name: 在界面中显示的名称\n')
-            f.write('# show_in_screen_time: 是否在屏幕时间统计中显示(true/false)\n')
-            f.write('# show_in_time_stream: 是否在时间流中显示(true/false)\n')
-            
-            # 获取所有进程配置
-            process_config = self.config.get('process_config', {})
-            
-            # 只写入现有的进程配置，不再添加默认进程配置
-            # 这样可以保留用户的自定义设置
-            for process_name, config in process_config.items():
-                f.write(f'\n[{process_name}]\n')
-                f.write(f"display_name = {config.get('display_name', process_name)}\n")
-                f.write(f"show_in_screen_time = {'true' if config.get('show_in_screen_time', True) else 'false'}\n")
-                f.write(f"show_in_time_stream = {'true' if config.get('show_in_time_stream', True) else 'false'}\n")
-        # 默认配置文件已生成
-
     def refresh_config(self):
         """刷新配置"""
         # 记录配置刷新日志
@@ -1652,6 +4804,9 @@ class CapsLockChecker:
         # 重新读取配置
         self.read_config()
         self.apply_config()
+        # 客户端模式下通知跟踪服务重新读取配置（自动大写软件列表和显示名称）
+        if self.service_client:
+            self.service_client.send({'t': 'reload'})
         
         # 比较并记录变化的关键配置
         changes = []
@@ -1687,31 +4842,6 @@ class CapsLockChecker:
             # 使用write_config_file方法重新写入整个配置文件，保存窗口尺寸（配置文件中始终需要尺寸设置）
             self.write_config_file(save_size=True)
     
-    def setup_logging(self):
-        """设置日志系统"""
-        # 创建logs文件夹
-        log_folder = 'logs'
-        if not os.path.exists(log_folder):
-            os.makedirs(log_folder)
-        
-        # 生成日志文件名
-        today = datetime.date.today()
-        log_filename = os.path.join(log_folder, 'log_{}.txt'.format(today.strftime('%Y-%m-%d')))
-        
-        # 配置日志 - 将日志级别从DEBUG改为INFO，减少日志输出
-        logging.basicConfig(
-            filename=log_filename,
-            level=logging.INFO,  # 改为INFO级别，减少DEBUG级别的日志
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            encoding='utf-8'
-        )
-        
-        # Initialize logger instance
-        self.logger = logging.getLogger(__name__)
-        
-        # 记录程序启动日志
-        self.logger.info("程序启动 - 屏幕时间追踪器初始化开始")
-    
     def _create_titlebar_buttons(self):
         """创建标题栏按钮"""
         # 添加关闭按钮
@@ -1786,6 +4916,7 @@ class CapsLockChecker:
         self.right_click_menu.add_command(label="设置", command=self.show_settings_window)
         self.right_click_menu.add_command(label="刷新", command=self.refresh_config)
         self.right_click_menu.add_command(label="统计", command=self.show_stats_window)
+        self.right_click_menu.add_command(label="重建统计", command=self.rebuild_daily_app_totals)
         self.right_click_menu.add_separator()
         self.right_click_menu.add_command(label="关闭", command=self.on_menu_close)
         self.root.bind("<Button-3>", self.show_right_click_menu)
@@ -1809,6 +4940,11 @@ class CapsLockChecker:
         # 统计图表渲染优化：保存上一次渲染的统计数据哈希值
         self.last_stats_hash = None
         
+        # 时间流增量渲染的布局状态（已绘制记录、方块序列等），None表示需要整体重新布局
+        self.stream_layout = None
+        # bitmap模式下承载全部方块的位图
+        self.stream_image = None
+        
         # 创建历史流条的高度常量（增加高度以支持方块堆叠）
         self.history_bar_h = 120
         self.history_gap = 0  # 移除间隙，确保与底部对齐
@@ -1951,19 +5087,9 @@ class CapsLockChecker:
                 # 删除所有项
                 canvas.delete("all")
         
-        # 清空绑定记录
+        # 清空绑定记录和直方图图形映射
         self.bound_canvas_tags.clear()
-        
-        # 限制缓存大小
-        for app_name in list(self.time_stream_cache.keys()):
-            if app_name in self.time_stream_cache:
-                cache = self.time_stream_cache[app_name]
-                if isinstance(cache, deque) and len(cache) > 50:
-                    # 创建新的更小的deque
-                    self.time_stream_cache[app_name] = deque(list(cache)[-50:], maxlen=100)
-                elif isinstance(cache, list) and len(cache) > 50:
-                    # 转换为deque并限制大小
-                    self.time_stream_cache[app_name] = deque(cache[-50:], maxlen=100)
+        self.stats_chart_items.clear()
         
         # 清理历史点击绑定
         if hasattr(self, 'history_click_bindings'):
@@ -1972,9 +5098,10 @@ class CapsLockChecker:
         # 强制垃圾回收
         gc.collect()
         
-        # 重置哈希值
+        # 重置哈希值和时间流布局（画布已清空，下次需要整体重新布局）
         self.last_stats_hash = None
         self.last_history_hash = None
+        self.stream_layout = None
     
     def cleanup_screen_time_memory(self):
         """清理屏幕时间相关内存"""
@@ -1989,10 +5116,34 @@ class CapsLockChecker:
         # 清理历史流画布
         if hasattr(self, 'history_canvas') and self.history_canvas:
             self.history_canvas.delete("all")
+        self.stream_layout = None
     
 
 
+def main():
+    parser = argparse.ArgumentParser(description='Caps Lock 状态检测与屏幕时间追踪')
+    parser.add_argument('--service', action='store_true', help='以无界面跟踪服务运行')
+    parser.add_argument('--client', action='store_true', help='以界面客户端运行，显示已启动的跟踪服务的数据')
+    parser.add_argument('--address', help='跟踪服务的本地IPC地址（默认为当前用户私有的地址）')
+    parser.add_argument('--replay', help='（测试用）从JSON文件回放录制的窗口切换记录，代替win32接口')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='回放速度倍数')
+    args = parser.parse_args()
+    window_provider = ReplayWindowProvider.load(args.replay, args.replay_speed) if args.replay else None
+    
+    if args.service:
+        root = HeadlessScheduler(logging.getLogger(__name__))
+        service = TrackerService(root, args.address, window_provider)
+        try:
+            root.mainloop()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.shutdown()
+    else:
+        root = tk.Tk()
+        app = CapsLockChecker(root, service_address=(args.address or default_service_address()) if args.client else None, window_provider=window_provider)
+        root.mainloop()
+
+
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = CapsLockChecker(root)
-    root.mainloop()
+    main()
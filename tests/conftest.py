@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试直接导入仓库根目录下的stt_new.py（非Windows环境下win32模块缺失时自动降级）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
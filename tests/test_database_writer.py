@@ -0,0 +1,66 @@
+"""后台分组提交写入线程"""
+import logging
+import sqlite3
+import threading
+import time
+
+import stt_new
+
+
+def make_writer(tmp_path):
+    db_path = str(tmp_path / 'history.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE t (v INTEGER)')
+    conn.commit()
+    conn.close()
+    writer = stt_new.DatabaseWriter(logging.getLogger('test_database_writer'), batch_interval=0.01)
+    writer.start()
+    return writer, db_path
+
+
+def count_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM t').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_stop_commits_queued_writes(tmp_path):
+    writer, db_path = make_writer(tmp_path)
+    committed = []
+    for i in range(50):
+        writer.submit(db_path, [('INSERT INTO t VALUES (?)', [(i,)])], on_commit=lambda i=i: committed.append(i))
+    assert writer.stop()
+    assert count_rows(db_path) == 50
+    assert sorted(committed) == list(range(50))
+    # 停止后的写入同步完成
+    writer.submit_one(db_path, 'INSERT INTO t VALUES (?)', (50,))
+    assert count_rows(db_path) == 51
+
+
+def test_stop_reports_timeout(tmp_path):
+    writer, db_path = make_writer(tmp_path)
+    release = threading.Event()
+    writer.submit(db_path, [('INSERT INTO t VALUES (?)', [(1,)])], on_commit=release.wait)
+    # 写入线程仍在提交（回调阻塞）时超时返回False
+    assert not writer.stop(timeout=0.1)
+    release.set()
+    writer.join(5)
+    assert not writer.is_alive()
+    assert count_rows(db_path) == 1
+
+
+def test_stop_interrupts_maintenance(tmp_path):
+    writer, db_path = make_writer(tmp_path)
+    # 不会自行结束的维护语句，模拟整理大数据库的VACUUM
+    endless = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c'
+    writer.submit_maintenance(db_path, [endless, 'VACUUM'])
+    writer.submit(db_path, [('INSERT INTO t VALUES (?)', [(1,)])])
+    deadline = time.monotonic() + 5
+    while writer._maintenance_conn is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert writer._maintenance_conn is not None
+    # 维护语句被中断，之后排队的写操作仍然提交
+    assert writer.stop(timeout=5)
+    assert count_rows(db_path) == 1
@@ -0,0 +1,199 @@
+"""旧版数据库的分批结构迁移：整数时间戳回填、汇总表重建、字典编码、时间流唯一键和像素格水位线"""
+import datetime
+import logging
+import sqlite3
+
+import stt_new
+
+
+# 最初版本（user_version为0）的建表语句
+BASELINE_SCREEN_TIME_SQL = '''
+    CREATE TABLE screen_time (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        app_name TEXT NOT NULL,
+        duration REAL NOT NULL
+    );
+    CREATE INDEX idx_screen_time_timestamp ON screen_time (timestamp);
+    CREATE INDEX idx_screen_time_app ON screen_time (app_name);
+'''
+BASELINE_TIME_STREAM_SQL = '''
+    CREATE TABLE time_stream (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        app_name TEXT NOT NULL,
+        duration REAL NOT NULL
+    );
+    CREATE INDEX idx_time_stream_timestamp ON time_stream (timestamp);
+    CREATE INDEX idx_time_stream_app ON time_stream (app_name);
+    CREATE TABLE logged_pixels (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        app_name TEXT NOT NULL,
+        time_range_start TEXT NOT NULL,
+        time_range_end TEXT NOT NULL,
+        duration REAL NOT NULL,
+        log_timestamp TEXT NOT NULL,
+        UNIQUE(app_name, time_range_start, time_range_end)
+    );
+'''
+APPS = ('code.exe', 'chrome.exe', 'WINWORD.EXE', '微信.exe')
+
+
+class ManualScheduler:
+    """只记录after调用，由测试逐步驱动迁移"""
+
+    def after(self, ms, func, *args):
+        return None
+
+    def after_cancel(self, after_id):
+        pass
+
+
+def baseline_rows(count, start):
+    """按时间顺序生成旧格式记录 (timestamp, app_name, duration)，跨越多天，部分记录跨越午夜"""
+    rows = []
+    end = start
+    for k in range(count):
+        duration = float(k % 7 * 600 + 30) + 0.5
+        end += datetime.timedelta(seconds=duration + k % 3 * 60)
+        rows.append((end.strftime('%Y-%m-%d %H:%M:%S'), APPS[k % len(APPS)], duration))
+    return rows
+
+
+def expected_day_totals(rows):
+    """按起始时间（记录时刻 - 整数秒时长）的本地日期汇总"""
+    totals = {}
+    for timestamp, app_name, duration in rows:
+        start = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S') - datetime.timedelta(seconds=int(duration))
+        key = (int(start.strftime('%Y%m%d')), app_name)
+        totals[key] = totals.get(key, 0.0) + duration
+    return totals
+
+
+def build_baseline(screen_rows, stream_rows, pixel_starts):
+    conn = sqlite3.connect('screen_time_history.db')
+    conn.executescript(BASELINE_SCREEN_TIME_SQL)
+    conn.executemany('INSERT INTO screen_time (timestamp, app_name, duration) VALUES (?, ?, ?)', screen_rows)
+    conn.commit()
+    conn.close()
+    conn = sqlite3.connect('time_stream_history.db')
+    conn.executescript(BASELINE_TIME_STREAM_SQL)
+    conn.executemany('INSERT INTO time_stream (timestamp, app_name, duration) VALUES (?, ?, ?)', stream_rows)
+    conn.executemany(
+        'INSERT INTO logged_pixels (app_name, time_range_start, time_range_end, duration, log_timestamp) VALUES (?, ?, ?, 60, ?)',
+        [('code.exe', start, start, start) for start in pixel_starts]
+    )
+    conn.commit()
+    conn.close()
+
+
+def make_tracker():
+    tracker = stt_new.ScreenTimeTracker.__new__(stt_new.ScreenTimeTracker)
+    tracker.logger = logging.getLogger('test_schema_migration')
+    tracker.config = {}
+    tracker.root = ManualScheduler()
+    tracker.MIGRATION_CHUNK_ROWS = 16  # 小批次，覆盖多批回填和复制
+    tracker.db_manager = stt_new.DatabaseManager(tracker.logger)
+    tracker.db_writer = stt_new.DatabaseWriter(tracker.logger, batch_interval=0.01)
+    tracker.db_writer.start()
+    tracker.init_db()
+    return tracker
+
+
+def run_migrations(tracker, during=None, max_steps=1000):
+    """逐步执行迁移直到完成，每一步之后等待写入线程提交；during(step)在每一步之前调用，模拟迁移期间的写入"""
+    step = 0
+    while tracker.schema_migrations:
+        assert step < max_steps, f"迁移没有完成: {tracker.schema_migrations[0]}"
+        if during:
+            during(step)
+        tracker.run_schema_migration_step()
+        assert tracker.db_writer.flush(5)
+        step += 1
+    return step
+
+
+def test_baseline_database_migrates_to_latest_schema(tmp_path, monkeypatch, caplog):
+    monkeypatch.chdir(tmp_path)
+    caplog.set_level(logging.INFO)
+    screen_rows = baseline_rows(150, datetime.datetime(2024, 3, 1, 20, 0, 0))
+    stream_rows = baseline_rows(120, datetime.datetime(2024, 3, 1, 21, 0, 0))
+    # 重启后重新加载缓存造成的重复时间流记录
+    stream_rows += stream_rows[10:30]
+    pixel_starts = ['2024-03-02 10:00:00', '2024-03-02 11:30:00']
+    build_baseline(screen_rows, stream_rows, pixel_starts)
+
+    tracker = make_tracker()
+    assert [task['kind'] for task in tracker.schema_migrations] == [
+        'epoch', 'daily_totals', 'apps', 'epoch', 'apps', 'stream_key', 'pixel_watermark']
+    assert not tracker.daily_totals_ready and not tracker.stream_key_ready
+
+    # 迁移期间继续写入新记录
+    new_screen_rows = []
+    new_stream_rows = []
+
+    def write_during_migration(step):
+        if step % 5:
+            return
+        end = datetime.datetime(2024, 3, 20, 9, 0, 0) + datetime.timedelta(minutes=step)
+        timestamp = end.strftime('%Y-%m-%d %H:%M:%S')
+        app_name = APPS[step % len(APPS)] if step % 10 else 'new_app.exe'
+        start_ts, day_key = tracker.epoch_columns(timestamp, 30.0)
+        tracker.write_to_db((timestamp, app_name, 30.0, start_ts, day_key))
+        tracker.write_to_time_stream_db((timestamp, app_name, 30.0, start_ts, day_key))
+        new_screen_rows.append((timestamp, app_name, 30.0))
+        new_stream_rows.append((timestamp, app_name, 30.0))
+
+    steps = run_migrations(tracker, write_during_migration)
+    assert steps > 10 and new_screen_rows
+    assert tracker.db_writer.stop()
+    assert not [record.getMessage() for record in caplog.records if record.levelno >= logging.ERROR]
+
+    assert tracker.epoch_schema_ready == {'screen_time': True, 'time_stream': True}
+    assert tracker.daily_totals_ready and tracker.stream_key_ready
+    assert tracker.apps_schema_live == {'screen_time': True, 'time_stream': True}
+
+    conn = sqlite3.connect('screen_time_history.db')
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == tracker.SCHEMA_VERSIONS['screen_time']
+    assert tracker.schema_object_type(conn, 'screen_time') == 'view'
+    assert tracker.schema_object_type(conn, 'screen_time_legacy') is None
+    all_screen_rows = screen_rows + new_screen_rows
+    assert conn.execute('SELECT COUNT(*) FROM screen_time').fetchone()[0] == len(all_screen_rows)
+    assert conn.execute('SELECT COUNT(*) FROM screen_time WHERE start_ts IS NULL OR day_key IS NULL').fetchone()[0] == 0
+    assert sorted(conn.execute('SELECT timestamp, app_name, duration FROM screen_time')) == sorted(all_screen_rows)
+    # 每个程序名只保存一次
+    assert conn.execute('SELECT COUNT(*) FROM apps').fetchone()[0] == len(APPS) + 1
+    expected = expected_day_totals(all_screen_rows)
+    assert len({day_key for day_key, _ in expected}) > 3
+    raw_totals = {(day_key, app_name): total for day_key, app_name, total in conn.execute(
+        'SELECT day_key, app_name, SUM(duration) FROM screen_time GROUP BY day_key, app_name')}
+    daily_totals = {(day_key, app_name): total for day_key, app_name, total in conn.execute(
+        'SELECT day_key, app_name, total_duration FROM daily_app_totals')}
+    assert raw_totals == expected
+    assert daily_totals == expected
+    # 回填的整数时间戳与新记录使用同一换算
+    for timestamp, duration, start_ts, day_key in conn.execute('SELECT timestamp, duration, start_ts, day_key FROM screen_time'):
+        assert (start_ts, day_key) == tracker.epoch_columns(timestamp, duration)
+    conn.close()
+
+    conn = sqlite3.connect('time_stream_history.db')
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == tracker.SCHEMA_VERSIONS['time_stream']
+    assert tracker.schema_object_type(conn, 'time_stream') == 'view'
+    assert tracker.schema_object_type(conn, 'time_stream_legacy') is None
+    assert tracker.schema_object_type(conn, 'logged_pixels') is None
+    unique_stream_rows = set(stream_rows + new_stream_rows)
+    assert conn.execute('SELECT COUNT(*) FROM time_stream').fetchone()[0] == len(unique_stream_rows)
+    assert set(conn.execute('SELECT timestamp, app_name, duration FROM time_stream')) == unique_stream_rows
+    assert conn.execute('SELECT COUNT(*) FROM (SELECT 1 FROM time_stream_rows GROUP BY start_ts, app_id HAVING COUNT(*) > 1)'
+                        ).fetchone()[0] == 0
+    assert conn.execute('SELECT value FROM watermarks WHERE name = ?',
+                        (tracker.PIXEL_WATERMARK,)).fetchone()[0] == max(pixel_starts)
+    conn.close()
+    tracker.db_manager.close_all()
+
+    # 再次启动时不再登记迁移任务
+    tracker = make_tracker()
+    assert tracker.schema_migrations == []
+    assert tracker.daily_totals_ready and tracker.stream_key_ready
+    tracker.db_writer.stop()
+    tracker.db_manager.close_all()
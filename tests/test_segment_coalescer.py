@@ -0,0 +1,88 @@
+"""窗口切换时间段合并"""
+import pytest
+
+import stt_new
+
+
+def make_coalescer(min_duration=1.0):
+    rows = []
+    coalescer = stt_new.SegmentCoalescer(lambda app_name, start, end: rows.append((app_name, start, end)), min_duration)
+    return coalescer, rows
+
+
+def totals(rows):
+    result = {}
+    for app_name, start, end in rows:
+        result[app_name] = result.get(app_name, 0.0) + end - start
+    return result
+
+
+def test_consecutive_same_app_segments_merge():
+    coalescer, rows = make_coalescer()
+    coalescer.add('code.exe', 0.0, 10.0)
+    coalescer.add('code.exe', 10.0, 20.0)
+    coalescer.add('word.exe', 20.0, 30.0)
+    coalescer.flush()
+    assert rows == [('code.exe', 0.0, 20.0), ('word.exe', 20.0, 30.0)]
+    assert coalescer.merged_count == 1 and coalescer.row_count == 2
+
+
+def test_short_segment_is_absorbed_into_previous():
+    coalescer, rows = make_coalescer()
+    coalescer.add('code.exe', 0.0, 10.0)
+    coalescer.add('explorer.exe', 10.0, 10.4)  # Alt+Tab经过的窗口
+    coalescer.add('word.exe', 10.4, 20.0)
+    coalescer.flush()
+    assert rows == [('code.exe', 0.0, 10.4), ('word.exe', 10.4, 20.0)]
+    assert coalescer.absorbed_count == 1
+
+
+def test_leading_short_segment_is_absorbed_into_next():
+    coalescer, rows = make_coalescer()
+    coalescer.add('explorer.exe', 0.0, 0.5)
+    coalescer.add('word.exe', 0.5, 10.0)
+    coalescer.flush()
+    assert rows == [('word.exe', 0.0, 10.0)]
+
+
+def test_zero_threshold_only_merges_same_app():
+    coalescer, rows = make_coalescer(0)
+    coalescer.add('code.exe', 0.0, 5.0)
+    coalescer.add('explorer.exe', 5.0, 5.2)
+    coalescer.add('code.exe', 5.2, 8.0)
+    coalescer.flush()
+    assert rows == [('code.exe', 0.0, 5.0), ('explorer.exe', 5.0, 5.2), ('code.exe', 5.2, 8.0)]
+
+
+def test_release_waits_until_pending_segment_is_final():
+    coalescer, rows = make_coalescer()
+    coalescer.add('code.exe', 0.0, 10.0)
+    # 当前会话刚开始，仍可能是短时间段
+    coalescer.release('word.exe', 10.0, 10.5)
+    assert rows == [] and coalescer.pending == ['code.exe', 0.0, 10.0]
+    # 当前会话超过阈值后，暂存的时间段不会再被合并
+    coalescer.release('word.exe', 10.0, 11.5)
+    assert rows == [('code.exe', 0.0, 10.0)] and coalescer.pending is None
+    # 同一程序的会话不释放（之后会合并）
+    coalescer.add('word.exe', 10.0, 12.0)
+    coalescer.release('word.exe', 12.0, 20.0)
+    assert coalescer.pending == ['word.exe', 10.0, 12.0]
+
+
+def test_total_duration_is_preserved_across_flushes():
+    coalescer, rows = make_coalescer(2.0)
+    segments = []
+    t = 0.0
+    for k, (app_name, duration) in enumerate([('a', 5), ('b', 0.5), ('c', 1), ('a', 7), ('a', 3), ('b', 1.5),
+                                              ('c', 0.2), ('c', 4), ('a', 0.1), ('b', 9)]):
+        segments.append((app_name, t, t + duration))
+        coalescer.add(app_name, t, t + duration)
+        if k % 3 == 2:
+            coalescer.flush()
+        t += duration
+    coalescer.flush()
+    assert sum(totals(rows).values()) == pytest.approx(sum(totals(segments).values()))
+    # 写入的记录首尾相接、不重叠
+    assert all(prev[2] == row[1] for prev, row in zip(rows, rows[1:]))
+    assert rows[0][1] == 0.0 and rows[-1][2] == t
+    assert coalescer.segment_count == len(segments) and coalescer.row_count == len(rows)
@@ -0,0 +1,162 @@
+"""跟踪服务与界面客户端之间的本地IPC（Unix套接字，可在Linux上运行）"""
+import logging
+import multiprocessing
+import os
+import queue
+import sqlite3
+import stat
+import threading
+import time
+
+import pytest
+from multiprocessing.connection import Client
+
+import stt_new
+
+
+@pytest.fixture
+def private_dir(tmp_path, monkeypatch):
+    """把当前用户的私有目录指向临时目录"""
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    return tmp_path / 'stt_new'
+
+
+def test_address_and_authkey_are_private(private_dir):
+    address = stt_new.default_service_address()
+    key = stt_new.service_authkey()
+    assert os.path.dirname(address) == str(private_dir)
+    assert stat.S_IMODE(os.stat(private_dir).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(private_dir / 'service.key').st_mode) == 0o600
+    # 密钥随机生成一次，之后保持不变
+    assert len(key) == 32 and stt_new.service_authkey() == key
+
+
+def test_server_rejects_wrong_authkey(private_dir):
+    received = queue.Queue()
+    address = stt_new.default_service_address()
+    server = stt_new.ServiceServer(address, logging.getLogger('test_service_ipc'),
+                                   on_connect=lambda conn: None,
+                                   on_message=lambda conn, message: received.put(message))
+    server.start()
+    try:
+        with pytest.raises((multiprocessing.AuthenticationError, OSError, EOFError)):
+            Client(address, authkey=b'stt_new_tracker').send_bytes(stt_new.encode_message({'t': 'stop'}))
+        client = stt_new.ServiceClient(address, logging.getLogger('test_service_ipc'))
+        assert client.connect()
+        client.send({'t': 'reload'})
+        assert received.get(timeout=5) == {'t': 'reload'}
+        assert received.empty()
+        client.close()
+    finally:
+        server.stop()
+
+
+class ServiceThread(threading.Thread):
+    """在后台线程中运行TrackerService（数据库连接在创建它的线程中使用）"""
+
+    def __init__(self, trace):
+        super().__init__(daemon=True)
+        self.trace = trace
+        self.ready = threading.Event()
+        self.service = None
+        self.root = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.root = stt_new.HeadlessScheduler(logging.getLogger('test_service_ipc'))
+            self.service = stt_new.TrackerService(self.root, window_provider=stt_new.ReplayWindowProvider(self.trace))
+        except Exception as e:
+            self.error = e
+            self.ready.set()
+            raise
+        self.ready.set()
+        try:
+            self.root.mainloop()
+        finally:
+            self.service.shutdown()
+
+    def call(self, func, *args):
+        """在服务主循环中执行并等待返回"""
+        done = queue.Queue()
+        self.root.after(0, lambda: done.put(func(*args)))
+        return done.get(timeout=5)
+
+
+def wait_for(messages, kind, timeout=5):
+    """读取客户端收到的消息，直到收到指定类型的消息，返回期间收到的全部消息"""
+    received = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            message = messages.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        received.append(message)
+        if message['t'] == kind:
+            return received
+    raise AssertionError(f"没有收到{kind}消息: {received}")
+
+
+def test_service_client_smoke(private_dir, tmp_path, monkeypatch):
+    workdir = tmp_path / 'data'
+    workdir.mkdir()
+    monkeypatch.chdir(workdir)
+    service_thread = ServiceThread([(0, 1, 'editor.exe', 'notes'), (0.2, 2, 'browser.exe', 'docs')])
+    service_thread.start()
+    assert service_thread.ready.wait(10) and service_thread.error is None
+    service = service_thread.service
+
+    logger = logging.getLogger('test_service_ipc')
+    client = stt_new.ServiceClient(stt_new.default_service_address(), logger)
+    assert client.connect()
+    client.start()
+    try:
+        # 欢迎消息：结构状态、当前状态和今天的统计
+        welcome = wait_for(client.messages, 'totals')
+        kinds = [message['t'] for message in welcome]
+        assert kinds[:2] == ['hello', 'schema'] and 'state' in kinds
+        assert welcome[1]['stream_key'] is True
+
+        # 客户端只读打开数据库，不创建写入线程
+        checker = stt_new.CapsLockChecker.__new__(stt_new.CapsLockChecker)
+        checker.logger = logger
+        checker.config = {}
+        checker.service_client = client
+        checker.render_scheduler = stt_new.RenderScheduler(stt_new.HeadlessScheduler(), logger)
+        checker.init_client_storage()
+        assert checker.db_writer is None
+        checker.apply_service_message(welcome[1])
+        assert checker.stream_key_ready and checker.daily_totals_ready
+        conn = checker.db_manager.get_connection(checker.time_stream_db_file())
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute('DELETE FROM watermarks')
+        conn.rollback()
+
+        # 服务刷新时间流缓存时不等待写入线程（不阻塞采样），提交后推送flushed
+        def no_blocking_flush(timeout=None):
+            raise AssertionError('flush_time_stream_cache不应阻塞等待写入线程')
+        service.db_writer.flush = no_blocking_flush
+        end_time = time.time()
+        service_thread.call(service.update_time_stream_cache, 'editor.exe', 30, end_time)
+        assert wait_for(client.messages, 'seg')[-1]['app'] == 'editor.exe'
+        service_thread.call(service.flush_time_stream_cache)
+        wait_for(client.messages, 'flushed')
+        rows = conn.execute('SELECT app_name, duration FROM time_stream').fetchall()
+        assert ('editor.exe', 30.0) in rows
+
+        # 客户端的写请求由服务执行
+        client.send({'t': 'watermark', 'value': '2025-01-01 00:00:00'})
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            row = conn.execute('SELECT value FROM watermarks WHERE name = ?', (stt_new.ScreenTimeTracker.PIXEL_WATERMARK,)).fetchone()
+            if row and row[0] == '2025-01-01 00:00:00':
+                break
+            time.sleep(0.05)
+        else:
+            raise AssertionError('服务没有写入客户端请求的水位线')
+        checker.db_manager.close_all()
+    finally:
+        client.close()
+        service_thread.root.quit()
+        service_thread.join(10)
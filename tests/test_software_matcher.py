@@ -0,0 +1,47 @@
+"""自动大写软件列表的匹配规则"""
+import logging
+
+import stt_new
+
+
+def test_substring_and_exact_rules():
+    matcher = stt_new.SoftwareMatcher(['CAD', '=notepad.exe'])
+    assert matcher.match('acad.exe', '') == 'CAD'
+    assert matcher.match('explorer.exe', 'drawing - autocad') == 'CAD'
+    assert matcher.match('NOTEPAD.EXE', '') == '=notepad.exe'
+    assert matcher.match('notepad.exe.bak', '') is None
+    # 第二次查询命中缓存
+    assert matcher.match('acad.exe', '') == 'CAD'
+    assert matcher.hits == 1
+
+
+def test_regex_rule_with_inline_flags():
+    matcher = stt_new.SoftwareMatcher(['CAD', 're:(?i)solid.*'])
+    assert matcher.rules == ['CAD', 're:(?i)solid.*']
+    assert matcher.match('SolidWorks.exe', '') == 're:(?i)solid.*'
+
+
+def test_regex_rule_with_named_group():
+    matcher = stt_new.SoftwareMatcher(['CAXA', 're:(?P<r0>draft)sight'])
+    assert matcher.match('draftsight.exe', '') == 're:(?P<r0>draft)sight'
+    assert matcher.match('caxa.exe', '') == 'CAXA'
+
+
+def test_regex_rule_with_backreference():
+    matcher = stt_new.SoftwareMatcher(['CAD', r're:(ab)\1'])
+    assert matcher.match('x.exe', 'ababx') == r're:(ab)\1'
+    assert matcher.match('x.exe', 'abx') is None
+
+
+def test_regex_rules_match_in_order():
+    matcher = stt_new.SoftwareMatcher(['re:^solid', 're:works'])
+    assert matcher.match('solidworks.exe', '') == 're:^solid'
+    assert matcher.match('sldworks.exe', '') == 're:works'
+
+
+def test_invalid_regex_rule_is_skipped(caplog):
+    with caplog.at_level(logging.WARNING):
+        matcher = stt_new.SoftwareMatcher(['re:(unclosed', 'CAD'], logging.getLogger('test_software_matcher'))
+    assert matcher.rules == ['CAD']
+    assert matcher.match('acad.exe', '') == 'CAD'
+    assert '忽略无效的软件匹配规则' in caplog.text
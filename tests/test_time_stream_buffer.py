@@ -0,0 +1,63 @@
+"""时间流缓存的列式环形缓冲区"""
+import pytest
+
+import stt_new
+
+
+def test_append_and_iterate_in_order():
+    buffer = stt_new.TimeStreamBuffer(4)
+    assert len(buffer) == 0 and buffer.last() is None
+    buffer.append('code.exe', 100, 5.0)
+    buffer.append('word.exe', 105, 2.5)
+    assert list(buffer) == [(100, 'code.exe', 5.0), (105, 'word.exe', 2.5)]
+    assert buffer.last() == (105, 'word.exe', 2.5)
+    assert buffer.app_count() == 2
+    assert not buffer.full
+
+
+def test_wraparound_overwrites_oldest():
+    buffer = stt_new.TimeStreamBuffer(3)
+    for k in range(5):
+        buffer.append(f'app{k}.exe', 100 + k, 1.0)
+    assert buffer.full
+    assert buffer.overwritten == 2
+    assert [start_ts for start_ts, _, _ in buffer] == [102, 103, 104]
+    assert [app_name for _, app_name, _ in buffer] == ['app2.exe', 'app3.exe', 'app4.exe']
+    assert buffer.last() == (104, 'app4.exe', 1.0)
+
+
+def test_clear_resets_rows_and_app_names():
+    buffer = stt_new.TimeStreamBuffer(3)
+    buffer.append('code.exe', 100, 1.0)
+    buffer.append('word.exe', 101, 1.0)
+    buffer.clear()
+    assert len(buffer) == 0 and list(buffer) == []
+    assert buffer.app_names == [] and buffer.app_index == {}
+    buffer.append('word.exe', 200, 1.0)
+    assert list(buffer) == [(200, 'word.exe', 1.0)]
+    assert buffer.app_names == ['word.exe']
+
+
+def test_app_names_are_compacted_at_capacity():
+    buffer = stt_new.TimeStreamBuffer(4)
+    for k in range(1000):
+        buffer.append(f'app{k}.exe', k, 1.0)
+        # 程序名表只保留缓冲区中的记录引用的程序名，编号不超过容量
+        assert len(buffer.app_names) <= buffer.capacity + 1
+        assert max(buffer.app_ids) < len(buffer.app_names)
+    assert list(buffer) == [(996, 'app996.exe', 1.0), (997, 'app997.exe', 1.0),
+                            (998, 'app998.exe', 1.0), (999, 'app999.exe', 1.0)]
+
+
+def test_compaction_keeps_shared_names():
+    buffer = stt_new.TimeStreamBuffer(3)
+    for k in range(10):
+        buffer.append('code.exe' if k % 2 else f'tmp{k}.exe', k, 1.0)
+    assert list(buffer) == [(7, 'code.exe', 1.0), (8, 'tmp8.exe', 1.0), (9, 'code.exe', 1.0)]
+    assert len(set(buffer.app_names)) == len(buffer.app_names)
+
+
+@pytest.mark.parametrize('capacity', [0, 32767, 100000])
+def test_capacity_must_fit_int16_app_ids(capacity):
+    with pytest.raises(ValueError):
+        stt_new.TimeStreamBuffer(capacity)
@@ -0,0 +1,143 @@
+"""时间流canvas渲染：整体重新布局和增量更新都不依赖网格覆盖层已存在（无需显示器，可在Linux上运行）"""
+import logging
+import time
+
+import tkinter as tk
+
+import stt_new
+
+
+class StackingCanvas:
+    """
+    只记录图形和堆叠顺序的画布替身，按Tk的规则处理tag_raise/tag_lower：
+    目标tagOrId不匹配任何图形时不报错，aboveThis/belowThis不匹配任何图形时抛出TclError
+    """
+
+    def __init__(self, width=300):
+        self.width = width
+        self.items = {}  # {item_id: (坐标, 选项)}
+        self.order = []  # 从下到上的堆叠顺序
+        self.next_id = 1
+        self.options = {'bg': '#222222'}
+
+    def winfo_width(self):
+        return self.width
+
+    def __getitem__(self, key):
+        return self.options[key]
+
+    def configure(self, **kwargs):
+        self.options.update(kwargs)
+
+    def find_withtag(self, tag_or_id):
+        if isinstance(tag_or_id, int):
+            return (tag_or_id,) if tag_or_id in self.items else ()
+        if tag_or_id == 'all':
+            return tuple(self.order)
+        return tuple(i for i in self.order if tag_or_id in self.items[i][1].get('tags', ()))
+
+    def create_rectangle(self, *coords, **kwargs):
+        item = self.next_id
+        self.next_id += 1
+        self.items[item] = (list(coords), kwargs)
+        self.order.append(item)
+        return item
+
+    def coords(self, item, *coords):
+        if coords:
+            self.items[item] = (list(coords), self.items[item][1])
+        return self.items[item][0]
+
+    def itemconfig(self, tag_or_id, **kwargs):
+        for item in self.find_withtag(tag_or_id):
+            self.items[item][1].update(kwargs)
+
+    def delete(self, *tags):
+        for tag in tags:
+            for item in self.find_withtag(tag):
+                del self.items[item]
+                self.order.remove(item)
+
+    def _relink(self, tag_or_id, reference, above):
+        moving = self.find_withtag(tag_or_id)
+        if reference is None:
+            anchor = None
+        else:
+            matches = self.find_withtag(reference)
+            if not matches:
+                raise tk.TclError(f'tagOrId "{reference}" doesn\'t match any items')
+            anchor = matches[-1] if above else matches[0]
+        rest = [i for i in self.order if i not in moving]
+        if anchor is None:
+            index = len(rest) if above else 0
+        else:
+            index = rest.index(anchor) + (1 if above else 0)
+        self.order = rest[:index] + list(moving) + rest[index:]
+
+    def tag_raise(self, tag_or_id, above_this=None):
+        self._relink(tag_or_id, above_this, above=True)
+
+    def tag_lower(self, tag_or_id, below_this=None):
+        self._relink(tag_or_id, below_this, above=False)
+
+    def tag_unbind(self, tag, sequence):
+        pass
+
+
+def make_checker(tmp_path, monkeypatch, history):
+    """不创建Tk窗口，只初始化时间流渲染用到的状态"""
+    monkeypatch.chdir(tmp_path)
+    checker = stt_new.CapsLockChecker.__new__(stt_new.CapsLockChecker)
+    checker.logger = logging.getLogger('test_time_stream_canvas')
+    checker.config = {'time_stream_renderer': 'canvas'}
+    checker.grid_second_per_block = 30
+    checker.app_display_flags = {}
+    checker.bound_canvas_tags = set()
+    checker.logged_render_data_hashes = set()
+    checker._is_initializing = True
+    checker._init_color_and_rendering_vars()
+    checker.history_canvas = StackingCanvas()
+    checker.time_stream_cache = stt_new.TimeStreamBuffer(64)
+    start_ts = int(time.time()) - 3600
+    for app_name, duration in history:
+        checker.time_stream_cache.append(app_name, start_ts, duration)
+        start_ts += duration
+    checker.current_app_name = 'editor'
+    checker.current_start_time = time.time() - 95
+    checker.get_today_time_stream_from_db = lambda: []
+    return checker
+
+
+def assert_grid_on_top(canvas):
+    runs = canvas.find_withtag('stream_run')
+    grid = canvas.find_withtag('stream_grid')
+    assert runs and grid
+    assert max(canvas.order.index(i) for i in runs) < min(canvas.order.index(i) for i in grid)
+
+
+def test_full_relayout_with_history(tmp_path, monkeypatch):
+    checker = make_checker(tmp_path, monkeypatch, [('browser', 120), ('terminal', 300), ('browser', 60)])
+    checker.render_history_stream()
+    canvas = checker.history_canvas
+    # 每个连续段一个矩形（不是每个方块一个），网格覆盖层在全部连续段上方
+    assert len(canvas.find_withtag('stream_run')) == len(checker.stream_layout['runs']) + len(checker.stream_layout['tail_items'])
+    assert_grid_on_top(canvas)
+
+    # 宽度变化触发整体重新布局：delete("all")之后再次创建连续段
+    canvas.width = 200
+    checker.last_history_hash = None
+    checker.render_history_stream()
+    assert checker.stream_layout['max_cols'] == 40
+    assert_grid_on_top(canvas)
+
+
+def test_incremental_update_keeps_grid_on_top(tmp_path, monkeypatch):
+    checker = make_checker(tmp_path, monkeypatch, [('browser', 120)])
+    checker.render_history_stream()
+    layout = checker.stream_layout
+    checker.time_stream_cache.append('terminal', int(time.time()) - 600, 90)
+    checker.render_history_stream()
+    # 增量更新沿用同一个布局，只追加新的连续段
+    assert checker.stream_layout is layout
+    assert [run[1] for run in layout['runs']] == ['browser', 'terminal']
+    assert_grid_on_top(checker.history_canvas)
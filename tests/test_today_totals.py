@@ -0,0 +1,54 @@
+"""今天各应用使用时长的内存累计值"""
+import pytest
+
+import stt_new
+
+
+def test_add_keeps_ranking_descending():
+    totals = stt_new.TodayTotals(20250101, {'a': 10.0, 'b': 5.0})
+    assert totals.ranked() == [('a', 10.0), ('b', 5.0)]
+    totals.add('c', 7.0)
+    assert totals.ranked() == [('a', 10.0), ('c', 7.0), ('b', 5.0)]
+    totals.add('b', 6.0)
+    assert totals.ranked() == [('b', 11.0), ('a', 10.0), ('c', 7.0)]
+    assert totals.get('b') == 11.0 and totals.get('missing') == 0.0
+    assert len(totals) == 3
+    assert totals.as_dict() == {'a': 10.0, 'b': 11.0, 'c': 7.0}
+
+
+def test_ranked_includes_in_progress_without_changing_totals():
+    totals = stt_new.TodayTotals(20250101, {'a': 10.0, 'b': 5.0})
+    # 合并器暂存的时间段和当前会话可能属于同一程序，也可能是新程序
+    ranked = totals.ranked([('b', 4.0), ('b', 3.0), ('new', 8.0)])
+    assert ranked == [('b', 12.0), ('a', 10.0), ('new', 8.0)]
+    assert totals.ranked() == [('a', 10.0), ('b', 5.0)]
+
+
+def test_reset_on_day_rollover():
+    totals = stt_new.TodayTotals(20250101, {'a': 10.0})
+    totals.reset(20250102)
+    assert totals.day_key == 20250102
+    assert totals.ranked() == [] and len(totals) == 0
+    # 跨越午夜后只有进行中的会话
+    assert totals.ranked([('a', 2.0)]) == [('a', 2.0)]
+    totals.add('b', 1.0)
+    assert totals.ranked([('a', 2.0)]) == [('a', 2.0), ('b', 1.0)]
+
+
+def test_totals_fed_from_coalesced_rows_match_sessions():
+    """与ScreenTimeTracker相同的接法：合并后的记录累加到TodayTotals，暂存的时间段作为进行中的时长"""
+    totals = stt_new.TodayTotals(20250101)
+    coalescer = stt_new.SegmentCoalescer(lambda app_name, start, end: totals.add(app_name, end - start), 1.0)
+    sessions = {}
+    t = 0.0
+    for app_name, duration in [('a', 30), ('b', 0.3), ('a', 20), ('c', 0.5), ('b', 12), ('b', 2), ('a', 0.2), ('c', 40)]:
+        coalescer.add(app_name, t, t + duration)
+        sessions[app_name] = sessions.get(app_name, 0.0) + duration
+        t += duration
+        pending = coalescer.pending
+        in_progress = [(pending[0], pending[2] - pending[1])] if pending else []
+        # 合并只改变短时间段的归属，任何时刻的总时长都与原始会话一致
+        assert sum(seconds for _, seconds in totals.ranked(in_progress)) == pytest.approx(sum(sessions.values()))
+    coalescer.flush()
+    assert sum(seconds for _, seconds in totals.ranked()) == pytest.approx(t)
+    assert [app_name for app_name, _ in totals.ranked()] == ['a', 'c', 'b']
@@ -0,0 +1,100 @@
+"""崩溃保护日志的写入与重放"""
+import logging
+
+import stt_new
+
+
+def make_journal(tmp_path):
+    journal = stt_new.TrackingJournal(str(tmp_path / 'tracking_journal.bin'), logging.getLogger('test_tracking_journal'))
+    journal.start()
+    return journal
+
+
+def reopen(tmp_path):
+    """模拟崩溃后下次启动：不关闭旧对象，直接读取留下的文件"""
+    return stt_new.TrackingJournal(str(tmp_path / 'tracking_journal.bin')).replay()
+
+
+def test_replay_segments_sessions_and_watermark(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.segment('code.exe', 1000, 5.0)
+    journal.segment('浏览器-名称很长很长很长很长很长很长很长很长很长很长.exe', 1005, 3.0)
+    journal.checkpoint('code.exe', 1008.0, 1010.0)
+    journal.checkpoint('code.exe', 1008.0, 1020.0)
+
+    segments, sessions, persisted = reopen(tmp_path)
+    assert segments == [('code.exe', 1000, 5.0),
+                        ('浏览器-名称很长很长很长很长很长很长很长很长很长很长.exe', 1005, 3.0)]
+    # 同一会话只保留最后确认时间
+    assert sessions == [('code.exe', 1008.0, 1020.0)]
+    assert persisted == 0.0
+
+
+def test_sessions_are_clipped_to_watermark(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.checkpoint('code.exe', 1000.0, 1010.0)
+    journal.checkpoint('word.exe', 1010.0, 1030.0)
+    journal.checkpoint('word.exe', 1010.0, 1040.0)
+    # code.exe整段和word.exe的前10秒已提交到数据库
+    journal.persisted(1020.0)
+
+    _, sessions, persisted = reopen(tmp_path)
+    assert persisted == 1020.0
+    assert sessions == [('word.exe', 1020.0, 1040.0)]
+
+
+def test_replay_file_starting_with_watermark(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.persisted(500.0)
+    journal.checkpoint('code.exe', 500.0, 530.0)
+
+    segments, sessions, persisted = reopen(tmp_path)
+    assert segments == []
+    assert sessions == [('code.exe', 500.0, 530.0)]
+    assert persisted == 500.0
+
+
+def test_replay_after_rotate(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.segment('code.exe', 1000, 5.0)
+    journal.checkpoint('code.exe', 1005.0, 1010.0)
+    journal.persisted(1005.0)
+    assert journal.rotate()
+    # 切换后的新文件以水位线记录开头，之后的记录照常重放
+    journal.segment('word.exe', 1020, 2.0)
+    journal.checkpoint('word.exe', 1020.0, 1030.0)
+
+    segments, sessions, persisted = reopen(tmp_path)
+    assert segments == [('code.exe', 1000, 5.0), ('word.exe', 1020, 2.0)]
+    assert sessions == [('code.exe', 1005.0, 1010.0), ('word.exe', 1020.0, 1030.0)]
+    assert persisted == 1005.0
+
+    # 旧文件删除后，新文件本身仍能恢复切换时的会话和水位线
+    journal.discard_old()
+    segments, sessions, persisted = reopen(tmp_path)
+    assert segments == [('word.exe', 1020, 2.0)]
+    assert sessions == [('code.exe', 1005.0, 1010.0), ('word.exe', 1020.0, 1030.0)]
+    assert persisted == 1005.0
+
+
+def test_replay_drops_torn_tail(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.segment('code.exe', 1000, 5.0)
+    journal.checkpoint('code.exe', 1005.0, 1010.0)
+    with open(journal.path, 'ab') as f:
+        f.write(b'\x02' * (journal.RECORD_SIZE // 2))
+
+    segments, sessions, _ = reopen(tmp_path)
+    assert segments == [('code.exe', 1000, 5.0)]
+    assert sessions == [('code.exe', 1005.0, 1010.0)]
+
+
+def test_lock_excludes_second_instance(tmp_path):
+    path = str(tmp_path / 'tracking_journal.bin')
+    first = stt_new.TrackingJournal(path)
+    second = stt_new.TrackingJournal(path)
+    assert first.acquire_lock()
+    assert not second.acquire_lock()
+    first.close()
+    assert second.acquire_lock()
+    second.close()